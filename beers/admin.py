@@ -10,3 +10,6 @@ admin.site.register(models.Contest_Player)
 admin.site.register(models.Unvalidated_Checkin)
 admin.site.register(models.Brewery)
 admin.site.register(models.Contest_Brewery)
+admin.site.register(models.Player_Feed)
+admin.site.register(models.Feed_Job)
+admin.site.register(models.Scrape_Job)
@@ -3,6 +3,7 @@ from beers import models
 from django.contrib.auth.models import User
 from rest_framework import serializers, validators
 from rest_framework.reverse import reverse
+import beers.utils.untappd as untappd
 
 logger = logging.getLogger(__name__)
 
@@ -192,14 +193,20 @@ class ContestBeerSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         contest = validated_data['contest']
+        untappd_url = validated_data['beer'].get('untappd_url')
         beer = None
-        beer_filter = models.Beer.objects.filter(
-                name=validated_data['beer']['name'],
-                brewery=validated_data['beer']['brewery'])
-        if beer_filter.exists():
-            beer = beer_filter.get()
-        else:
-            beer = models.Beer.objects.create_beer(**validated_data['beer'])
+        if untappd_url:
+            validated_data['beer']['untappd_url'] = untappd.canonical_url(untappd_url)
+            beer = models.Beer.objects.for_untappd_url(
+                    untappd_url, validated_data['beer']['untappd_url'])
+        if beer is None:
+            beer_filter = models.Beer.objects.filter(
+                    name=validated_data['beer']['name'],
+                    brewery=validated_data['beer']['brewery'])
+            if beer_filter.exists():
+                beer = beer_filter.get()
+            else:
+                beer = models.Beer.objects.create_beer(**validated_data['beer'])
         if 'challenger' in validated_data:
             key_names = ['point_value', 'challenge_point_value', 
                          'challenge_point_loss', 'max_point_loss']
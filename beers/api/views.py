@@ -8,12 +8,15 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.reverse import reverse
 from rest_framework import status, generics, permissions, serializers
 from beers.api.serializers import PlayerSerializer, ContestSerializer, \
                                   ContestBrewerySerializer, ContestBonusSerializer, \
                                   ContestBeerSerializer, ContestPlayerSerializer, \
                                   UnvalidatedCheckinSerializer
 import beers.utils.untappd as untappd
+from beers.utils.checkin import submit_checkin_urls, CREATED, \
+                                parse_assignment, validate_checkins, VALIDATED
 
 logger = logging.getLogger(__name__)
 
@@ -143,7 +146,9 @@ class ContestBeerList(generics.ListCreateAPIView):
             if models.Contest_Beer.objects.filter(beer=beer, contest=contest).exists():
                 raise serializers.ValidationError(
                         {'non_field_errors': ['Duplicate beer/contest pairing']})
-        serializer.save(contest=contest)
+        contest_beer = serializer.save(contest=contest)
+        models.Unvalidated_Checkin.objects.find_possible_matches(
+            contest.id, contest_beers=[contest_beer.id])
 
     def get_queryset(self):
         contest_id = self.kwargs['contest_id']
@@ -195,7 +200,9 @@ class ContestBreweryList(generics.ListCreateAPIView):
                         brewery=brewery, contest=contest).exists():
                 raise serializers.ValidationError(
                         {'non_field_errors': ['Duplicate brewery/contest pairing']})
-        serializer.save(contest=contest)
+        contest_brewery = serializer.save(contest=contest)
+        models.Unvalidated_Checkin.objects.find_possible_matches(
+            contest.id, contest_breweries=[contest_brewery.id])
 
     def get_queryset(self):
         contest_id = self.kwargs['contest_id']
@@ -254,8 +261,13 @@ class ContestBonusDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsContestRunnerPermission,)
 
+    def perform_update(self, serializer):
+        contest_bonus = serializer.save()
+        models.Contest_Bonus.objects.invalidate_tag_index(contest_bonus.contest_id)
+
     def perform_destroy(self, contest_bonus):
         contest_bonus.delete()
+        models.Contest_Bonus.objects.invalidate_tag_index(contest_bonus.contest_id)
         
     def get_object(self):
         contest_id = self.kwargs['contest_id']
@@ -265,45 +277,110 @@ class ContestBonusDetail(generics.RetrieveUpdateDestroyAPIView):
                                           id = contest_bonus_id,)
         return contest_bonus
 
+def beer_lookup_data(beer):
+    """The fields of a beer returned by a lookup"""
+    return {'name': beer.name,
+            'brewery': beer.brewery,
+            'style': beer.style,
+            'untappd_url': beer.untappd_url,
+            'brewery_url': beer.brewery_url,
+           }
+
+def brewery_lookup_data(brewery):
+    """The fields of a brewery returned by a lookup"""
+    return {'name': brewery.name,
+            'untappd_url': brewery.untappd_url,
+            'location': brewery.location,
+           }
+
+def scrape_job_data(job, request):
+    """
+    Describes a Scrape_Job for clients polling it. Once it's done, result
+    has what the matching endpoint would have returned without the job;
+    if it failed, errors has the validation errors.
+    """
+    data = {'id': job.id,
+            'kind': job.get_kind_display().lower(),
+            'untappd_url': job.url,
+            'status': job.get_status_display().lower(),
+            'url': reverse('scrape-job-detail', kwargs={'job_id': job.id},
+                           request=request),
+           }
+    if job.is_expired():
+        # Shown as the failure that the next worker's claim records, so
+        # polling doesn't have to write it
+        job.status = models.Scrape_Job.FAILED
+        job.error = models.Scrape_Job.expired_outcome()['error']
+        data['status'] = job.get_status_display().lower()
+    if job.status == models.Scrape_Job.DONE:
+        if job.kind == models.Scrape_Job.CHECKIN:
+            checkin = get_object_or_404(models.Unvalidated_Checkin, id=job.object_id)
+            data['result'] = UnvalidatedCheckinSerializer(
+                    checkin, context={'request': request}).data
+        elif job.kind == models.Scrape_Job.BEER:
+            data['result'] = beer_lookup_data(
+                    get_object_or_404(models.Beer, id=job.object_id))
+        else:
+            data['result'] = brewery_lookup_data(
+                    get_object_or_404(models.Brewery, id=job.object_id))
+    elif job.status == models.Scrape_Job.FAILED:
+        data['errors'] = {'non_field_errors': [job.error]}
+    return data
+
+def scrape_job_response(job, request):
+    """A 202 Accepted response pointing at a queued Scrape_Job"""
+    data = scrape_job_data(job, request)
+    return Response(data, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': data['url']})
+
 class BeerLookup(APIView):
     """Looking up beer data from Untappd from URL"""
 
     def get(self, request, format=None):
-        """Retrieves beer info based on URL"""
+        """
+        Retrieves beer info based on URL, from the database if it's there,
+        or otherwise by queueing a job to scrape it
+        """
         if 'url' not in request.query_params:
             raise serializers.ValidationError(
                     {'non_field_errors': ['No URL provided']})
-        try:
-            beer = untappd.parse_beer(request.query_params['url'])
-            logger.info('Looking up beer at URL: %s', request.query_params['url'])
-            beer_object = {'name': beer.name,
-                           'brewery': beer.brewery,
-                           'style': beer.style,
-                           'untappd_url': beer.untappd_url,
-                           'brewery_url': beer.brewery_url,
-                          }
-            return Response(beer_object)
-        except untappd.UntappdParseException as e:
-            raise serializers.ValidationError({'non_field_errors': ['{}'.format(e)]})
+        logger.info('Looking up beer at URL: %s', request.query_params['url'])
+        beer = untappd.stored_beer(request.query_params['url'])
+        if beer is not None:
+            return Response(beer_lookup_data(beer))
+        job = models.Scrape_Job.objects.enqueue(models.Scrape_Job.BEER,
+                                                request.query_params['url'])
+        return scrape_job_response(job, request)
 
 class BreweryLookup(APIView):
     """Looking up brewery data from Untappd from URL"""
 
     def get(self, request, format=None):
-        """Retrieves beer info based on URL"""
+        """
+        Retrieves brewery info based on URL, from the database if it's
+        there, or otherwise by queueing a job to scrape it
+        """
         if 'url' not in request.query_params:
             raise serializers.ValidationError(
                     {'non_field_errors': ['No URL provided']})
-        try:
-            brewery = untappd.parse_brewery(request.query_params['url'])
-            logger.info('Looking up brewery at URL: %s', request.query_params['url'])
-            brewery_object = {'name': brewery.name,
-                              'untappd_url': brewery.untappd_url,
-                              'location': brewery.location,
-                             }
-            return Response(brewery_object)
-        except untappd.UntappdParseException as e:
-            raise serializers.ValidationError({'non_field_errors': ['{}'.format(e)]})
+        logger.info('Looking up brewery at URL: %s', request.query_params['url'])
+        brewery = untappd.stored_brewery(request.query_params['url'])
+        if brewery is not None:
+            return Response(brewery_lookup_data(brewery))
+        job = models.Scrape_Job.objects.enqueue(models.Scrape_Job.BREWERY,
+                                                request.query_params['url'])
+        return scrape_job_response(job, request)
+
+class ScrapeJobDetail(APIView):
+    """The state of a queued Untappd scrape, for clients to poll"""
+
+    def get(self, request, job_id, format=None):
+        """
+        Retrieves the job, with its result once it's done. A job whose
+        worker has died shows as failed once it has run past its lease.
+        """
+        job = get_object_or_404(models.Scrape_Job, id=job_id)
+        return Response(scrape_job_data(job, request))
 
 class UnvalidatedCheckinPaginator(LimitOffsetPagination):
     default_limit = 25
@@ -343,20 +420,20 @@ class UnvalidatedCheckinList(generics.ListCreateAPIView):
         sort_field = UnvalidatedCheckinList.sort_mapping.get(sort, 'untappd_checkin_date')
         return checkins.order_by(modifier + sort_field)
 
-    def perform_create(self, serializer):
+    def create(self, request, *args, **kwargs):
         """
-        Creates a Unvalidated Checkin from the URL being passed in as `untappd_checkin`
+        Queues a job to add the Unvalidated Checkin from the URL being passed
+        in as `untappd_checkin`, returning 202 Accepted with the job
         """
-        logger.info("Entering perform_create")
         contest_id = self.kwargs['contest_id']
-
-        untappd_url = self.request.data.get('untappd_checkin', None)
-        logger.info("Attempting perform_create on %s", untappd_url)
+        untappd_url = request.data.get('untappd_checkin', None)
+        logger.info("Attempting create on %s", untappd_url)
         if untappd_url is None:
             logger.warning("No 'untappd_checkin' passed into create")
             raise serializers.ValidationError(
                 {'untappd_checkin': "Untappd checkin URL required'"}
             )
+        contest = get_object_or_404(models.Contest, id=contest_id)
         if models.Unvalidated_Checkin.objects.filter(
                                             contest_player__contest_id=contest_id, 
                                             untappd_checkin=untappd_url).count() > 0:
@@ -365,30 +442,100 @@ class UnvalidatedCheckinList(generics.ListCreateAPIView):
             raise serializers.ValidationError(
                 {'untappd_checkin': "Untappd checkin URL already in validation list'"}
             )
-        try:
-            uv = untappd.parse_checkin(untappd_url)
-            player = models.Contest_Player.objects.get(contest_id=contest_id, 
-                                                       player__untappd_username=uv.untappd_user)
-            serializer.save(contest_player=player,
-                            untappd_title=uv.untappd_title,
-                            untappd_checkin=uv.untappd_checkin,
-                            untappd_checkin_date=uv.untappd_checkin_date,
-                            brewery=uv.brewery,
-                            beer=uv.beer,
-                            brewery_url=uv.brewery_url,
-                            beer_url=uv.beer_url,
-                            photo_url=uv.photo_url,)
-            logger.info('Saved unvalidated checkin at url: {}'.format(uv.untappd_checkin))
-        except untappd.UntappdParseException as e:
-            logger.warning("Bad Untappd parse at %s: %s", untappd_url, e)
-            raise serializers.ValidationError({'non_field_errors': ["{}".format(e)]})
-        except models.Contest_Player.DoesNotExist as e:
-            logger.warning("Untappd user %s is not part of contest %i", 
-                           uv.untappd_user, contest_id)
-            raise serializers.ValidationError(
-                {'non_field_errors': ["Can't link Untappd user {} to contest {}".format(
-                            uv.untappd_user, contest_id)]})
+        job = models.Scrape_Job.objects.enqueue(models.Scrape_Job.CHECKIN,
+                                                untappd_url, contest=contest)
+        logger.info('Queued scrape job %s for checkin at url: %s', job.id, untappd_url)
+        return scrape_job_response(job, request)
     
+class UnvalidatedCheckinBulkCreate(APIView):
+    """
+    Adds many Untappd checkins to a contest's unvalidated checkins at once,
+    from the list of URLs passed in as `untappd_checkins`. The pages are
+    scraped within the request, so the number of URLs is kept to what the
+    Untappd rate limit gets through well inside the web worker's timeout;
+    the add_checkins command takes longer lists.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,
+                          IsContestRunnerPermission,)
+    max_urls = 50
+
+    def post(self, request, contest_id, format=None):
+        """
+        Parses the checkins concurrently and returns the result for each
+        URL, in the order given
+        """
+        get_object_or_404(models.Contest, id=contest_id)
+        urls = None
+        if isinstance(request.data, dict):
+            urls = request.data.get('untappd_checkins', None)
+        if not isinstance(urls, list) or len(urls) == 0 \
+                or not all(isinstance(url, str) for url in urls):
+            raise serializers.ValidationError(
+                {'untappd_checkins': ['A list of Untappd checkin URLs is required']})
+        if len(urls) > self.max_urls:
+            raise serializers.ValidationError(
+                {'untappd_checkins': ['At most {} URLs can be added at once'.format(
+                    self.max_urls)]})
+        urls = [url.strip() for url in urls]
+        results = submit_checkin_urls(contest_id, urls)
+        created = [result.checkin for result in results if result.status == CREATED]
+        logger.info('Bulk added %s of %s checkins to contest %s',
+                    len(created), len(urls), contest_id)
+        return Response({
+            'created': len(created),
+            'results': [{'untappd_checkin': result.url,
+                         'status': result.status,
+                         'error': result.error,
+                         'id': result.checkin.id if result.checkin else None,
+                         'url': reverse('unvalidated-checkin-detail',
+                                        kwargs={'id': result.checkin.id},
+                                        request=request)
+                                if result.checkin else None}
+                        for result in results],
+        })
+
+class CheckinBatchValidate(APIView):
+    """
+    Validates many of a contest's unvalidated checkins at once, from the
+    list passed in as `checkins`. Each item takes the same form as the body
+    of a single validation: `checkin`, optionally `as_beer` or `as_brewery`,
+    `bonuses` and `preserve`.
+    """
+    permission_classes = (permissions.IsAuthenticated,
+                          IsContestRunnerPermission,)
+    max_checkins = 500
+
+    def post(self, request, contest_id, format=None):
+        """
+        Scores the checkins in one transaction and returns the result for
+        each item, in the order given
+        """
+        contest = get_object_or_404(models.Contest, id=contest_id)
+        self.check_object_permissions(request, contest)
+        items = None
+        if isinstance(request.data, dict):
+            items = request.data.get('checkins', None)
+        if not isinstance(items, list) or len(items) == 0:
+            raise serializers.ValidationError(
+                {'checkins': ['A list of checkins to validate is required']})
+        if len(items) > self.max_checkins:
+            raise serializers.ValidationError(
+                {'checkins': ['At most {} checkins can be validated at once'.format(
+                    self.max_checkins)]})
+        results = validate_checkins(contest.id,
+                                    [parse_assignment(item) for item in items])
+        validated = [result for result in results if result.status == VALIDATED]
+        logger.info('Batch validated %s of %s checkins for contest %s',
+                    len(validated), len(items), contest_id)
+        return Response({
+            'validated': len(validated),
+            'results': [{'checkin': result.checkin_id,
+                         'status': result.status,
+                         'error': result.error,
+                         'points': result.points}
+                        for result in results],
+        })
+
 class UnvalidatedCheckinDetail(generics.RetrieveDestroyAPIView):
     """
     Provides detail for a single Unvalidated Checkin
@@ -0,0 +1,59 @@
+"""The loop shared by the commands that run queued jobs"""
+
+import os
+import socket
+import time
+from django.core.management.base import BaseCommand
+from beers.management.commands.load_checkins import positive_int
+
+
+class WorkerCommand(BaseCommand):
+    """
+    A command which claims jobs from a queue and runs them. Any number of
+    workers can run at once; each job is only claimed by one of them.
+    Subclasses set the job model, a name for its jobs in the output, how
+    long to wait when the queue is empty, and run the jobs.
+    """
+
+    job_model = None
+    job_name = 'jobs'
+    default_sleep = 5
+
+    def add_arguments(self, parser):
+        """There are three optional arguments for the command:
+           --name: the name recorded on the jobs, defaulting to host:pid
+           --sleep: The number of seconds to wait when the queue is empty
+           --exit-when-empty: Stop once there are no pending jobs
+        """
+        parser.add_argument('--name', nargs=1, help='Worker name')
+        parser.add_argument('--sleep', nargs=1, type=positive_int,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--exit-when-empty', action='store_true',
+                            help='Stop once there are no pending jobs')
+
+    def run_job(self, job):
+        """Runs a claimed job and records its outcome on it"""
+        raise NotImplementedError
+
+    def handle(self, *args, **opts):
+        """Runs jobs until interrupted, or until the queue is empty"""
+        name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        if 'name' in opts and opts['name']:
+            name = opts['name'][0]
+        sleep = self.default_sleep
+        if 'sleep' in opts and opts['sleep']:
+            sleep = opts['sleep'][0]
+        count = 0
+        try:
+            while True:
+                job = self.job_model.objects.claim(name)
+                if job is None:
+                    if opts['exit_when_empty']:
+                        break
+                    time.sleep(sleep)
+                    continue
+                self.run_job(job)
+                count += 1
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('{} ran {} {}'.format(name, count, self.job_name))
@@ -0,0 +1,67 @@
+"""Command that adds a list of Untappd checkins to a contest for validation"""
+
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from beers.models import Contest
+from beers.utils.checkin import submit_checkin_urls, CREATED
+from beers.management.commands.load_checkins import positive_int
+
+
+class Command(BaseCommand):
+    """
+    A command which parses the Untappd checkins at the given URLs
+    concurrently and adds them to a contest's unvalidated checkins,
+    reporting the result for each URL
+    """
+
+    help = 'Adds Untappd checkins to a contest for validation'
+
+    def add_arguments(self, parser):
+        """There are two optional arguments for the command:
+           --file: a file of checkin URLs, one per line, or - for stdin
+           --concurrency: the number of pages parsed at once
+        """
+        parser.add_argument('contest_id', nargs=1, help='Contest ID', type=int)
+        parser.add_argument('untappd_urls', nargs='*',
+                            help='Untappd URLs of the checkins')
+        parser.add_argument('--file', nargs=1, help='File of checkin URLs')
+        parser.add_argument('--concurrency', nargs=1, type=positive_int,
+                            help='Pages parsed at once')
+
+    def handle(self, *args, **opts):
+        """Adds the checkins and prints the result for each URL"""
+        contest_id = opts['contest_id'][0]
+        if not Contest.objects.filter(id=contest_id).exists():
+            raise CommandError(('Error: add_checkins got a contest that'
+                                + ' did not exist: {}').format(contest_id))
+        urls = list(opts['untappd_urls'])
+        if 'file' in opts and opts['file']:
+            urls.extend(self.read_urls(opts['file'][0]))
+        if not urls:
+            raise CommandError('Error: no checkin URLs were given')
+        concurrency = None
+        if 'concurrency' in opts and opts['concurrency']:
+            concurrency = opts['concurrency'][0]
+        results = submit_checkin_urls(contest_id, urls, concurrency=concurrency)
+        for result in results:
+            if result.status == CREATED:
+                self.stdout.write('{}: {} (id {})'.format(
+                    result.url, result.status, result.checkin.id))
+            else:
+                self.stdout.write('{}: {}: {}'.format(
+                    result.url, result.status, result.error))
+        created = len([result for result in results if result.status == CREATED])
+        self.stdout.write('Added {} of {} checkins'.format(created, len(results)))
+
+    @staticmethod
+    def read_urls(name):
+        """Returns the non-blank lines of a file, or stdin for -"""
+        try:
+            if name == '-':
+                lines = sys.stdin.readlines()
+            else:
+                with open(name) as stream:
+                    lines = stream.readlines()
+        except OSError as exc:
+            raise CommandError('Error: unable to read {}: {}'.format(name, exc))
+        return [line.strip() for line in lines if line.strip()]
@@ -0,0 +1,51 @@
+"""Command that checks the players' scores against their contest checkins"""
+
+from django.core.management.base import BaseCommand, CommandError
+from beers.models import Contest
+from beers.utils.audit import audit_scores, DEFAULT_CHUNK_SIZE
+from beers.management.commands.load_checkins import positive_int
+
+
+class Command(BaseCommand):
+    """
+    A command which reads the contest checkins in chunks, without locking
+    anything, and reports the players whose stored scores don't add up to
+    their checkins. It is meant to be run regularly; recompute_scores
+    fixes the players it reports.
+    """
+
+    help = "Reports players whose scores don't match their checkins"
+
+    def add_arguments(self, parser):
+        """There are two optional arguments for the command:
+           --contest: Only audit the contest with this ID
+           --chunk-size: The number of rows read per query
+        """
+        parser.add_argument('--contest', nargs=1, type=int, help='Contest ID')
+        parser.add_argument('--chunk-size', nargs=1, type=positive_int,
+                            help='Rows read per query, default {}'.format(
+                                DEFAULT_CHUNK_SIZE))
+
+    def handle(self, *args, **opts):
+        """Runs the audit and prints each mismatched player"""
+        contest_id = None
+        if 'contest' in opts and opts['contest']:
+            contest_id = opts['contest'][0]
+            if not Contest.objects.filter(id=contest_id).exists():
+                raise CommandError(('Error: audit_scores got a contest that'
+                                    + ' did not exist: {}').format(contest_id))
+        chunk_size = DEFAULT_CHUNK_SIZE
+        if 'chunk_size' in opts and opts['chunk_size']:
+            chunk_size = opts['chunk_size'][0]
+        result = audit_scores(contest_id, chunk_size=chunk_size)
+        for drift in result.mismatches:
+            self.stdout.write('contest {} {}: {}'.format(
+                drift.contest_player.contest_id,
+                drift.contest_player.user_name,
+                ', '.join('{} {} != {}'.format(field, stored, computed)
+                          for field, (stored, computed)
+                          in sorted(drift.changes.items()))))
+        self.stdout.write(
+            'Audited {} checkins of {} players in {} queries: {} mismatched'.format(
+                result.checkins, result.players, result.chunks,
+                len(result.mismatches)))
@@ -0,0 +1,20 @@
+"""Command that runs queued feed jobs"""
+
+from beers.models import Feed_Job
+from beers.utils.checkin import run_feed_job
+from beers.management.commands._worker import WorkerCommand
+
+
+class Command(WorkerCommand):
+    """
+    A command which claims feed jobs from the queue and loads the checkins
+    for them
+    """
+
+    help = 'Runs queued feed jobs'
+    job_model = Feed_Job
+    job_name = 'feed jobs'
+
+    def run_job(self, job):
+        """Loads the checkins for the job's player"""
+        run_feed_job(job)
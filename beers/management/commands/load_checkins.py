@@ -1,13 +1,31 @@
 """Command that will load checkins for a user"""
 
 import argparse
+import json
+import time
 from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from beers.models import Player, Contest
+from beers.models import Player, Contest, Contest_Player, Contest_Bonus, \
+                         Unvalidated_Checkin
 from beers.utils.checkin import load_player_checkins
+from beers.utils.feeds import fetch_feeds, FeedStats, FeedSource
+from beers.utils.metrics import RunMetrics
+from beers.utils.locks import advisory_lock, LOADER_RUN
 from dateutil.parser import parse as date_parse
 
 
+def positive_int(arg):
+    "Converts a string to an integer that is at least 1"
+    try:
+        value = int(arg)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError(('Error: expected a positive '
+                                          + 'integer: {}').format(arg))
+    return value
+
+
 def convert_to_date(arg):
     "Converts a string to a timezone aware date"
     try:
@@ -21,34 +39,53 @@ def convert_to_date(arg):
 class Command(BaseCommand):
     """
     A command which loads checkins for a player or many players for a
-    given contest.
+    given contest. Without a contest, only contests that are running, see
+    running_contests, are loaded. Only one run loads at a time, using a Postgres advisory
+    lock, and players being loaded by the poller or a worker are skipped.
     """
 
     help = 'Loads checkins across contests'
 
     def add_arguments(self, parser):
-        """There are three optional arguments for the command:
+        """There are eight optional arguments for the command:
            --player: the user name of the player
            --contest: the Contest ID
            --after-date: The date after which to filter the results
+           --concurrency: The number of feeds to download at once
+           --source: A directory or archive of saved <username>.xml feeds
+                     to load instead of downloading them
+           --deadline: The number of seconds after which no more feeds are
+                       downloaded
+           --report: Print the run's metrics as a table or as JSON
+           --wait: Wait for another run to finish rather than skipping
         """
         parser.add_argument('--player', nargs=1, help='Player')
         parser.add_argument('--contest', nargs=1, help='Contest ID', type=int)
         parser.add_argument('--after-date', nargs=1, help='After date',
                             type=convert_to_date)
+        parser.add_argument('--concurrency', nargs=1, type=positive_int,
+                            help='Number of feeds to download at once')
+        parser.add_argument('--source', nargs=1,
+                            help='Directory or archive of saved feeds')
+        parser.add_argument('--deadline', nargs=1, type=positive_int,
+                            help='Seconds after which no more feeds are downloaded')
+        parser.add_argument('--report', nargs=1, choices=['table', 'json'],
+                            help='Print timings and counts for the run')
+        parser.add_argument('--wait', action='store_true',
+                            help='Wait for a run in progress instead of skipping')
 
     def handle(self, *args, **opts):
         """
         Primarily calls load_player_checkins with the right arguments
         """
-        players = Player.objects.all()
+        username = None
         contest_id = None
         after_date = None
         if 'player' in opts and opts['player']:
-            players = players.filter(user__username=opts['player'][0])
-            if players.count() == 0:
+            username = opts['player'][0]
+            if not Player.objects.filter(user__username=username).exists():
                 raise CommandError(('Error: no such player: '
-                                    + '{}').format(opts['player'][0]))
+                                    + '{}').format(username))
         if 'contest' in opts and opts['contest']:
             try:
                 contest_id = opts['contest'][0]
@@ -58,6 +95,97 @@ class Command(BaseCommand):
                                     + ' did not exist: {}').format(contest_id))
         if 'after_date' in opts and opts['after_date']:
             after_date = opts['after_date'][0]
-        for player in players:
-            load_player_checkins(player, from_date=after_date,
-                                 contest_id=contest_id)
+        concurrency = None
+        if 'concurrency' in opts and opts['concurrency']:
+            concurrency = opts['concurrency'][0]
+        deadline = None
+        if 'deadline' in opts and opts['deadline']:
+            deadline = time.monotonic() + opts['deadline'][0]
+        source = None
+        if 'source' in opts and opts['source']:
+            try:
+                source = FeedSource(opts['source'][0])
+            except ValueError as exc:
+                raise CommandError('Error: {}'.format(exc))
+        # Only download the feeds of players who can have checkins loaded.
+        # Saved feeds are found by user name, with or without an RSS URL
+        contest_players = Contest_Player.objects.loadable(
+            timezone.now(), contest_id=contest_id, require_feed=source is None)
+        if username is not None:
+            contest_players = contest_players.filter(
+                player__user__username=username)
+        # Unchanged feeds can only be skipped when loading every contest from
+        # each player's last load
+        conditional = contest_id is None and after_date is None \
+                      and source is None
+        report = None
+        if 'report' in opts and opts['report']:
+            report = opts['report'][0]
+        stats = FeedStats()
+        metrics = RunMetrics()
+        run_start = time.perf_counter()
+        with advisory_lock(LOADER_RUN, wait=opts['wait']) as acquired:
+            metrics.add_time('lock', time.perf_counter() - run_start)
+            if acquired:
+                self.load(contest_players, stats, metrics, contest_id=contest_id,
+                          after_date=after_date, concurrency=concurrency,
+                          conditional=conditional, source=source,
+                          deadline=deadline)
+        metrics.add_time('total', time.perf_counter() - run_start)
+        if acquired:
+            self.write_report(stats, metrics, report, str(stats))
+        else:
+            metrics.run_skipped = True
+            self.write_report(stats, metrics, report,
+                              'Skipping: another load_checkins run is in progress')
+
+    def load(self, contest_players, stats, metrics, contest_id=None,
+             after_date=None, concurrency=None, conditional=True, source=None,
+             deadline=None):
+        """
+        Loads the checkins of the contest players, counting the feeds in
+        stats and the timings and entries in metrics
+        """
+        players = []
+        loadable = {}
+        with metrics.phase('select'):
+            # The rows are ordered by player, and streamed rather than cached
+            for contest_player in contest_players.iterator():
+                if contest_player.player_id not in loadable:
+                    players.append(contest_player.player)
+                    loadable[contest_player.player_id] = []
+                loadable[contest_player.player_id].append(contest_player)
+        # Bonuses are read once per run and shared by every player's load
+        Contest_Bonus.objects.invalidate_tag_index()
+        contests = set()
+        # The time spent waiting for the next feed is the fetch phase
+        feeds = metrics.timed('fetch', fetch_feeds(
+            players, concurrency=concurrency, conditional=conditional,
+            stats=stats, source=source, deadline=deadline, lock_players=True))
+        for player, feed in feeds:
+            if feed is not None:
+                metrics.add_feed(player, feed)
+            new_checkins = load_player_checkins(player, from_date=after_date,
+                                                contest_id=contest_id, feed=feed,
+                                                find_matches=False,
+                                                record_feed=source is None,
+                                                metrics=metrics,
+                                                contest_players=loadable[player.id])
+            contests.update(uv.contest_player.contest_id for uv in new_checkins)
+        # Possible matches are found once per contest rather than per player
+        with metrics.phase('match'):
+            for match_contest_id in sorted(contests):
+                Unvalidated_Checkin.objects.find_possible_matches(match_contest_id)
+
+    def write_report(self, stats, metrics, report, summary):
+        """Prints the summary of the run, or its report if one was asked for"""
+        if report == 'json':
+            # Nothing else is printed so the output can be piped to a parser
+            self.stdout.write(json.dumps(metrics.as_dict(stats), indent=2))
+            return
+        self.stdout.write(summary)
+        for line in stats.details():
+            self.stdout.write(line)
+        if report == 'table':
+            for line in metrics.as_table():
+                self.stdout.write(line)
@@ -0,0 +1,94 @@
+"""Command that keeps polling player feeds for new checkins"""
+
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from beers.models import Player, Player_Feed, Contest_Bonus, Contest_Player, \
+                         Unvalidated_Checkin
+from beers.utils.checkin import load_player_checkins
+from beers.utils.feeds import fetch_feeds, FeedStats, FAILED, LOCKED
+from beers.management.commands.load_checkins import positive_int
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    A command which runs continuously, loading the checkins of players in
+    running contests whenever their feed is due. Each player's next poll
+    time is kept in Player_Feed so the schedule survives restarts.
+    """
+
+    help = 'Polls player feeds for checkins, backing off for idle players'
+
+    def add_arguments(self, parser):
+        """There are three optional arguments for the command:
+           --concurrency: The number of feeds to download at once
+           --sleep: The number of seconds to wait between polls
+           --once: Poll the players that are due and then exit
+        """
+        parser.add_argument('--concurrency', nargs=1, type=positive_int,
+                            help='Number of feeds to download at once')
+        parser.add_argument('--sleep', nargs=1, type=positive_int,
+                            help='Seconds to wait between polls')
+        parser.add_argument('--once', action='store_true',
+                            help='Poll the players that are due and exit')
+
+    def poll(self, concurrency=None):
+        """
+        Loads the checkins of every player who is due, reschedules them, and
+        returns the FeedStats for the poll
+        """
+        now = timezone.now()
+        players = list(Player.objects.due_for_poll(now).select_related('user'))
+        # Checkins are only loaded into the contests that are running
+        loadable = {player.id: [] for player in players}
+        for contest_player in Contest_Player.objects.loadable(now).filter(
+                player__in=players):
+            loadable[contest_player.player_id].append(contest_player)
+        stats = FeedStats()
+        Contest_Bonus.objects.invalidate_tag_index()
+        contests = set()
+        for player, feed in fetch_feeds(players, concurrency=concurrency,
+                                        stats=stats, lock_players=True):
+            if feed is not None and feed.status == LOCKED:
+                # Another run is loading the player, who stays due and is
+                # polled again next time
+                continue
+            new_checkins = []
+            try:
+                new_checkins = load_player_checkins(
+                    player, feed=feed, find_matches=False,
+                    contest_players=loadable[player.id])
+            except Exception:
+                # One bad feed shouldn't stop the poller; the player backs
+                # off like an idle one
+                logger.exception('Unable to load checkins for %s',
+                                 player.user.username)
+            contests.update(uv.contest_player.contest_id for uv in new_checkins)
+            Player_Feed.objects.schedule(player, len(new_checkins) > 0, now)
+        for contest_id in sorted(contests):
+            Unvalidated_Checkin.objects.find_possible_matches(contest_id)
+        return stats
+
+    def handle(self, *args, **opts):
+        """Polls until interrupted, or once if --once is given"""
+        concurrency = None
+        if 'concurrency' in opts and opts['concurrency']:
+            concurrency = opts['concurrency'][0]
+        sleep = 60
+        if 'sleep' in opts and opts['sleep']:
+            sleep = opts['sleep'][0]
+        try:
+            while True:
+                stats = self.poll(concurrency)
+                if stats.hits + stats.misses + stats.counts[FAILED] > 0:
+                    self.stdout.write(str(stats))
+                    for line in stats.details():
+                        self.stdout.write(line)
+                if opts['once']:
+                    break
+                time.sleep(sleep)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping')
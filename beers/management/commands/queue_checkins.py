@@ -0,0 +1,41 @@
+"""Command that queues feed jobs for the checkin workers"""
+
+from django.core.management.base import BaseCommand, CommandError
+from beers.models import Player, Contest, Feed_Job
+
+
+class Command(BaseCommand):
+    """
+    A command which queues a feed job for every player with a feed in a
+    contest, or for a single player or contest, to be run by checkin_worker
+    """
+
+    help = 'Queues feed jobs for the checkin workers'
+
+    def add_arguments(self, parser):
+        """There are two optional arguments for the command:
+           --player: the user name of the player
+           --contest: the Contest ID
+        """
+        parser.add_argument('--player', nargs=1, help='Player')
+        parser.add_argument('--contest', nargs=1, help='Contest ID', type=int)
+
+    def handle(self, *args, **opts):
+        """Queues the jobs and reports how many were added"""
+        players = Player.objects.exclude(untappd_rss__isnull=True) \
+                                .exclude(untappd_rss='')
+        if 'player' in opts and opts['player']:
+            players = players.filter(user__username=opts['player'][0])
+            if players.count() == 0:
+                raise CommandError(('Error: no such player: '
+                                    + '{}').format(opts['player'][0]))
+        if 'contest' in opts and opts['contest']:
+            contest_id = opts['contest'][0]
+            if not Contest.objects.filter(id=contest_id).exists():
+                raise CommandError(('Error: queue_checkins got a contest that'
+                                    + ' did not exist: {}').format(contest_id))
+            players = players.filter(contest_player__contest_id=contest_id)
+        else:
+            players = players.filter(contest_player__isnull=False)
+        jobs = Feed_Job.objects.enqueue(list(players.distinct()))
+        self.stdout.write('Queued {} feed jobs'.format(len(jobs)))
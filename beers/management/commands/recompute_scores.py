@@ -0,0 +1,39 @@
+"""Command that rebuilds the scores of a contest's players from their checkins"""
+
+from django.core.management.base import BaseCommand, CommandError
+from beers.models import Contest, Contest_Player
+
+
+class Command(BaseCommand):
+    """
+    A command which recomputes every player's points and beer count in a
+    contest from the contest checkins, and reports the players whose stored
+    scores had drifted from them
+    """
+
+    help = "Recomputes the scores of a contest's players"
+
+    def add_arguments(self, parser):
+        """There is one optional argument for the command:
+           --dry-run: Only report the drifted players, without saving them
+        """
+        parser.add_argument('contest_id', nargs=1, help='Contest ID', type=int)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the drift without saving the scores')
+
+    def handle(self, *args, **opts):
+        """Recomputes the scores and prints the changes for each player"""
+        contest_id = opts['contest_id'][0]
+        if not Contest.objects.filter(id=contest_id).exists():
+            raise CommandError(('Error: recompute_scores got a contest that'
+                                + ' did not exist: {}').format(contest_id))
+        drifted = Contest_Player.objects.recompute_scores(
+            contest_id, save=not opts['dry_run'])
+        for drift in drifted:
+            self.stdout.write('{}: {}'.format(
+                drift.contest_player.user_name,
+                ', '.join('{} {} -> {}'.format(field, stored, computed)
+                          for field, (stored, computed)
+                          in sorted(drift.changes.items()))))
+        self.stdout.write('{} {} players whose scores had drifted'.format(
+            'Found' if opts['dry_run'] else 'Fixed', len(drifted)))
@@ -0,0 +1,21 @@
+"""Command that runs queued Untappd scrape jobs"""
+
+from beers.models import Scrape_Job
+from beers.utils.scrape import run_scrape_job
+from beers.management.commands._worker import WorkerCommand
+
+
+class Command(WorkerCommand):
+    """
+    A command which claims the scrape jobs queued by the web tier and
+    scrapes their Untappd pages
+    """
+
+    help = 'Runs queued Untappd scrape jobs'
+    job_model = Scrape_Job
+    job_name = 'scrape jobs'
+    default_sleep = 1
+
+    def run_job(self, job):
+        """Scrapes the job's page"""
+        run_scrape_job(job)
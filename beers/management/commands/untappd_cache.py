@@ -0,0 +1,59 @@
+"""Command that inspects or purges the cache of Untappd pages"""
+
+from django.core.management.base import BaseCommand, CommandError
+from beers.utils.page_cache import get_page_cache, KINDS
+
+
+class Command(BaseCommand):
+    """
+    A command which summarises the on-disk cache of Untappd beer, brewery
+    and checkin pages, or removes pages from it
+    """
+
+    help = 'Shows or purges the cache of Untappd pages'
+
+    def add_arguments(self, parser):
+        """There are three optional arguments for the command:
+           --purge: Remove all the matching pages, or only the expired ones
+           --kind: Only look at beer, brewery or checkin pages
+           --url: Only look at the page for a URL
+        """
+        parser.add_argument('--purge', nargs=1, choices=['all', 'expired'],
+                            help='Remove all or only expired pages')
+        parser.add_argument('--kind', nargs=1, choices=KINDS,
+                            help='Kind of page')
+        parser.add_argument('--url', nargs=1, help='URL of a page')
+
+    def handle(self, *args, **opts):
+        """Prints the summary, or purges the pages"""
+        cache = get_page_cache()
+        if cache is None:
+            raise CommandError('Error: the Untappd cache is turned off')
+        kind = None
+        if 'kind' in opts and opts['kind']:
+            kind = opts['kind'][0]
+        url = None
+        if 'url' in opts and opts['url']:
+            url = opts['url'][0]
+        if 'purge' in opts and opts['purge']:
+            removed = cache.purge(kind=kind, url=url,
+                                  expired_only=opts['purge'][0] == 'expired')
+            self.stdout.write('Removed {} pages'.format(removed))
+            return
+        if url is not None:
+            page = cache.get(url, kind)
+            if page is None:
+                self.stdout.write('Not cached: {}'.format(url))
+            else:
+                self.stdout.write('{} page {}: {} bytes, {:.0f} seconds old'.format(
+                    page.kind, page.url, page.size, page.age))
+            return
+        self.stdout.write('Untappd cache at {}'.format(cache.path))
+        total = 0
+        for summary in cache.summary():
+            if kind is not None and summary.kind != kind:
+                continue
+            total += summary.size
+            self.stdout.write('  {:<8} {:>6} pages {:>12} bytes {:>6} expired'.format(
+                summary.kind, summary.entries, summary.size, summary.expired))
+        self.stdout.write('  {} of {} bytes used'.format(total, cache.max_size))
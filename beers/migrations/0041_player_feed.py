@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beers', '0040_auto_20190407_2203'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Player_Feed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=512)),
+                ('etag', models.CharField(blank=True, max_length=250, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=100, null=True)),
+                ('content_hash', models.CharField(blank=True, max_length=64, null=True)),
+                ('last_loaded', models.DateTimeField(blank=True, null=True)),
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='beers.Player')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beers', '0041_player_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player_feed',
+            name='next_poll',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='player_feed',
+            name='poll_interval',
+            field=models.IntegerField(blank=True, help_text='seconds between polls', null=True),
+        ),
+    ]
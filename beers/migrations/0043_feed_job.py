@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beers', '0042_player_feed_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Feed_Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('RU', 'Running'), ('DO', 'Done'), ('FA', 'Failed')], db_index=True, default='PE', max_length=2)),
+                ('created_on', models.DateTimeField()),
+                ('started_on', models.DateTimeField(blank=True, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, help_text='seconds spent running the job', null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('result', models.CharField(blank=True, default='', max_length=250)),
+                ('checkins_loaded', models.IntegerField(default=0)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='beers.Player')),
+            ],
+        ),
+    ]
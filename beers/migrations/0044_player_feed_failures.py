@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beers', '0043_feed_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player_feed',
+            name='failures',
+            field=models.IntegerField(default=0, help_text='consecutive failed downloads'),
+        ),
+        migrations.AddField(
+            model_name='player_feed',
+            name='last_error',
+            field=models.CharField(blank=True, default='', max_length=250),
+        ),
+        migrations.AddField(
+            model_name='player_feed',
+            name='retry_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
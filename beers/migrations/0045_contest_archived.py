@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beers', '0044_player_feed_failures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beers', '0045_contest_archived'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='beer',
+            name='untappd_url',
+            field=models.URLField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='brewery',
+            name='untappd_url',
+            field=models.URLField(blank=True, db_index=True, null=True),
+        ),
+    ]
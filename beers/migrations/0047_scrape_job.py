@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beers', '0046_untappd_url_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scrape_Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('CH', 'Checkin'), ('BE', 'Beer'), ('BR', 'Brewery')], max_length=2)),
+                ('url', models.URLField(max_length=500)),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('RU', 'Running'), ('DO', 'Done'), ('FA', 'Failed')], db_index=True, default='PE', max_length=2)),
+                ('created_on', models.DateTimeField()),
+                ('started_on', models.DateTimeField(blank=True, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, help_text='seconds spent running the job', null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('error', models.CharField(blank=True, default='', max_length=250)),
+                ('object_id', models.IntegerField(blank=True, null=True)),
+                ('contest', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='beers.Contest')),
+            ],
+        ),
+    ]
@@ -4,6 +4,8 @@ from beers.models.contest_player import (
 
 from beers.models.contest import Contest
 from beers.models.player import Player
+from beers.models.feed import Player_Feed, Feed_Job
+from beers.models.scrape import Scrape_Job
 from beers.models.drinks import Beer, Brewery
 from beers.models.checkin import Unvalidated_Checkin
 from beers.models.associations import (
@@ -12,5 +14,6 @@ from beers.models.associations import (
 
 __all__ = [
     'Beer', 'Brewery', 'Contest', 'Contest_Beer', 'Contest_Bonus', 'Contest_Brewery',
-    'Contest_Checkin', 'Contest_Player', 'Player', 'Unvalidated_Checkin'
+    'Contest_Checkin', 'Contest_Player', 'Feed_Job', 'Player', 'Player_Feed',
+    'Scrape_Job', 'Unvalidated_Checkin'
 ]
\ No newline at end of file
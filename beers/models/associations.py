@@ -59,6 +59,57 @@ class Contest_Beer(models.Model):
     def __str__(self):
         return "{0}/{1}".format(self.beer.name, self.beer.brewery)
 
+class Contest_BonusManager(models.Manager):
+    """
+    Manager for contest bonuses. The checkin loader matches the hash tags of
+    every checkin against a contest's bonuses, so the manager keeps a map of
+    hash tag to bonus IDs for each contest in memory.
+
+    The map is only kept for one run of the loader. It lives in the memory
+    of a single process and isn't checked against the database, so changes
+    made by other processes aren't seen until it's cleared. Every consumer
+    clears it with invalidate_tag_index at the start of a run:
+    load_checkins once per run, poll_checkins once per pass and
+    checkin_worker once per job. Code that changes a contest's bonuses
+    also clears that contest's map, which only helps within the same
+    process.
+    """
+
+    _tag_indexes = {}
+
+    def tag_index(self, contest_id):
+        """
+        Returns a dictionary of hash tag to the IDs of the contest's bonuses
+        that use it, loading it from the database the first time it's needed
+        """
+        index = self._tag_indexes.get(contest_id)
+        if index is None:
+            index = {}
+            for bonus_id, hashtags in self.filter(contest_id=contest_id).order_by(
+                    'id').values_list('id', 'hashtags'):
+                for tag in hashtags or []:
+                    index.setdefault(tag, []).append(bonus_id)
+            self._tag_indexes[contest_id] = index
+        return index
+
+    def invalidate_tag_index(self, contest_id=None):
+        """
+        Forgets this process's hash tag map for a contest, or for every
+        contest if contest_id is None
+        """
+        if contest_id is None:
+            self._tag_indexes.clear()
+        else:
+            self._tag_indexes.pop(contest_id, None)
+
+    def matching_tags(self, contest_id, tags):
+        """
+        Returns the sorted IDs of the contest's bonuses that use any of the
+        hash tags
+        """
+        index = self.tag_index(contest_id)
+        return sorted({bonus_id for tag in tags for bonus_id in index.get(tag, ())})
+
 class Contest_Bonus(models.Model):
     """Represents a bonus associated with a particular contest"""
     from .contest import Contest
@@ -71,5 +122,7 @@ class Contest_Bonus(models.Model):
                           default=None)
     point_value = models.IntegerField(default=1,)
 
+    objects = Contest_BonusManager()
+
     class Meta:
         unique_together = (('contest', 'name'),)
\ No newline at end of file
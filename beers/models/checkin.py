@@ -2,7 +2,7 @@
 import datetime
 import logging
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.db import models, connection
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +16,68 @@ class Unvalidated_CheckinManager(models.Manager):
                            untappd_checkin=untappd_checkin,
                            untappd_checkin_date=untappd_checkin_date)
 
+    def build_checkin(self, contest_player, untappd_title, brewery, beer,
+                      untappd_checkin, untappd_checkin_date,
+                      possible_bonuses=None):
+        """Same as create_checkin, but without saving so it can be bulk created"""
+        return self.model(contest_player=contest_player,
+                          untappd_title=untappd_title,
+                          brewery=brewery,
+                          beer=beer,
+                          untappd_checkin=untappd_checkin,
+                          untappd_checkin_date=untappd_checkin_date,
+                          possible_bonuses=possible_bonuses)
+
+    def find_possible_matches(self, contest_id, contest_beers=None,
+                              contest_breweries=None):
+        """
+        Flags the contest's unvalidated checkins whose beer and brewery names
+        match a contest beer, or whose brewery name matches a contest
+        brewery, in a single statement. With no contest beers or breweries
+        given, every unvalidated checkin in the contest is rechecked, so
+        checkins whose match was removed are unflagged too. Otherwise only
+        the given Contest_Beer and Contest_Brewery IDs are matched, which is
+        enough when they were just added to the contest. Returns the number
+        of checkins that changed.
+        """
+        incremental = contest_beers is not None or contest_breweries is not None
+        beer_clause, brewery_clause = '', ''
+        match_params = []
+        if incremental:
+            beer_clause = ' AND b.id = ANY(%s)'
+            brewery_clause = ' AND br.id = ANY(%s)'
+            match_params = [list(contest_beers or []),
+                            list(contest_breweries or [])]
+        matched = """(EXISTS (SELECT 1 FROM beers_contest_beer b
+                               WHERE b.contest_id = cp.contest_id
+                                 AND b.beer_name = uv.beer
+                                 AND b.brewery_name = uv.brewery{})
+                       OR EXISTS (SELECT 1 FROM beers_contest_brewery br
+                                   WHERE br.contest_id = cp.contest_id
+                                     AND br.brewery_name = uv.brewery{}))""".format(
+            beer_clause, brewery_clause)
+        with connection.cursor() as cursor:
+            if incremental:
+                cursor.execute("""
+                    UPDATE beers_unvalidated_checkin uv
+                       SET has_possibles = TRUE
+                      FROM beers_contest_player cp
+                     WHERE uv.contest_player_id = cp.id
+                       AND cp.contest_id = %s
+                       AND NOT uv.has_possibles
+                       AND {}
+                    """.format(matched), [contest_id] + match_params)
+            else:
+                cursor.execute("""
+                    UPDATE beers_unvalidated_checkin uv
+                       SET has_possibles = {0}
+                      FROM beers_contest_player cp
+                     WHERE uv.contest_player_id = cp.id
+                       AND cp.contest_id = %s
+                       AND uv.has_possibles IS DISTINCT FROM {0}
+                    """.format(matched), [contest_id])
+            return cursor.rowcount
+
 class Unvalidated_Checkin(models.Model):
     from .contest_player import Contest_Player
     contest_player = models.ForeignKey(Contest_Player, on_delete=models.CASCADE)
@@ -1,12 +1,26 @@
 """Implementation of the Contest object for the application"""
 
+import datetime
 import logging
 import re
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+def running_contests(now, prefix=''):
+    """
+    Returns a Q filter for the contests that checkins are loaded for at now:
+    ones that aren't archived and whose dates, widened by the
+    CHECKIN_CONTEST_GRACE setting, include now. prefix is the lookup path to
+    the contest, e.g. 'contest__' when filtering contest players.
+    """
+    grace = datetime.timedelta(seconds=settings.CHECKIN_CONTEST_GRACE)
+    return models.Q(**{prefix + 'archived': False,
+                       prefix + 'start_date__lte': now + grace,
+                       prefix + 'end_date__gte': now - grace})
+
 class ContestManager(models.Manager):
     "Manager for contests"
 
@@ -29,6 +43,7 @@ class Contest(models.Model):
     name = models.CharField(max_length=250, unique=True)
     creator = models.ForeignKey(Player, default=1, on_delete=models.PROTECT)
     active = models.BooleanField(default=False)
+    archived = models.BooleanField(default=False)
     created_on = models.DateTimeField()
     last_updated = models.DateTimeField()
     start_date = models.DateTimeField()
@@ -41,6 +56,7 @@ class Contest(models.Model):
     def add_player(self, player):
         """Adds a player into the contest - should deprecate link()"""
         from .contest_player import Contest_Player
+        from .feed import Player_Feed
         contest_player = Contest_Player(contest=self, player=player,
                                         user_name=player.user.username,
                                         beer_count=0,
@@ -48,6 +64,8 @@ class Contest(models.Model):
                                         last_checkin_beer=None,
                                         last_checkin_load=self.start_date,)
         contest_player.save()
+        # The player's feed needs to be read in full for the new contest
+        Player_Feed.objects.invalidate(player)
         return contest_player
 
     def add_beer(self, beer, point_value=1):
@@ -144,6 +162,7 @@ class Contest(models.Model):
                               hashtags=tag_list,
                               point_value=point_value)
         bonus.save()
+        Contest_Bonus.objects.invalidate_tag_index(self.id)
         return bonus
 
     def ranked_players(self):
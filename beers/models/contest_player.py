@@ -2,7 +2,8 @@
 
 import datetime
 import logging
-from django.db import models, connection
+from collections import namedtuple
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
 from .player import Player
@@ -10,6 +11,123 @@ from .drinks import Beer, Brewery
 
 logger = logging.getLogger(__name__)
 
+# The counters that validating a checkin adds to, which are read under a
+# row lock before they're changed
+SCORE_FIELDS = ('beer_count',
+                'beer_points',
+                'brewery_points',
+                'bonus_points',
+                'challenge_point_gain',
+                'challenge_point_loss',
+                'total_points',
+               )
+LAST_CHECKIN_FIELDS = ['last_checkin_date', 'last_checkin_beer', 'last_checkin_brewery']
+
+# The transaction types counted in each score, and in the beer count.
+# Challenge losses are stored as negative points.
+SCORE_TX_TYPES = {
+    'beer_points': ('BE', 'CO'),
+    'brewery_points': ('BR',),
+    'bonus_points': ('BO',),
+    'challenge_point_gain': ('CS',),
+    'challenge_point_loss': ('CL',),
+}
+BEER_TX_TYPES = ('BE', 'CO', 'CS')
+
+def score_aggregates(prefix=''):
+    """
+    Returns the aggregates over Contest_Checkin rows that the scores are
+    rebuilt from, with the prefix on the checkin fields, e.g.
+    'contest_checkin__' to annotate Contest_Player rows
+    """
+    aggregates = {'beer_count': models.Count(
+        prefix + 'id', filter=models.Q(**{prefix + 'tx_type__in': BEER_TX_TYPES}))}
+    for field, tx_types in SCORE_TX_TYPES.items():
+        aggregates[field] = models.Sum(
+            prefix + 'checkin_points',
+            filter=models.Q(**{prefix + 'tx_type__in': tx_types}))
+    return aggregates
+
+SCORE_AGGREGATES = score_aggregates()
+
+# A player whose stored scores didn't match their checkins: changes is a
+# dictionary of score field to the stored and the computed values
+ScoreDrift = namedtuple('ScoreDrift', ['contest_player', 'changes'])
+
+def scores_from_aggregates(row):
+    """
+    Returns a dictionary of every score field from the result of
+    SCORE_AGGREGATES, with None for a player without checkins
+    """
+    scores = {field: (row or {}).get(field) or 0 for field in SCORE_AGGREGATES}
+    scores['challenge_point_loss'] = -scores['challenge_point_loss']
+    scores['total_points'] = (scores['beer_points']
+                              + scores['brewery_points']
+                              + scores['bonus_points']
+                              + scores['challenge_point_gain']
+                              - scores['challenge_point_loss'])
+    return scores
+
+class Contest_PlayerManager(models.Manager):
+    """A model manager for Contest_Player"""
+
+    def loadable(self, now, contest_id=None, require_feed=True):
+        """
+        Returns the contest players whose checkins can be loaded at now, with
+        their player, user and contest, ordered by player. These are the
+        players with an RSS feed in a running contest, see running_contests,
+        or in the given contest whatever its dates. Unless require_feed is
+        set, players without an RSS URL are included too, e.g. when loading
+        saved feeds.
+        """
+        from .contest import running_contests
+        contest_players = self.all()
+        if require_feed:
+            contest_players = contest_players \
+                .exclude(player__untappd_rss__isnull=True) \
+                .exclude(player__untappd_rss='')
+        if contest_id is None:
+            contest_players = contest_players.filter(
+                running_contests(now, 'contest__'))
+        else:
+            contest_players = contest_players.filter(contest_id=contest_id)
+        return contest_players.select_related('contest', 'player__user') \
+                              .order_by('player_id', 'contest_id')
+
+    def recompute_scores(self, contest_id, save=True):
+        """
+        Rebuilds the scores of every player in a contest from the checkins,
+        returning a ScoreDrift for each player whose stored scores were
+        different. The checkins are summed with one GROUP BY query and the
+        drifted players saved with one bulk update, unless save is False.
+        The players are locked meanwhile, so validations wait for it.
+        """
+        with transaction.atomic():
+            players = list(self.select_for_update().filter(contest_id=contest_id)
+                           .order_by('id'))
+            rows = Contest_Checkin.objects.filter(contest_player__contest_id=contest_id) \
+                                          .values('contest_player_id') \
+                                          .annotate(**SCORE_AGGREGATES) \
+                                          .order_by()
+            computed = {row['contest_player_id']: row for row in rows}
+            drifted = []
+            for player in players:
+                scores = scores_from_aggregates(computed.get(player.id))
+                changes = {field: (getattr(player, field), value)
+                           for field, value in scores.items()
+                           if getattr(player, field) != value}
+                if changes:
+                    for field, (_, value) in changes.items():
+                        setattr(player, field, value)
+                    drifted.append(ScoreDrift(player, changes))
+            if save and drifted:
+                self.bulk_update([drift.contest_player for drift in drifted],
+                                 list(SCORE_FIELDS))
+        if drifted:
+            logger.warning('Scores of %s of %s players in contest %s had drifted',
+                           len(drifted), len(players), contest_id)
+        return drifted
+
 class Contest_Player(models.Model):
     """ Links a player's activities relative to a contest
         A reverse sort by contest and beer count gives you a leaderboard"""
@@ -39,22 +157,40 @@ class Contest_Player(models.Model):
     last_checkin_load = models.DateTimeField(
         "Latest date in the last load for this player")
 
+    objects = Contest_PlayerManager()
+
     class Meta:
         unique_together = (('contest', 'player'),)
 
-    def __compute_losses(self):
+    def __lock(self, *others):
+        """
+        Locks the rows of this player and of any others for the rest of the
+        transaction and refreshes their score counters from the database, so
+        that counters updated by a concurrent validation aren't overwritten.
+        Rows are locked in ID order so that two validations can't deadlock.
         """
-        Computes the point value of the losses due to challenges. We do need
-        to query against the set of data (at the moment) because calculating
-        against the maximum point loss requires querying against all the
-        checkouts of all the challenge beers.
+        players = [self] + [other for other in others if other.id != self.id]
+        locked = Contest_Player.objects.select_for_update() \
+                                       .filter(id__in=[player.id for player in players]) \
+                                       .order_by('id') \
+                                       .values('id', *SCORE_FIELDS)
+        rows = {row['id']: row for row in locked}
+        for player in players:
+            for field in SCORE_FIELDS:
+                setattr(player, field, rows[player.id][field])
+
+    def add_points(self, field, points):
         """
-        challenger_losses = Contest_Checkin.objects.filter(contest_player=self, 
-                                                           tx_type='CL')
-        loss = (challenger_losses.aggregate(
-            models.Sum('checkin_points'))['checkin_points__sum'] or 0)
-        self.challenge_point_loss = -loss
-        self.save()
+        Adds points to one of the point counters and to the total, returning
+        the fields to save. This doesn't lock or save the player.
+        """
+        setattr(self, field, getattr(self, field) + points)
+        self.total_points = (self.brewery_points
+                             + self.beer_points
+                             + self.bonus_points
+                             + self.challenge_point_gain
+                             - self.challenge_point_loss)
+        return [field, 'total_points']
 
     def drink_beer(self, beer, checkin=None, data=None):
         """
@@ -63,17 +199,21 @@ class Contest_Player(models.Model):
         challenges, and updates history. It does not delete the checkin and
         gives preference to the data from the data object.
 
+        The player, and the challenger for a challenge beer, are locked while
+        the points are added, so validations of the same players can run at
+        once.
+
         beer: A Contest_Beer object to check into
         checkin: An Unvalidated_Checkin object
 
         returns Contest_Checkin
         """
-        if beer.contest.id != self.contest.id:
+        if beer.contest_id != self.contest_id:
             raise ValueError('Cannot check into a beer not in the contest')
         checkin_time = None
         untappd_checkin = None
         if checkin:
-            if checkin.contest_player.id != self.id:
+            if checkin.contest_player_id != self.id:
                 raise ValueError('Player and checkin not matched')
             checkin_time = checkin.untappd_checkin_date
             untappd_checkin = checkin.untappd_checkin
@@ -87,18 +227,31 @@ class Contest_Player(models.Model):
         self.last_checkin_date = checkin_time
         self.last_checkin_beer = beer.beer_name
         self.last_checkin_brewery = None
-        # Check if the beer has already been checked in
-        # Exclude the CL type as that indicates that another use drank the beer
-        if Contest_Checkin.objects.filter(contest_player=self,
-                                          contest_beer=beer).exclude(tx_type='CL').count() > 0:
-            logger.info("contest_player(%s).drink_beer: Already checked into beer %s",
-                        self.user_name, beer.beer_name)
-            return None
-        checkin = None
-        # Check if this is a challenge beer
-        if beer.challenger is not None:
-            # This is our own challenge beer, so
-            if beer.challenger.id == self.id:
+        challenger = None
+        if beer.challenger_id is not None and beer.challenger_id != self.id:
+            challenger = Contest_Player(id=beer.challenger_id)
+        with transaction.atomic():
+            if challenger is None:
+                self.__lock()
+            else:
+                self.__lock(challenger)
+            # Check if the beer has already been checked in, excluding the CL
+            # type as that indicates that another user drank the beer, and
+            # what the challenger has already lost to it
+            prior = Contest_Checkin.objects.filter(contest_beer_id=beer.id).aggregate(
+                drunk=models.Count('id', filter=models.Q(contest_player_id=self.id)
+                                   & ~models.Q(tx_type='CL')),
+                lost=models.Sum('checkin_points',
+                                filter=models.Q(contest_player_id=beer.challenger_id,
+                                                tx_type='CL')))
+            if prior['drunk'] > 0:
+                logger.info("contest_player(%s).drink_beer: Already checked into beer %s",
+                            self.user_name, beer.beer_name)
+                return None
+            checkins = []
+            # Check if this is a challenge beer
+            if beer.challenger_id == self.id:
+                # This is our own challenge beer, so
                 logger.info("contest_player(%s).drink_beer: Adding self-drink challenge beer %s",
                             self.user_name, untappd_checkin)
                 checkin = Contest_Checkin(contest_player=self,
@@ -108,10 +261,9 @@ class Contest_Player(models.Model):
                                           checkin_time=checkin_time,
                                           tx_type='CS',
                                          )
-                checkin.save()
-                self.challenge_point_gain = (self.challenge_point_gain
-                                             + beer.challenge_point_value)
-            else:
+                fields = self.add_points('challenge_point_gain',
+                                           beer.challenge_point_value)
+            elif challenger is not None:
                 logger.info("contest_player(%s).drink_beer: Adding other-drinnk challenge beer %s",
                             self.user_name, untappd_checkin)
                 checkin = Contest_Checkin(contest_player=self,
@@ -121,52 +273,38 @@ class Contest_Player(models.Model):
                                           checkin_time=checkin_time,
                                           tx_type='CO',
                                          )
-                checkin.save()
-                self.beer_points = self.beer_points + beer.point_value
+                fields = self.add_points('beer_points', beer.point_value)
                 # The challenger is penalized if someone else drinks their
                 # challenge beer
-                challenger = beer.challenger
-                points_lost = (Contest_Checkin.objects.filter(contest_player=challenger,
-                    contest_beer=beer,
-                    tx_type='CL').aggregate(
-                        models.Sum('checkin_points'))['checkin_points__sum'] or 0)
+                points_lost = prior['lost'] or 0
                 if -(points_lost - beer.challenge_point_loss) <= beer.max_point_loss:
-                    loss_checkin = Contest_Checkin(
+                    checkins.append(Contest_Checkin(
                         contest_player=challenger,
                         contest_beer=beer,
                         checkin_points=-beer.challenge_point_loss,
                         checkin_time=checkin_time,
                         untappd_checkin=untappd_checkin,
                         tx_type='CL',
-                        )
-                    loss_checkin.save()
-
-                challenger.__compute_losses()
-                challenger.total_points = (challenger.beer_points
-                                           + challenger.brewery_points
-                                           + challenger.bonus_points
-                                           + challenger.challenge_point_gain
-                                           - challenger.challenge_point_loss)
-                challenger.save()
-        else:
-            logger.info("contest_player(%s).drink_beer: Adding drink non-challenge beer %s",
-                            self.user_name, untappd_checkin)
-            checkin = Contest_Checkin(contest_player=self,
-                                      contest_beer=beer,
-                                      checkin_points=beer.point_value,
-                                      untappd_checkin=untappd_checkin,
-                                      checkin_time=checkin_time,
-                                      tx_type='BE',
-                                     )
-            checkin.save()
-            self.beer_points = self.beer_points + beer.point_value
-        self.total_points = (self.brewery_points
-                             + self.beer_points
-                             + self.bonus_points
-                             + self.challenge_point_gain
-                             - self.challenge_point_loss)
-        self.beer_count = self.beer_count + 1
-        self.save()
+                        ))
+                    challenger.save(update_fields=challenger.add_points(
+                        'challenge_point_loss', beer.challenge_point_loss))
+            else:
+                logger.info("contest_player(%s).drink_beer: Adding drink non-challenge beer %s",
+                                self.user_name, untappd_checkin)
+                checkin = Contest_Checkin(contest_player=self,
+                                          contest_beer=beer,
+                                          checkin_points=beer.point_value,
+                                          untappd_checkin=untappd_checkin,
+                                          checkin_time=checkin_time,
+                                          tx_type='BE',
+                                         )
+                fields = self.add_points('beer_points', beer.point_value)
+            Contest_Checkin.objects.bulk_create([checkin] + checkins)
+            self.beer_count = self.beer_count + 1
+            self.save(update_fields=fields + ['beer_count'] + LAST_CHECKIN_FIELDS)
+        if challenger is not None and type(beer).challenger.is_cached(beer):
+            for field in SCORE_FIELDS:
+                setattr(beer.challenger, field, getattr(challenger, field))
         return checkin
 
     def drink_at_brewery(self, brewery, checkin=None, data=None):
@@ -180,12 +318,12 @@ class Contest_Player(models.Model):
 
         returns Contest_Checkin
         """
-        if brewery.contest.id != self.contest.id:
+        if brewery.contest_id != self.contest_id:
             raise ValueError('Cannot check into a brewery not in the contest')
         checkin_time = None
         untappd_checkin = None
         if checkin:
-            if checkin.contest_player.id != self.id:
+            if checkin.contest_player_id != self.id:
                 raise ValueError('Cannot use checkin not in the contest')
             checkin_time = checkin.untappd_checkin_date
             untappd_checkin = checkin.untappd_checkin
@@ -197,20 +335,20 @@ class Contest_Player(models.Model):
         self.last_checkin_date = checkin_time
         self.last_checkin_beer = None
         self.last_checkin_brewery = brewery.brewery_name
-        if Contest_Checkin.objects.filter(contest_player=self,
-                                          contest_brewery=brewery).count() > 0:
-            return None
-        checkin = Contest_Checkin(contest_player=self,
-                                  contest_brewery=brewery,
-                                  checkin_points=brewery.point_value,
-                                  untappd_checkin=untappd_checkin,
-                                  checkin_time=checkin_time,
-                                  tx_type='BR',
-                                 )
-        checkin.save()
-        self.brewery_points = self.brewery_points + brewery.point_value
-        self.total_points = self.total_points + brewery.point_value
-        self.save()
+        with transaction.atomic():
+            self.__lock()
+            if Contest_Checkin.objects.filter(contest_player=self,
+                                              contest_brewery=brewery).exists():
+                return None
+            checkin = Contest_Checkin.objects.create(contest_player=self,
+                                                     contest_brewery=brewery,
+                                                     checkin_points=brewery.point_value,
+                                                     untappd_checkin=untappd_checkin,
+                                                     checkin_time=checkin_time,
+                                                     tx_type='BR',
+                                                    )
+            fields = self.add_points('brewery_points', brewery.point_value)
+            self.save(update_fields=fields + LAST_CHECKIN_FIELDS)
         return checkin
 
     def drink_bonus(self, bonus, checkin=None, data=None):
@@ -229,12 +367,12 @@ class Contest_Player(models.Model):
         untappd_checkin = None
         contest_bonus = None
         try:
-            contest_bonus = Contest_Bonus.objects.get(contest=self.contest,
+            contest_bonus = Contest_Bonus.objects.get(contest_id=self.contest_id,
                                                       name=bonus)
         except Contest_Bonus.DoesNotExist:
             raise ValueError('No such bonus {} for contest'.format(bonus))
         if checkin:
-            if checkin.contest_player.id != self.id:
+            if checkin.contest_player_id != self.id:
                 raise ValueError('Cannot use checkin not in the contest')
             checkin_time = checkin.untappd_checkin_date
             untappd_checkin = checkin.untappd_checkin
@@ -244,52 +382,28 @@ class Contest_Player(models.Model):
             if 'untappd_checkin' in data:
                 untappd_checkin = data['untappd_checkin']
         
-        checkin = Contest_Checkin(contest_player=self,
-                                  contest_bonus=contest_bonus,
-                                  checkin_points=contest_bonus.point_value,
-                                  untappd_checkin=untappd_checkin,
-                                  checkin_time=checkin_time,
-                                  tx_type='BO',
-                                 )
-        checkin.save()
-        self.bonus_points = self.bonus_points + contest_bonus.point_value
-        self.total_points = self.total_points + contest_bonus.point_value
-        self.save()
+        with transaction.atomic():
+            self.__lock()
+            checkin = Contest_Checkin.objects.create(contest_player=self,
+                                                     contest_bonus=contest_bonus,
+                                                     checkin_points=contest_bonus.point_value,
+                                                     untappd_checkin=untappd_checkin,
+                                                     checkin_time=checkin_time,
+                                                     tx_type='BO',
+                                                    )
+            fields = self.add_points('bonus_points', contest_bonus.point_value)
+            self.save(update_fields=fields)
         return checkin
 
     def compute_points(self):
-        """Computes the brewery and beer points for this user."""
-        checkins = Contest_Checkin.objects.filter(contest_player=self)
-        self.challenge_point_gain = checkins.filter(tx_type='CS').aggregate(
-            models.Sum('checkin_points'))['checkin_points__sum'] or 0
-        self.challenge_point_loss = -(checkins.filter(tx_type='CL').aggregate(
-            models.Sum('checkin_points'))['checkin_points__sum'] or 0)
-        self.beer_points = checkins.filter(models.Q(tx_type='CO') | 
-                                             models.Q(tx_type='BE')).aggregate(
-            models.Sum('checkin_points'))['checkin_points__sum'] or 0
-        self.brewery_points = checkins.filter(tx_type='BR').aggregate(
-            models.Sum('checkin_points'))['checkin_points__sum'] or 0
-        self.bonus_points = checkins.filter(tx_type='BO').aggregate(
-            models.Sum('checkin_points'))['checkin_points__sum'] or 0
-        self.total_points = (self.beer_points
-                             + self.brewery_points
-                             + self.bonus_points
-                             + self.challenge_point_gain
-                             - self.challenge_point_loss)
-        self.save()
-
-    def find_possible_matches(self):
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                UPDATE beers_unvalidated_checkin uv
-                   SET has_possibles = TRUE
-                  FROM beers_contest_beer b
-                 WHERE uv.contest_player_id = %s
-                   AND b.contest_id = %s
-                   AND b.beer_name = uv.beer
-                   AND b.brewery_name = uv.brewery
-                """, [self.id, self.contest_id])
-                            
+        """Computes all the points for this user from their checkins."""
+        scores = scores_from_aggregates(
+            Contest_Checkin.objects.filter(contest_player=self).aggregate(
+                **SCORE_AGGREGATES))
+        for field, value in scores.items():
+            setattr(self, field, value)
+        self.save(update_fields=list(SCORE_FIELDS))
+
     def __str__(self):
         return "{0}:[Player={1}]".format(self.contest.name, self.user_name)
 
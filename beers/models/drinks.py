@@ -21,6 +21,13 @@ class BeerManager(models.Manager):
                            last_updated=timezone.now())
         return beer
 
+    def for_untappd_url(self, *urls):
+        """
+        Returns the oldest beer stored under any of the Untappd URLs, or
+        None if there isn't one
+        """
+        return self.filter(untappd_url__in=set(urls)).order_by('id').first()
+
 # Create your models here.
 class Beer(models.Model):
     "Represents a common beer - can be shared across contests"
@@ -35,7 +42,7 @@ class Beer(models.Model):
     brewery_lat = models.FloatField(null=True, blank=True)
     brewery_lon = models.FloatField(null=True, blank=True)
     untappd_id = models.CharField(max_length=25, null=True, blank=True)
-    untappd_url = models.URLField(null=True, blank=True)
+    untappd_url = models.URLField(null=True, blank=True, db_index=True)
     brewery_url = models.URLField(null=True, blank=True)
     last_updated = models.DateTimeField()
 
@@ -55,10 +62,17 @@ class Brewery_Manager(models.Manager):
                            location=location,
 						   last_updated=timezone.now())
 
+    def for_untappd_url(self, *urls):
+        """
+        Returns the oldest brewery stored under any of the Untappd URLs, or
+        None if there isn't one
+        """
+        return self.filter(untappd_url__in=set(urls)).order_by('id').first()
+
 class Brewery(models.Model):
     name = models.CharField(max_length=250)
     untappd_id = models.CharField(max_length=25, null=True, blank=True,)
-    untappd_url = models.URLField(null=True, blank=True,)
+    untappd_url = models.URLField(null=True, blank=True, db_index=True)
     state = models.CharField(max_length=250)
     location = models.CharField(max_length=250, null=True, blank=True, default=None)
     last_updated = models.DateTimeField()
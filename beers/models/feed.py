@@ -0,0 +1,160 @@
+"""Tracks the state of each player's Untappd RSS feed between loads"""
+
+import datetime
+import logging
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from .player import Player
+from .job import Job, JobManager
+
+logger = logging.getLogger(__name__)
+
+class Player_FeedManager(models.Manager):
+    """Manager for the feed state of players"""
+
+    def record(self, player, url, etag=None, last_modified=None,
+               content_hash=None):
+        """
+        Saves the validators from the last successful load of the player's
+        feed so that the next load can be skipped if nothing changed
+        """
+        feed, _ = self.update_or_create(player=player,
+                                        defaults={'url': url,
+                                                  'etag': etag,
+                                                  'last_modified': last_modified,
+                                                  'content_hash': content_hash,
+                                                  'last_loaded': timezone.now()})
+        return feed
+
+    def invalidate(self, player):
+        """
+        Forgets the validators for the player's feed so that the next load
+        processes the whole feed, e.g. when the player joins a contest or
+        their load date is reset. The feed is also due for polling right away.
+        """
+        return self.filter(player=player).update(etag=None,
+                                                 last_modified=None,
+                                                 content_hash=None,
+                                                 next_poll=None,
+                                                 poll_interval=None)
+
+    def record_failure(self, player, url, error, now=None):
+        """
+        Counts a failed download of the player's feed and opens its circuit
+        until a retry time that doubles with each consecutive failure,
+        starting at CHECKIN_FEED_BACKOFF seconds and capped at
+        CHECKIN_FEED_MAX_BACKOFF
+        """
+        if now is None:
+            now = timezone.now()
+        feed, _ = self.get_or_create(player=player, defaults={'url': url})
+        feed.failures += 1
+        backoff = min(settings.CHECKIN_FEED_BACKOFF * 2 ** (feed.failures - 1),
+                      settings.CHECKIN_FEED_MAX_BACKOFF)
+        feed.retry_after = now + datetime.timedelta(seconds=backoff)
+        feed.last_error = str(error)[:250]
+        feed.save(update_fields=['failures', 'retry_after', 'last_error'])
+        return feed
+
+    def reset_failures(self, player):
+        """
+        Closes the circuit on the player's feed, e.g. after a successful
+        download or when the player changes their RSS URL
+        """
+        return self.filter(player=player).update(failures=0, retry_after=None,
+                                                 last_error='')
+
+    def schedule(self, player, found_checkins, now=None):
+        """
+        Sets when the player's feed should next be polled. A feed with new
+        checkins is polled again after CHECKIN_POLL_MIN_INTERVAL seconds;
+        otherwise the interval doubles, up to CHECKIN_POLL_MAX_INTERVAL, so
+        idle players are polled less and less often.
+        """
+        if now is None:
+            now = timezone.now()
+        feed, _ = self.get_or_create(player=player,
+                                     defaults={'url': player.untappd_rss})
+        if found_checkins or feed.poll_interval is None:
+            feed.poll_interval = settings.CHECKIN_POLL_MIN_INTERVAL
+        else:
+            feed.poll_interval = min(feed.poll_interval * 2,
+                                     settings.CHECKIN_POLL_MAX_INTERVAL)
+        feed.next_poll = now + datetime.timedelta(seconds=feed.poll_interval)
+        feed.save(update_fields=['poll_interval', 'next_poll'])
+        return feed
+
+
+class Player_Feed(models.Model):
+    """
+    The HTTP validators and content hash from the last time a player's feed
+    was loaded. These only apply while the player's RSS URL matches url.
+    """
+    player = models.OneToOneField(Player, on_delete=models.CASCADE)
+    url = models.URLField(max_length=512)
+    etag = models.CharField(max_length=250, null=True, blank=True)
+    last_modified = models.CharField(max_length=100, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    last_loaded = models.DateTimeField(null=True, blank=True)
+    next_poll = models.DateTimeField(null=True, blank=True)
+    poll_interval = models.IntegerField(null=True, blank=True,
+                                        help_text='seconds between polls')
+    failures = models.IntegerField(default=0,
+                                   help_text='consecutive failed downloads')
+    retry_after = models.DateTimeField(null=True, blank=True)
+    last_error = models.CharField(max_length=250, blank=True, default='')
+
+    objects = Player_FeedManager()
+
+    def matches(self, url):
+        """Returns whether the stored validators apply to the URL"""
+        return self.url == url
+
+    def is_broken(self, now=None):
+        """Returns whether the feed has failed recently enough to be skipped"""
+        if now is None:
+            now = timezone.now()
+        return self.retry_after is not None and self.retry_after > now
+
+    def __str__(self):
+        return "Player_Feed[player={}, etag={}, last_modified={}]".format(
+            self.player_id, self.etag, self.last_modified)
+
+
+class Feed_JobManager(JobManager):
+    """Manager for the queue of feed loading jobs"""
+
+    def enqueue(self, players):
+        """
+        Queues a job for each of the players that doesn't already have one
+        waiting, returning the new jobs
+        """
+        waiting = set(self.filter(status=Feed_Job.PENDING,
+                                  player__in=players).values_list('player_id',
+                                                                  flat=True))
+        now = timezone.now()
+        return self.bulk_create([Feed_Job(player=player, created_on=now)
+                                 for player in players
+                                 if player.id not in waiting])
+
+
+class Feed_Job(Job):
+    """A request to load one player's feed, claimed by a checkin worker"""
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    result = models.CharField(max_length=250, blank=True, default='')
+    checkins_loaded = models.IntegerField(default=0)
+
+    objects = Feed_JobManager()
+
+    @classmethod
+    def expired_outcome(cls):
+        return {'result': 'lease expired'}
+
+    def finish(self, status, result, checkins_loaded=0):
+        """Records the outcome of running the job and how long it took"""
+        super().finish(status, result=result[:250], checkins_loaded=checkins_loaded)
+
+    def __str__(self):
+        return "Feed_Job[player={}, status={}, worker={}]".format(
+            self.player_id, self.status, self.worker)
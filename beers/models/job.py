@@ -0,0 +1,121 @@
+"""The parts shared by the queues of work that the worker commands run"""
+
+import datetime
+import logging
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+class JobManager(models.Manager):
+    """
+    Manager for a queue of jobs, see Job. A worker has JOB_LEASE seconds
+    to finish a job it claims. After that the job is taken to have failed,
+    e.g. because the worker died, rather than leaving it running forever.
+    """
+
+    def live(self, now=None):
+        """Returns the jobs that are pending, or running within their lease"""
+        if now is None:
+            now = timezone.now()
+        return self.filter(models.Q(status=Job.PENDING)
+                           | models.Q(status=Job.RUNNING,
+                                      started_on__gte=now - Job.lease()))
+
+    def expire(self, now=None):
+        """
+        Marks the running jobs whose lease has run out as failed, returning
+        how many there were
+        """
+        if now is None:
+            now = timezone.now()
+        expired = self.filter(status=Job.RUNNING,
+                              started_on__lt=now - Job.lease()).update(
+                                  status=Job.FAILED, finished_on=now,
+                                  **self.model.expired_outcome())
+        if expired:
+            logger.warning('%s %s jobs ran past their lease', expired,
+                           self.model.__name__)
+        return expired
+
+    def claim(self, worker):
+        """
+        Takes the oldest pending job and marks it as running for the worker,
+        or returns None if there is nothing to do. Rows that another worker
+        is claiming at the same time are skipped rather than waited on, so
+        no two workers get the same job. Jobs past their lease are expired
+        first.
+        """
+        self.expire()
+        with transaction.atomic():
+            job = self.select_for_update(skip_locked=True) \
+                      .filter(status=Job.PENDING).order_by('id').first()
+            if job is None:
+                return None
+            job.status = Job.RUNNING
+            job.worker = worker
+            job.started_on = timezone.now()
+            job.save(update_fields=['status', 'worker', 'started_on'])
+        return job
+
+
+class Job(models.Model):
+    """
+    A unit of work waiting in a queue until a worker claims it. Subclasses
+    add what the job is for, and record its outcome with finish.
+    """
+    PENDING = 'PE'
+    RUNNING = 'RU'
+    DONE = 'DO'
+    FAILED = 'FA'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(max_length=2, choices=STATUSES, default=PENDING,
+                              db_index=True)
+    created_on = models.DateTimeField()
+    started_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True,
+                                 help_text='seconds spent running the job')
+    worker = models.CharField(max_length=100, blank=True, default='')
+
+    objects = JobManager()
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def lease():
+        """How long a worker has to finish a job it has claimed"""
+        return datetime.timedelta(seconds=settings.JOB_LEASE)
+
+    def is_expired(self, now=None):
+        """
+        Whether the job is still marked as running past its lease, which
+        JobManager.expire has yet to record as a failure
+        """
+        if now is None:
+            now = timezone.now()
+        return self.status == Job.RUNNING and self.started_on < now - Job.lease()
+
+    @classmethod
+    def expired_outcome(cls):
+        """The outcome fields recorded on a job whose lease ran out"""
+        return {}
+
+    def finish(self, status, **outcome):
+        """
+        Records the status of running the job, how long it took, and the
+        other fields given as the outcome
+        """
+        for field, value in outcome.items():
+            setattr(self, field, value)
+        self.status = status
+        self.finished_on = timezone.now()
+        self.duration = (self.finished_on - self.started_on).total_seconds()
+        self.save(update_fields=['status', 'finished_on', 'duration'] + list(outcome))
@@ -2,6 +2,7 @@
 
 import logging
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 
 logger = logging.getLogger(__name__)
@@ -17,6 +18,20 @@ class PlayerManager(models.Manager):
                            untappd_rss=untappd_rss,
                            untappd_username=untappd_username)
 
+    def due_for_poll(self, now):
+        """
+        Returns the players with an RSS feed who are in at least one contest
+        running at now and whose feed is due to be polled, i.e. it has never
+        been scheduled or its next poll time has passed
+        """
+        from .contest import running_contests
+        return self.exclude(untappd_rss__isnull=True).exclude(untappd_rss='') \
+                   .filter(running_contests(now, 'contest_player__contest__')) \
+                   .filter(Q(player_feed__isnull=True)
+                           | Q(player_feed__next_poll__isnull=True)
+                           | Q(player_feed__next_poll__lte=now)) \
+                   .distinct()
+
 
 # The user profile.
 class Player(models.Model):
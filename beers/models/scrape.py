@@ -0,0 +1,63 @@
+"""The queue of Untappd pages that the web tier hands to scrape workers"""
+
+import logging
+from django.db import models
+from django.utils import timezone
+from .contest import Contest
+from .job import Job, JobManager
+
+logger = logging.getLogger(__name__)
+
+class Scrape_JobManager(JobManager):
+    """Manager for the queue of scrape jobs"""
+
+    def enqueue(self, kind, url, contest=None):
+        """
+        Queues a job to scrape the Untappd page of the given kind at url,
+        for a contest in the case of a checkin. If the same page is already
+        waiting or being scraped, that job is returned instead, unless it
+        has run past its lease. Expired jobs are left for the next claim to
+        mark as failed.
+        """
+        job = self.live().filter(kind=kind, url=url, contest=contest) \
+                  .order_by('id').first()
+        if job is not None:
+            return job
+        return self.create(kind=kind, url=url, contest=contest,
+                           created_on=timezone.now())
+
+
+class Scrape_Job(Job):
+    """
+    A request to scrape one Untappd page, claimed by a scrape worker. Once
+    it's done, object_id is the ID of the Unvalidated_Checkin, Beer or
+    Brewery it found, depending on the kind of page.
+    """
+    CHECKIN = 'CH'
+    BEER = 'BE'
+    BREWERY = 'BR'
+    KINDS = (
+        (CHECKIN, 'Checkin'),
+        (BEER, 'Beer'),
+        (BREWERY, 'Brewery'),
+    )
+    kind = models.CharField(max_length=2, choices=KINDS)
+    url = models.URLField(max_length=500)
+    contest = models.ForeignKey(Contest, on_delete=models.CASCADE,
+                                null=True, blank=True)
+    error = models.CharField(max_length=250, blank=True, default='')
+    object_id = models.IntegerField(null=True, blank=True)
+
+    objects = Scrape_JobManager()
+
+    @classmethod
+    def expired_outcome(cls):
+        return {'error': 'lease expired'}
+
+    def finish(self, status, error='', object_id=None):
+        """Records the outcome of running the job and how long it took"""
+        super().finish(status, error=error[:250], object_id=object_id)
+
+    def __str__(self):
+        return "Scrape_Job[kind={}, url={}, status={}, worker={}]".format(
+            self.kind, self.url, self.status, self.worker)
@@ -1,5 +1,9 @@
+import copy
 import datetime
+import io
 import json
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase, override_settings, Client
 from django.urls import reverse
 from django.utils import timezone
@@ -7,13 +11,17 @@ from django.db.models import Q
 from rest_framework import status
 from unittest import mock
 
+from beers.utils import untappd
 from beers.models import Beer, Brewery, Contest, Contest_Player, \
                          Unvalidated_Checkin, Contest_Checkin, Contest_Beer, \
                          Contest_Brewery, Player
 
 
-def outer_mock_parse_checkin(url):
-    return AddCheckinTestCase.mock_parse_checkin(url)
+def copying_mock_parse_checkin(url):
+    """Parses into a copy, as the checkin that is returned gets saved"""
+    if url not in AddCheckinTestCase.CHECKINS:
+        raise untappd.UntappdParseException('Unable to find beer information on checkin page')
+    return copy.copy(AddCheckinTestCase.CHECKINS[url])
 
 @override_settings(SECURE_SSL_REDIRECT=False, ROOTURL_CONF='beers.urls')
 class AddCheckinTestCase(TestCase):
@@ -26,11 +34,6 @@ class AddCheckinTestCase(TestCase):
                 'unvalidated_checkins',
                 ]
 
-    @classmethod
-    def mock_parse_checkin(clz, url):
-        print("Mock parse: {}".format(url))
-        return clz.CHECKINS[url]
-
     @classmethod
     def setUpTestData(clz):
         checkin = Unvalidated_Checkin()
@@ -43,15 +46,34 @@ class AddCheckinTestCase(TestCase):
         checkin.beer_url = 'https://test.com/beers/beer7'
         checkin.brewery_url = 'https://test.com/brewery/brewery7'
         clz.CHECKINS['https://example.com/unvalidated_checkin_new'] = checkin
+        stranger = copy.copy(checkin)
+        stranger.untappd_checkin = 'https://example.com/unvalidated_checkin_stranger'
+        stranger.untappd_user = 'stranger'
+        clz.CHECKINS[stranger.untappd_checkin] = stranger
+
+    def run_scrape_jobs(self, response):
+        """
+        Checks that a response queued a scrape job, then runs the queued
+        jobs and returns the finished job as polled
+        """
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual(job['status'], 'pending')
+        self.assertTrue(response['Location'].endswith(
+            reverse('scrape-job-detail', kwargs={'job_id': job['id']})))
+        call_command('scrape_worker', '--exit-when-empty', stdout=io.StringIO())
+        response = Client().get(job['url'], HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
 
-    @mock.patch('beers.api.views.untappd.parse_checkin', side_effect=outer_mock_parse_checkin)
+    @mock.patch('beers.utils.checkin.parse_checkin', side_effect=copying_mock_parse_checkin)
     def test_successful_add_checkin(self, mocked_function):
         c = Client()
         untappd_url = 'https://example.com/unvalidated_checkin_new'
         _ = Player.objects.get(user__username='runner1')
         self.assertTrue(c.login(username='runner1', password='password1%'))
         response = c.post(reverse('unvalidated-checkin-list', args=[1]), data={'untappd_checkin': untappd_url})
-        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.run_scrape_jobs(response)['status'], 'done')
         uv = Unvalidated_Checkin.objects.get(untappd_checkin=untappd_url)
         checkin = AddCheckinTestCase.CHECKINS[untappd_url]
         self.assertEqual(uv.untappd_checkin, untappd_url)
@@ -62,7 +84,7 @@ class AddCheckinTestCase(TestCase):
         self.assertEqual(uv.beer_url, checkin.beer_url)
         self.assertEqual(uv.brewery_url, checkin.brewery_url)
 
-    @mock.patch('beers.api.views.untappd.parse_checkin', side_effect=outer_mock_parse_checkin)
+    @mock.patch('beers.utils.checkin.parse_checkin', side_effect=copying_mock_parse_checkin)
     def test_failed_duplicate_url(self, mocked_function):
         c = Client()
         untappd_url = 'https://example.com/unvalidated_1'
@@ -71,7 +93,7 @@ class AddCheckinTestCase(TestCase):
         response = c.post(reverse('unvalidated-checkin-list', args=[1]), data={'untappd_checkin': untappd_url})
         self.assertEqual(response.status_code, 400)
 
-    @mock.patch('beers.api.views.untappd.parse_checkin', side_effect=outer_mock_parse_checkin)
+    @mock.patch('beers.utils.checkin.parse_checkin', side_effect=copying_mock_parse_checkin)
     def test_unvalidated_api_create(self, mocked_function):
         """Tests if the JSON API gets the right values for a single request"""
         c = Client()
@@ -79,15 +101,16 @@ class AddCheckinTestCase(TestCase):
         response = c.post(reverse('unvalidated-checkin-list',
                                   kwargs={'contest_id': 1}),
                                   data={'untappd_checkin': 'https://example.com/unvalidated_checkin_new'})
-        self.assertEqual(response.status_code, 201)
-        checkin = json.loads(response.content)
+        job = self.run_scrape_jobs(response)
+        self.assertEqual(job['status'], 'done')
+        checkin = job['result']
         self.assertTrue(checkin['url'].endswith(reverse('unvalidated-checkin-detail', 
                                                 kwargs={'id': checkin['id']})))
         self.assertEqual(checkin['player'], 'user1')
         self.assertEqual(checkin['brewery'], 'Brewery 7')
         self.assertEqual(checkin['beer'], 'Beer 7')
 
-    @mock.patch('beers.api.views.untappd.parse_checkin', side_effect=outer_mock_parse_checkin)
+    @mock.patch('beers.utils.checkin.parse_checkin', side_effect=copying_mock_parse_checkin)
     def test_unvalidated_api_create_not_in_contest(self, mocked_function):
         """Tests if the JSON API gets the right values for a single request"""
         c = Client()
@@ -95,7 +118,93 @@ class AddCheckinTestCase(TestCase):
         response = c.post(reverse('unvalidated-checkin-list',
                                   kwargs={'contest_id': 3}),
                                   data={'untappd_checkin': 'https://example.com/unvalidated_checkin_new'})
-        self.assertEqual(response.status_code, 400)
-        errors = json.loads(response.content)
+        self.assertEqual(response.status_code, 404)
+        response = c.post(reverse('unvalidated-checkin-list',
+                                  kwargs={'contest_id': 1}),
+                                  data={'untappd_checkin': 'https://example.com/unvalidated_checkin_stranger'})
+        job = self.run_scrape_jobs(response)
+        self.assertEqual(job['status'], 'failed')
+        errors = job['errors']
         self.assertIn('non_field_errors', errors)
-        self.assertTrue(errors['non_field_errors'][0].count("Can't link") > 0)
\ No newline at end of file
+        self.assertTrue(errors['non_field_errors'][0].count("Can't link") > 0)
+
+    @mock.patch('beers.utils.checkin.parse_checkin', side_effect=copying_mock_parse_checkin)
+    def test_repeated_add_checkin_shares_job(self, mocked_function):
+        """Tests that adding a checkin that is already queued reuses its job"""
+        c = Client()
+        self.assertTrue(c.login(username='runner1', password='password1%'))
+        url = reverse('unvalidated-checkin-list', kwargs={'contest_id': 1})
+        data = {'untappd_checkin': 'https://example.com/unvalidated_checkin_new'}
+        first = c.post(url, data=data).json()
+        second = c.post(url, data=data).json()
+        self.assertEqual(first['id'], second['id'])
+        self.assertEqual(self.run_scrape_jobs(c.post(url, data=data))['status'], 'done')
+        self.assertEqual(mocked_function.call_count, 1)
+
+    @mock.patch('beers.utils.checkin.parse_checkin', side_effect=copying_mock_parse_checkin)
+    def test_bulk_add_checkins(self, mocked_function):
+        """Tests adding a list of checkins, with a result for each URL"""
+        c = Client()
+        self.assertTrue(c.login(username='runner1', password='password1%'))
+        urls = ['https://example.com/unvalidated_checkin_new',
+                'https://example.com/unvalidated_1',
+                'https://example.com/unvalidated_checkin_new',
+                'https://example.com/not_a_checkin',
+                'https://example.com/unvalidated_checkin_stranger']
+        count = Unvalidated_Checkin.objects.count()
+        response = c.post(reverse('unvalidated-checkin-bulk', kwargs={'contest_id': 1}),
+                          content_type='application/json',
+                          data=json.dumps({'untappd_checkins': urls}))
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([item['untappd_checkin'] for item in result['results']], urls)
+        self.assertEqual([item['status'] for item in result['results']],
+                         ['created', 'duplicate', 'duplicate', 'invalid',
+                          'unknown_player'])
+        self.assertEqual(result['results'][3]['error'],
+                         'Unable to find beer information on checkin page')
+        # Already present and repeated URLs aren't downloaded
+        self.assertEqual(mocked_function.call_count, 3)
+        self.assertEqual(Unvalidated_Checkin.objects.count(), count + 1)
+        uv = Unvalidated_Checkin.objects.get(id=result['results'][0]['id'])
+        self.assertEqual(uv.untappd_checkin, urls[0])
+        self.assertEqual(uv.contest_player.player.untappd_username, 'untapped1')
+        self.assertTrue(result['results'][0]['url'].endswith(
+            reverse('unvalidated-checkin-detail', kwargs={'id': uv.id})))
+
+    def test_bulk_add_checkins_errors(self):
+        """Tests that bulk adds need a contest runner and a list of URLs"""
+        c = Client()
+        self.assertTrue(c.login(username='user1', password='password1%'))
+        url = reverse('unvalidated-checkin-bulk', kwargs={'contest_id': 1})
+        response = c.post(url, content_type='application/json',
+                          data=json.dumps({'untappd_checkins': ['https://example.com/1']}))
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(c.login(username='runner1', password='password1%'))
+        response = c.post(url, content_type='application/json',
+                          data=json.dumps({'untappd_checkins': 'https://example.com/1'}))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('untappd_checkins', response.json())
+        # More URLs than can be scraped within one request
+        response = c.post(url, content_type='application/json',
+                          data=json.dumps({'untappd_checkins': [
+                              'https://example.com/{}'.format(i) for i in range(51)]}))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('untappd_checkins', response.json())
+
+    @mock.patch('beers.utils.checkin.parse_checkin', side_effect=copying_mock_parse_checkin)
+    def test_add_checkins_command(self, mocked_function):
+        """Tests adding checkins with the add_checkins command"""
+        out = io.StringIO()
+        call_command('add_checkins', '1', 'https://example.com/unvalidated_checkin_new',
+                     'https://example.com/unvalidated_2', '--concurrency', '2',
+                     stdout=out)
+        self.assertIn('https://example.com/unvalidated_checkin_new: created', out.getvalue())
+        self.assertIn('https://example.com/unvalidated_2: duplicate', out.getvalue())
+        self.assertIn('Added 1 of 2 checkins', out.getvalue())
+        self.assertTrue(Unvalidated_Checkin.objects.filter(
+            untappd_checkin='https://example.com/unvalidated_checkin_new').exists())
+        with self.assertRaises(CommandError):
+            call_command('add_checkins', '1', 'https://example.com/1',
+                         '--concurrency', '0', stdout=io.StringIO())
@@ -1,8 +1,16 @@
 """Tests the core contest features and their models"""
 
 import datetime
+import io
 import json
-from django.test import TestCase, override_settings, Client
+import random
+import threading
+from unittest.mock import patch
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, Client
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
 from django.utils import timezone
 from django.db.models import Q
@@ -10,6 +18,9 @@ from rest_framework import status
 from beers.models import Beer, Brewery, Contest, Contest_Player, \
                          Unvalidated_Checkin, Contest_Checkin, Contest_Beer, \
                          Contest_Brewery, Player
+from beers.utils import audit
+from beers.utils.audit import audit_scores
+from beers.utils.checkin import parse_assignment, validate_checkins
 
 @override_settings(SECURE_SSL_REDIRECT=False, ROOTURL_CONF='beers.urls')
 class ContestTestCase(TestCase):
@@ -494,6 +505,210 @@ class ContestTestCase(TestCase):
         self.__test_beer_and_brewery_calculations(player, [challenge], [])
         self.__test_beer_and_brewery_calculations(challenge.challenger, [challenge], [])
 
+    def test_batch_validate_checkins(self):
+        """
+        Tests that a batch of checkins is scored as if each were validated
+        in turn, with a result for each item
+        """
+        c = Client()
+        self.assertTrue(c.login(username='runner1', password='password1%'))
+        items = [{'checkin': 1, 'as_beer': 1},
+                 {'checkin': 2, 'as_beer': 2, 'bonuses': ['pun']},
+                 {'checkin': 3, 'as_brewery': 1},
+                 {'checkin': 6, 'as_beer': 6},
+                 {'checkin': 8, 'as_beer': 6},
+                 {'checkin': 10, 'as_beer': 1},
+                 {'checkin': 9999, 'as_beer': 1},
+                 {'checkin': 4, 'as_beer': 99},
+                 {'checkin': 1, 'as_beer': 1},
+                 {'checkin': 5, 'as_beer': 5, 'preserve': True},
+                 {'checkin': 'x'},
+                ]
+        response = c.post(reverse('checkin-batch-validate', kwargs={'contest_id': 1}),
+                          content_type='application/json',
+                          data=json.dumps({'checkins': items}))
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['validated'], 7)
+        self.assertEqual([(r['checkin'], r['status'], r['points']) for r in result['results']],
+                         [(1, 'validated', 1),
+                          (2, 'validated', 2),
+                          (3, 'validated', 3),
+                          (6, 'validated', 3),
+                          (8, 'validated', 12),
+                          (10, 'validated', 0),
+                          (9999, 'unknown_checkin', 0),
+                          (4, 'invalid', 0),
+                          (1, 'invalid', 0),
+                          (5, 'validated', 3),
+                          (None, 'invalid', 0),
+                         ])
+        self.assertEqual(result['results'][8]['error'], 'repeated in the list')
+        self.assertEqual(
+            sorted(Unvalidated_Checkin.objects.filter(id__lte=10).values_list('id', flat=True)),
+            [4, 5, 7, 9])
+        player = Contest_Player.objects.get(id=1)
+        self.assertEqual(player.beer_count, 4)
+        self.assertEqual(player.beer_points, 8)
+        self.assertEqual(player.brewery_points, 3)
+        self.assertEqual(player.bonus_points, 1)
+        self.assertEqual(player.last_checkin_beer, 'Beer 5')
+        challenger = Contest_Player.objects.get(id=3)
+        self.assertEqual(challenger.challenge_point_gain, 12)
+        self.assertEqual(challenger.challenge_point_loss, 3)
+        for cp in (player, challenger):
+            scored = (cp.beer_points, cp.brewery_points, cp.bonus_points,
+                      cp.challenge_point_gain, cp.challenge_point_loss, cp.total_points)
+            cp.compute_points()
+            self.assertEqual(scored,
+                             (cp.beer_points, cp.brewery_points, cp.bonus_points,
+                              cp.challenge_point_gain, cp.challenge_point_loss,
+                              cp.total_points))
+
+    def test_batch_validate_queries(self):
+        """
+        Tests that the number of queries to validate a batch doesn't grow
+        with the number of checkins
+        """
+        def validate(items):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(all(r.status == 'validated' for r in validate_checkins(
+                    1, [parse_assignment(item) for item in items])))
+            return len(queries)
+        small = validate([{'checkin': 1, 'as_beer': 1, 'bonuses': ['pun']},
+                          {'checkin': 2, 'as_brewery': 1}])
+        large = validate([{'checkin': 3, 'as_beer': 3, 'bonuses': ['pun']},
+                          {'checkin': 4, 'as_beer': 4},
+                          {'checkin': 5, 'as_beer': 5, 'bonuses': ['ballgame']},
+                          {'checkin': 7, 'as_brewery': 2},
+                          {'checkin': 9, 'as_brewery': 3}])
+        self.assertEqual(small, large)
+
+    def test_batch_validate_not_runner(self):
+        """Tests that only the contest runner can validate a batch"""
+        c = Client()
+        self.assertTrue(c.login(username='user1', password='password1%'))
+        response = c.post(reverse('checkin-batch-validate', kwargs={'contest_id': 1}),
+                          content_type='application/json',
+                          data=json.dumps({'checkins': [{'checkin': 1, 'as_beer': 1}]}))
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Unvalidated_Checkin.objects.filter(id=1).exists())
+
+    def test_recompute_scores(self):
+        """
+        Tests that recompute_scores rebuilds drifted scores from the
+        checkins in a fixed number of queries, and reports the drift
+        """
+        player = Contest_Player.objects.get(id=1)
+        player.drink_beer(Contest_Beer.objects.get(id=6),
+                          data={'checkin_time': timezone.now()})
+        player.drink_at_brewery(Contest_Brewery.objects.get(id=1),
+                                data={'checkin_time': timezone.now()})
+        expected = {cp.id: (cp.beer_count, cp.beer_points, cp.brewery_points,
+                            cp.challenge_point_loss, cp.total_points)
+                    for cp in Contest_Player.objects.filter(contest_id=1)}
+        Contest_Player.objects.filter(id=1).update(beer_points=10, total_points=20)
+        Contest_Player.objects.filter(id=3).update(challenge_point_loss=0)
+        out = io.StringIO()
+        call_command('recompute_scores', '1', '--dry-run', stdout=out)
+        self.assertIn('user1: beer_points 10 -> 3, total_points 20 -> 6', out.getvalue())
+        self.assertIn('Found 2 players', out.getvalue())
+        self.assertEqual(Contest_Player.objects.get(id=1).beer_points, 10)
+        # The savepoint, the lock, the GROUP BY, the update and the release
+        with self.assertNumQueries(5):
+            drifted = Contest_Player.objects.recompute_scores(1)
+        self.assertEqual(sorted(drift.contest_player.id for drift in drifted), [1, 3])
+        self.assertEqual({cp.id: (cp.beer_count, cp.beer_points, cp.brewery_points,
+                                  cp.challenge_point_loss, cp.total_points)
+                          for cp in Contest_Player.objects.filter(contest_id=1)},
+                         expected)
+        out = io.StringIO()
+        call_command('recompute_scores', '1', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Fixed 0 players whose scores had drifted')
+        with self.assertRaises(CommandError):
+            call_command('recompute_scores', '99', stdout=io.StringIO())
+
+    def __drink_some(self):
+        """Validates a few checkins, including a challenge beer"""
+        player = Contest_Player.objects.get(id=1)
+        for beer_id in (1, 2, 6):
+            player.drink_beer(Contest_Beer.objects.get(id=beer_id),
+                              data={'checkin_time': timezone.now()})
+        player.drink_at_brewery(Contest_Brewery.objects.get(id=1),
+                                data={'checkin_time': timezone.now()})
+        player.drink_bonus('pun', data={'checkin_time': timezone.now()})
+        Contest_Player.objects.get(id=3).drink_beer(
+            Contest_Beer.objects.get(id=6), data={'checkin_time': timezone.now()})
+
+    def test_audit_scores(self):
+        """
+        Tests that the audit reads the ledger in chunks without locking and
+        reports only the players whose scores disagree with it
+        """
+        self.__drink_some()
+        result = audit_scores(1, chunk_size=2)
+        self.assertEqual(result.mismatches, [])
+        self.assertEqual(result.checkins, Contest_Checkin.objects.count())
+        Contest_Player.objects.filter(id=1).update(bonus_points=5)
+        Contest_Player.objects.filter(id=3).update(challenge_point_loss=0, beer_count=3)
+        with CaptureQueriesContext(connection) as queries:
+            result = audit_scores(chunk_size=2)
+        self.assertFalse(any('FOR UPDATE' in query['sql'] for query in queries))
+        # Four chunks of 7 checkins, three of 4 players and one to check again
+        self.assertEqual((result.checkins, result.players, result.chunks),
+                         (7, 4, 8))
+        self.assertEqual(len(queries), 8)
+        self.assertEqual({drift.contest_player.id: drift.changes
+                          for drift in result.mismatches},
+                         {1: {'bonus_points': (5, 1)},
+                          3: {'challenge_point_loss': (0, 3), 'beer_count': (3, 1)}})
+        out = io.StringIO()
+        call_command('audit_scores', '--contest', '1', '--chunk-size', '3', stdout=out)
+        self.assertIn('contest 1 user1: bonus_points 5 != 1', out.getvalue())
+        self.assertIn('Audited 7 checkins of 4 players in 6 queries: 2 mismatched',
+                      out.getvalue())
+
+    def test_audit_scores_concurrent_checkin(self):
+        """
+        Tests that a checkin validated while the audit is reading isn't
+        reported as a mismatch
+        """
+        self.__drink_some()
+        chunks = audit._chunks
+        calls = []
+
+        def validate_between(queryset, chunk_size, counts):
+            yield from chunks(queryset, chunk_size, counts)
+            if not calls:
+                calls.append(queryset)
+                Contest_Player.objects.get(id=2).drink_beer(
+                    Contest_Beer.objects.get(id=3), data={'checkin_time': timezone.now()})
+
+        with patch.object(audit, '_chunks', validate_between):
+            result = audit_scores(1)
+        self.assertEqual(result.mismatches, [])
+        self.assertEqual(result.checkins, 7)
+
+    def test_challenge_checkin_queries(self):
+        """
+        Tests that checking into a challenge beer takes a fixed number of
+        queries, and that the challenger on the beer is kept up to date
+        """
+        challenge = Contest_Beer.objects.select_related('challenger').get(id=6)
+        player = Contest_Player.objects.get(id=1)
+        data = {
+            'untappd_checkin': 'https://untappd.com/checkin/beer',
+            'checkin_time': timezone.make_aware(datetime.datetime.now()),
+        }
+        # The savepoint, the lock, the aggregate, the insert, two updates
+        # and the release
+        with self.assertNumQueries(7):
+            player.drink_beer(challenge, data=data)
+        self.assertEqual(challenge.challenger.challenge_point_loss,
+                         challenge.challenge_point_loss)
+        with self.assertNumQueries(4):
+            self.assertIsNone(player.drink_beer(challenge, data=data))
+
     def test_bonus_points(self):
         """
         This tests that bonus points can be gained by a player.
@@ -682,3 +897,80 @@ class ContestTestCase(TestCase):
         self.assertTrue(breweries[5].checked_into)
         self.assertEqual(breweries[6].brewery_name, 'Zzzz Brewery')
         self.assertFalse(breweries[6].checked_into)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ConcurrentScoringTestCase(TransactionTestCase):
+    """
+    Validates checkins from several threads at once, so the scoring has to
+    hold up against other transactions rather than a single test transaction
+    """
+
+    fixtures = ['permissions',
+                'users',
+                'contest_tests',
+                ]
+    # Restores the content types the permissions fixture refers to, which
+    # flushing the database between transaction test cases removes
+    serialized_rollback = True
+
+    THREADS_PER_PLAYER = 3
+
+    def __drink(self, player_id, barrier, errors):
+        """Drinks every beer and brewery in the contest, in a random order"""
+        try:
+            player = Contest_Player.objects.get(id=player_id)
+            drinks = ([(player.drink_beer, beer) for beer in Contest_Beer.objects.all()]
+                      + [(player.drink_at_brewery, brewery)
+                         for brewery in Contest_Brewery.objects.all()])
+            random.shuffle(drinks)
+            barrier.wait()
+            for drink, target in drinks:
+                drink(target, data={
+                    'untappd_checkin': 'https://untappd.com/checkin/stress',
+                    'checkin_time': timezone.now(),
+                })
+            player.drink_bonus('pun', data={'checkin_time': timezone.now()})
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_concurrent_validations(self):
+        """
+        Tests that when each player's checkins are validated by several
+        threads at once, every beer and brewery is scored once, challengers
+        lose no more than their maximum, and no counter update is lost
+        """
+        players = list(Contest_Player.objects.values_list('id', flat=True))
+        errors = []
+        barrier = threading.Barrier(len(players) * self.THREADS_PER_PLAYER)
+        threads = [threading.Thread(target=self.__drink,
+                                    args=(player_id, barrier, errors))
+                   for player_id in players
+                   for _ in range(self.THREADS_PER_PLAYER)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        beer_count = Contest_Beer.objects.count()
+        for player_id in players:
+            player = Contest_Player.objects.get(id=player_id)
+            self.assertEqual(player.beer_count, beer_count)
+            self.assertEqual(player.bonus_points, self.THREADS_PER_PLAYER)
+            scored = {field: getattr(player, field) for field in
+                      ('beer_points', 'brewery_points', 'bonus_points',
+                       'challenge_point_gain', 'challenge_point_loss',
+                       'total_points')}
+            player.compute_points()
+            self.assertEqual(scored,
+                             {field: getattr(player, field) for field in scored},
+                             msg='Scores for {}'.format(player))
+        for challenge in Contest_Beer.objects.filter(challenger__isnull=False):
+            drinkers = len(players) - 1
+            self.assertEqual(
+                challenge.challenger.challenge_point_loss,
+                min(drinkers * challenge.challenge_point_loss,
+                    challenge.max_point_loss
+                    - challenge.max_point_loss % challenge.challenge_point_loss))
@@ -250,6 +250,31 @@ class ContestEditingTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('non_field_errors', response.json())
 
+    def test_add_beer_uses_stored_beer_by_url(self):
+        """
+        Tests that adding a beer reuses the beer stored under the same
+        canonical Untappd URL, whatever its name
+        """
+        stored = Beer.objects.create_beer('Beer One', 'Brewery One',
+                                          untappd_url='https://untappd.com/b/beer/1',
+                                          brewery_url='https://untappd.com/w/brewery/1')
+        c = Client()
+        self.assertTrue(c.login(username='runner1', password='password1%'))
+        contest = Contest.objects.get(name='Contest Base')
+        response = c.post(reverse('contest-beer-list', 
+                                  kwargs={'contest_id': contest.id}),
+                          content_type='application/json',
+                          data=json.dumps({'name': 'Beer 1',
+                                           'brewery': 'Brewery 1',
+                                           'untappd_url': 'http://www.untappd.com/b/beer/1/',
+                                           'brewery_url': 'https://untappd.com/w/brewery/1',
+                                           'point_value': 2}),
+                          HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Beer.objects.count(), 1)
+        contest_beer = Contest_Beer.objects.get(id=response.json()['id'])
+        self.assertEqual(contest_beer.beer.id, stored.id)
+
     def test_successful_delete_beer(self):
         """
         Tests whether a beer can be deleted successfully
@@ -317,6 +342,69 @@ class ContestEditingTestCase(TestCase):
         self.assertEqual(contest_brewery.point_value, 2)
         self.assertEqual(response.json()['id'], contest_brewery.id)
  
+    def test_add_beer_and_brewery_find_possible_matches(self):
+        """
+        Tests that adding a beer or brewery to a contest flags the
+        unvalidated checkins that were already waiting for it
+        """
+        c = Client()
+        self.assertTrue(c.login(username='runner1', password='password1%'))
+        contest = Contest.objects.get(name='Contest Base')
+        contest_player = Contest_Player.objects.get(contest=contest)
+        checkin_date = timezone.make_aware(datetime.datetime(2018, 2, 1))
+        beer_checkin = Unvalidated_Checkin.objects.create_checkin(
+            contest_player, 'Drinking Beer 1', 'Brewery 1', 'Beer 1',
+            'https://untappd.com/checkin/1', checkin_date)
+        brewery_checkin = Unvalidated_Checkin.objects.create_checkin(
+            contest_player, 'Drinking Beer 2', 'Brewery 2', 'Beer 2',
+            'https://untappd.com/checkin/2', checkin_date)
+        response = c.post(reverse('contest-beer-list',
+                                  kwargs={'contest_id': contest.id}),
+                          content_type='application/json',
+                          data=json.dumps({'name': 'Beer 1',
+                                           'brewery': 'Brewery 1',
+                                           'untappd_url': 'https://untappd.com/beer/1',
+                                           'brewery_url': 'https://untappd.com/brewery/1',
+                                           'point_value': 2}),
+                          HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        beer_checkin.refresh_from_db()
+        brewery_checkin.refresh_from_db()
+        self.assertTrue(beer_checkin.has_possibles)
+        self.assertFalse(brewery_checkin.has_possibles)
+        response = c.post(reverse('contest-brewery-list',
+                                  kwargs={'contest_id': contest.id}),
+                          content_type='application/json',
+                          data=json.dumps({'name': 'Brewery 2',
+                                           'untappd_url': 'https://untappd.com/brewery/2',
+                                           'location': 'Location 2',
+                                           'point_value': 2}),
+                          HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        brewery_checkin.refresh_from_db()
+        self.assertTrue(brewery_checkin.has_possibles)
+
+        # The validation page finds the match for a brewery-only checkin
+        # among the contest breweries, as no contest beer has its names
+        response = c.get(reverse('unvalidated-checkin-list',
+                                 kwargs={'contest_id': contest.id}),
+                         HTTP_ACCEPT='application/json')
+        flagged = {uv['beer']: uv for uv in response.json()['results']
+                   if uv['has_possibles']}
+        self.assertEqual(set(flagged), {'Beer 1', 'Beer 2'})
+        beers = c.get(reverse('contest-beer-list',
+                              kwargs={'contest_id': contest.id}),
+                      HTTP_ACCEPT='application/json').json()
+        breweries = c.get(reverse('contest-brewery-list',
+                                  kwargs={'contest_id': contest.id}),
+                          HTTP_ACCEPT='application/json').json()
+        self.assertFalse([b for b in beers if b['name'] == 'Beer 2'
+                          and b['brewery'] == 'Brewery 2'])
+        self.assertEqual([b['id'] for b in breweries
+                          if b['name'] == flagged['Beer 2']['brewery']],
+                         [Contest_Brewery.objects.get(
+                             contest=contest, brewery__name='Brewery 2').id])
+
     def test_nonunique_add_brewery(self):
         """
         Tests whether a brewery fails to be added to a contest based on non-unique
@@ -595,6 +683,32 @@ class ContestEditingTestCase(TestCase):
         self.assertIn('tag1', obj['hashtags'])
         self.assertIn('tag2', obj['hashtags'])
 
+    def test_success_update_bonus_hash_tags(self):
+        """
+        Tests that changing or deleting a bonus through the API is seen by
+        the loader's hash tag matching
+        """
+        c = Client()
+        self.assertTrue(c.login(username='runner1', password='password1%'))
+        contest = Contest.objects.get(name='Contest Base')
+        bonus = contest.add_bonus('bonus1', 'First Bonus', ['tag1'])
+        self.assertEqual(Contest_Bonus.objects.matching_tags(contest.id, ['tag1']),
+                         [bonus.id])
+        url = reverse('contest-bonus-detail',
+                      kwargs={'contest_id': contest.id,
+                              'contest_bonus_id': bonus.id})
+        response = c.patch(url,
+                           content_type='application/json',
+                           data=json.dumps({'hashtags': ['tag9']}),
+                           HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Contest_Bonus.objects.matching_tags(contest.id, ['tag1']), [])
+        self.assertEqual(Contest_Bonus.objects.matching_tags(contest.id, ['tag9']),
+                         [bonus.id])
+        response = c.delete(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Contest_Bonus.objects.matching_tags(contest.id, ['tag9']), [])
+
     def test_failed_duplicate_bonus_hash_tag(self):
         c = Client()
         self.assertTrue(c.login(username='runner1', password='password1%'))
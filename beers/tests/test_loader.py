@@ -7,26 +7,109 @@ import io
 import tempfile
 import os
 import re
+import subprocess
+import sys
 import uuid
+import zipfile
 import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from string import Template
+from types import SimpleNamespace
+from urllib.parse import quote
 from unittest.mock import patch, MagicMock
 from unittest import skip
 import boto3
 import botocore.session
 from botocore.stub import Stubber
-from django.test import TestCase, override_settings
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from beers.models import Contest_Beer, Beer, Contest, Player, \
-                         Contest_Checkin, Unvalidated_Checkin, Contest_Bonus
+from beers.models import Contest_Beer, Beer, Contest, Player, Contest_Player, \
+                         Contest_Checkin, Unvalidated_Checkin, Contest_Bonus, \
+                         Player_Feed, Brewery, Feed_Job
 from beers.utils.loader import create_contest_from_csv
 from beers.utils.checkin import load_player_checkins
+from beers.utils import checkin as checkin_utils
+from beers.utils.feeds import iter_entries, fetch_feeds, RssEntry, FeedStats, \
+                               FETCHED, FAILED
+from beers.utils import locks
 from hundred_beers.settings import BASE_DIR
 
 FAKE_ARN = 'this_is_a_long_fake_arn'
+TEST_CHECKINS_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'test-data', 'test-checkins.xml')
+MANAGE_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), 'manage.py')
+# load_checkins only loads contests that are running, so contests loading
+# the 2017 test feed with it run from 2017 until after now
+RUNNING_END_DATE = timezone.now() + datetime.timedelta(days=365)
+
+
+class FeedServer:
+    """
+    A local HTTP stand-in for Untappd that serves RSS feeds out of a
+    dictionary of path to file name, waiting for latency seconds before
+    answering each request. If validators is set, the feeds are sent with an
+    ETag and a 304 is returned when the request's If-None-Match matches it.
+    """
+
+    def __init__(self, feeds, latency=0, validators=False):
+        self.feeds = feeds
+        self.latency = latency
+        self.validators = validators
+        self.requests = []
+        self.responses = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                time.sleep(server.latency)
+                if self.path not in server.feeds:
+                    self.send_error(404)
+                    return
+                with open(server.feeds[self.path], 'rb') as feed:
+                    body = feed.read()
+                etag = '"{}"'.format(len(body))
+                if server.validators and self.headers.get('If-None-Match') == etag:
+                    server.responses.append(304)
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                server.responses.append(200)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/rss+xml')
+                self.send_header('Content-Length', str(len(body)))
+                if server.validators:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+
+    def url(self, path):
+        """Returns the full URL for a path on this server"""
+        return 'http://127.0.0.1:{}{}'.format(self.httpd.server_port, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
 
 def sts_boto_patch(client_type):
@@ -288,7 +371,7 @@ Brewery 5,Beer 5,https://example.com/untapped4,ST,3
             'test-data', 'test-checkins.xml')
         player.save()
         start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
-        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        end_date = RUNNING_END_DATE
         contest = Contest.objects.create_contest('Contest',
                                                  runner,
                                                  start_date,
@@ -311,7 +394,7 @@ Brewery 5,Beer 5,https://example.com/untapped4,ST,3
             'test-data', 'test-checkins.xml')
         player.save()
         start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
-        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        end_date = RUNNING_END_DATE
         contest = Contest.objects.create_contest('Contest',
                                                  runner,
                                                  start_date,
@@ -328,7 +411,7 @@ Brewery 5,Beer 5,https://example.com/untapped4,ST,3
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                             'test-data', 'test-checkins.xml')
         start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
-        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        end_date = RUNNING_END_DATE
         runner = Player.objects.get(id=4)
         runner.untappd_rss = path
         runner.save()
@@ -360,7 +443,7 @@ Brewery 5,Beer 5,https://example.com/untapped4,ST,3
             'test-data', 'test-checkins.xml')
         player.save()
         start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
-        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        end_date = RUNNING_END_DATE
         contest = Contest.objects.create_contest('Contest',
                                                  runner,
                                                  start_date,
@@ -392,6 +475,802 @@ Brewery 5,Beer 5,https://example.com/untapped4,ST,3
         with self.assertRaises(CommandError):
             call_command('load_checkins', '--after-date', 'is not a date')
 
+    def test_concurrent_checkin_command_for_all(self):
+        """Tests loading all the feeds from a server with several downloads at once"""
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = RUNNING_END_DATE
+        runner = Player.objects.get(id=4)
+        player = Player.objects.get(id=1)
+        feeds = {'/rss/runner': TEST_CHECKINS_XML, '/rss/player': TEST_CHECKINS_XML}
+        with FeedServer(feeds, latency=0.1) as server:
+            runner.untappd_rss = server.url('/rss/runner')
+            runner.save()
+            player.untappd_rss = server.url('/rss/player')
+            player.save()
+            contest = Contest.objects.create_contest('Contest',
+                                                     runner,
+                                                     start_date,
+                                                     end_date)
+            contest.add_player(player)
+            call_command('load_checkins', '--concurrency', '2')
+            self.assertEqual(len(server.requests), 2)
+        self.assertEqual(Unvalidated_Checkin.objects.all().count(), 50)
+
+    def __start_feed_contest(self, server):
+        """Creates a running contest with user1 reading the test feed from the server"""
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = RUNNING_END_DATE
+        runner = Player.objects.get(id=4)
+        player = Player.objects.get(id=1)
+        player.untappd_rss = server.url('/rss/player')
+        player.save()
+        contest = Contest.objects.create_contest('Contest',
+                                                 runner,
+                                                 start_date,
+                                                 end_date)
+        return contest.add_player(player)
+
+    def test_not_modified_feed_is_skipped(self):
+        """Tests that a feed answering 304 to a conditional request isn't parsed"""
+        feeds = {'/rss/player': TEST_CHECKINS_XML}
+        with FeedServer(feeds, validators=True) as server:
+            contest_player = self.__start_feed_contest(server)
+            out = io.StringIO()
+            call_command('load_checkins', stdout=out)
+            self.assertIn('1 loaded', out.getvalue())
+            with patch('beers.utils.feeds.iter_entries') as parse:
+                out = io.StringIO()
+                call_command('load_checkins', stdout=out)
+                parse.assert_not_called()
+            self.assertIn('1 not modified', out.getvalue())
+            self.assertEqual(server.responses, [200, 304])
+            self.assertEqual(server.requests[1][1]['If-None-Match'],
+                             Player_Feed.objects.get(
+                                 player=contest_player.player).etag)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+
+    def test_unchanged_feed_is_skipped(self):
+        """Tests that a feed without validators is skipped if its content is the same"""
+        feeds = {'/rss/player': TEST_CHECKINS_XML}
+        with FeedServer(feeds) as server:
+            self.__start_feed_contest(server)
+            call_command('load_checkins', stdout=io.StringIO())
+            with patch('beers.utils.feeds.iter_entries') as parse:
+                out = io.StringIO()
+                call_command('load_checkins', stdout=out)
+                parse.assert_not_called()
+            self.assertIn('1 unchanged', out.getvalue())
+            self.assertEqual(server.responses, [200, 200])
+
+    def test_joining_contest_reloads_unchanged_feed(self):
+        """Tests that a player joining a contest has their feed loaded in full"""
+        feeds = {'/rss/player': TEST_CHECKINS_XML}
+        with FeedServer(feeds, validators=True) as server:
+            contest_player = self.__start_feed_contest(server)
+            call_command('load_checkins', stdout=io.StringIO())
+            contest = Contest.objects.create_contest(
+                'Another Contest', Player.objects.get(id=4),
+                timezone.make_aware(datetime.datetime(2017, 1, 1)),
+                RUNNING_END_DATE)
+            other_player = contest.add_player(contest_player.player)
+            out = io.StringIO()
+            call_command('load_checkins', stdout=out)
+            self.assertIn('1 loaded', out.getvalue())
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=other_player).count(), 25)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+
+    def test_checkin_command_loads_running_contests(self):
+        """
+        Tests that only players with a feed in running contests that aren't
+        archived are loaded, unless their contest is asked for
+        """
+        feeds = {'/rss/player': TEST_CHECKINS_XML, '/rss/ended': TEST_CHECKINS_XML,
+                 '/rss/archived': TEST_CHECKINS_XML}
+        with FeedServer(feeds) as server:
+            runner = Player.objects.get(id=4)
+            runner.untappd_rss = None
+            runner.save()
+            contest_player = self.__start_feed_contest(server)
+            ended_player = Player.objects.get(id=2)
+            ended_player.untappd_rss = server.url('/rss/ended')
+            ended_player.save()
+            ended = Contest.objects.create_contest(
+                'Ended Contest', runner,
+                timezone.make_aware(datetime.datetime(2017, 1, 1)),
+                timezone.make_aware(datetime.datetime(2017, 12, 31)))
+            ended.add_player(ended_player)
+            archived_player = Player.objects.get(id=3)
+            archived_player.untappd_rss = server.url('/rss/archived')
+            archived_player.save()
+            archived = Contest.objects.create_contest(
+                'Archived Contest', runner,
+                timezone.make_aware(datetime.datetime(2017, 1, 1)),
+                RUNNING_END_DATE)
+            archived.archived = True
+            archived.save()
+            archived.add_player(archived_player)
+
+            self.assertEqual(list(Contest_Player.objects.loadable(timezone.now())),
+                             [contest_player])
+            # Contests that ended within the grace period are still loaded
+            grace = datetime.timedelta(seconds=settings.CHECKIN_CONTEST_GRACE)
+            self.assertTrue(Contest_Player.objects.loadable(
+                ended.end_date + grace / 2).filter(contest=ended).exists())
+            self.assertFalse(Contest_Player.objects.loadable(
+                ended.end_date + grace * 2).filter(contest=ended).exists())
+
+            call_command('load_checkins', stdout=io.StringIO())
+            self.assertEqual([path for path, _ in server.requests], ['/rss/player'])
+            call_command('load_checkins', '--contest', ended.id,
+                         stdout=io.StringIO())
+            self.assertEqual([path for path, _ in server.requests],
+                             ['/rss/player', '/rss/ended'])
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player__contest=ended).count(), 25)
+        self.assertFalse(Unvalidated_Checkin.objects.filter(
+            contest_player__contest=archived).exists())
+
+    def test_poller_and_worker_skip_ended_contests(self):
+        """
+        Tests that poll_checkins and checkin_worker only load a player's
+        checkins into the contests that are running, not ones that ended
+        """
+        with FeedServer({'/rss/player': TEST_CHECKINS_XML}) as server:
+            runner = Player.objects.get(id=4)
+            runner.untappd_rss = None
+            runner.save()
+            contest_player = self.__start_feed_contest(server)
+            ended = Contest.objects.create_contest(
+                'Ended Contest', runner,
+                timezone.make_aware(datetime.datetime(2017, 1, 1)),
+                timezone.make_aware(datetime.datetime(2017, 12, 31)))
+            ended.add_player(contest_player.player)
+            call_command('poll_checkins', '--once', stdout=io.StringIO())
+            self.assertEqual(Unvalidated_Checkin.objects.filter(
+                contest_player=contest_player).count(), 25)
+            self.assertFalse(Unvalidated_Checkin.objects.filter(
+                contest_player__contest=ended).exists())
+            Unvalidated_Checkin.objects.all().delete()
+            Contest_Player.objects.filter(id=contest_player.id).update(
+                last_checkin_load=contest_player.contest.start_date)
+            Player_Feed.objects.all().delete()
+            call_command('queue_checkins', stdout=io.StringIO())
+            call_command('checkin_worker', '--exit-when-empty',
+                         stdout=io.StringIO())
+            self.assertEqual(len(server.requests), 2)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+        self.assertFalse(Unvalidated_Checkin.objects.filter(
+            contest_player__contest=ended).exists())
+
+    def test_poll_checkins_adapts_schedule(self):
+        """
+        Tests that polling only loads players in running contests whose feed
+        is due, and that players without new checkins back off
+        """
+        poll_time = timezone.make_aware(datetime.datetime(2017, 6, 15))
+        feeds = {'/rss/player': TEST_CHECKINS_XML, '/rss/idle': TEST_CHECKINS_XML}
+        with FeedServer(feeds) as server:
+            runner = Player.objects.get(id=4)
+            runner.untappd_rss = None
+            runner.save()
+            contest_player = self.__start_feed_contest(server)
+            idle = Player.objects.get(id=2)
+            idle.untappd_rss = server.url('/rss/idle')
+            idle.save()
+            ended = Contest.objects.create_contest(
+                'Ended Contest', runner,
+                timezone.make_aware(datetime.datetime(2016, 1, 1)),
+                timezone.make_aware(datetime.datetime(2016, 12, 31)))
+            ended.add_player(idle)
+            with patch('django.utils.timezone.now', return_value=poll_time):
+                call_command('poll_checkins', '--once', stdout=io.StringIO())
+                # Nobody is due right after a poll
+                call_command('poll_checkins', '--once', stdout=io.StringIO())
+            self.assertEqual([path for path, _ in server.requests], ['/rss/player'])
+            self.assertEqual(Unvalidated_Checkin.objects.filter(
+                contest_player=contest_player).count(), 25)
+            feed = Player_Feed.objects.get(player=contest_player.player)
+            interval = settings.CHECKIN_POLL_MIN_INTERVAL
+            self.assertEqual(feed.poll_interval, interval)
+            self.assertEqual(feed.next_poll,
+                             poll_time + datetime.timedelta(seconds=interval))
+            self.assertFalse(Player_Feed.objects.filter(player=idle).exists())
+            with patch('django.utils.timezone.now', return_value=feed.next_poll):
+                call_command('poll_checkins', '--once', stdout=io.StringIO())
+            self.assertEqual(len(server.requests), 2)
+            feed.refresh_from_db()
+            self.assertEqual(feed.poll_interval, interval * 2)
+
+    def test_checkin_worker_runs_queued_jobs(self):
+        """
+        Tests that queued feed jobs are run once by a worker, which records
+        their result and duration
+        """
+        feeds = {'/rss/player': TEST_CHECKINS_XML}
+        with FeedServer(feeds) as server:
+            runner = Player.objects.get(id=4)
+            runner.untappd_rss = None
+            runner.save()
+            contest_player = self.__start_feed_contest(server)
+            out = io.StringIO()
+            call_command('queue_checkins', stdout=out)
+            call_command('queue_checkins', stdout=out)
+            self.assertEqual(out.getvalue().splitlines(),
+                             ['Queued 1 feed jobs', 'Queued 0 feed jobs'])
+            call_command('checkin_worker', '--exit-when-empty',
+                         '--name', 'worker-1', stdout=io.StringIO())
+            self.assertEqual(len(server.requests), 1)
+        job = Feed_Job.objects.get()
+        self.assertEqual(job.player, contest_player.player)
+        self.assertEqual(job.status, Feed_Job.DONE)
+        self.assertEqual(job.worker, 'worker-1')
+        self.assertEqual(job.checkins_loaded, 25)
+        self.assertEqual(job.result, 'fetched: 25 new checkins')
+        self.assertIsNotNone(job.duration)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+
+    def test_failing_feed_backs_off(self):
+        """
+        Tests that a feed that keeps failing is skipped for longer after each
+        failure, and is tried again once its failures are reset
+        """
+        with FeedServer({}) as server:
+            runner = Player.objects.get(id=4)
+            runner.untappd_rss = None
+            runner.save()
+            contest_player = self.__start_feed_contest(server)
+            player = contest_player.player
+            out = io.StringIO()
+            call_command('load_checkins', stdout=out)
+            self.assertIn('1 failed', out.getvalue())
+            self.assertIn('failed user1: HTTP Error 404', out.getvalue())
+            feed = Player_Feed.objects.get(player=player)
+            self.assertEqual(feed.failures, 1)
+            backoff = datetime.timedelta(seconds=settings.CHECKIN_FEED_BACKOFF)
+            self.assertLess(feed.retry_after - timezone.now(), backoff)
+            out = io.StringIO()
+            call_command('load_checkins', stdout=out)
+            self.assertIn('1 broken', out.getvalue())
+            self.assertEqual(len(server.requests), 1)
+            Player_Feed.objects.filter(player=player).update(
+                retry_after=timezone.now())
+            call_command('load_checkins', stdout=io.StringIO())
+            feed.refresh_from_db()
+            self.assertEqual(feed.failures, 2)
+            self.assertGreater(feed.retry_after - timezone.now(), backoff)
+            self.assertEqual(len(server.requests), 2)
+            Player_Feed.objects.reset_failures(player)
+            server.feeds['/rss/player'] = TEST_CHECKINS_XML
+            call_command('load_checkins', stdout=io.StringIO())
+            self.assertEqual(len(server.requests), 3)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+
+    def test_malformed_feed_backs_off(self):
+        """
+        Tests that a feed which fails to parse as its entries are read is
+        reported and backed off from like one that failed to download
+        """
+        rssfile = tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False)
+        with rssfile, open(TEST_CHECKINS_XML) as feed:
+            rssfile.write(feed.read()[:2000])
+        self.addCleanup(os.remove, rssfile.name)
+        with FeedServer({'/rss/player': rssfile.name}) as server:
+            runner = Player.objects.get(id=4)
+            runner.untappd_rss = None
+            runner.save()
+            contest_player = self.__start_feed_contest(server)
+            out = io.StringIO()
+            call_command('load_checkins', stdout=out)
+            self.assertIn('1 failed', out.getvalue())
+            self.assertIn('failed user1: unable to parse feed', out.getvalue())
+            feed = Player_Feed.objects.get(player=contest_player.player)
+            self.assertEqual(feed.failures, 1)
+            out = io.StringIO()
+            call_command('load_checkins', stdout=out)
+            self.assertIn('1 broken', out.getvalue())
+            self.assertEqual(len(server.requests), 1)
+
+    def test_unconditional_feeds_need_no_saved_players(self):
+        """
+        Tests that fetching feeds without conditional requests doesn't touch
+        Player_Feed, so it works for players that were never saved
+        """
+        with FeedServer({'/rss/0': TEST_CHECKINS_XML}) as server:
+            players = [SimpleNamespace(id=i, untappd_rss=server.url('/rss/{}'.format(i)))
+                       for i in range(2)]
+            stats = FeedStats()
+            with self.assertNumQueries(0):
+                results = [(player, feed.status, sum(1 for _ in feed.entries or ()))
+                           for player, feed in fetch_feeds(players, conditional=False,
+                                                           stats=stats)]
+        self.assertEqual(results, [(players[0], FETCHED, 25), (players[1], FAILED, 0)])
+        self.assertEqual(stats.counts[FAILED], 1)
+
+    @override_settings(CHECKIN_FEED_TIMEOUT=1)
+    def test_slow_feeds_time_out_and_deadline_skips(self):
+        """
+        Tests that a feed slower than the timeout fails, and that feeds after
+        the run's deadline aren't downloaded
+        """
+        feeds = {'/rss/player': TEST_CHECKINS_XML, '/rss/other': TEST_CHECKINS_XML}
+        with FeedServer(feeds, latency=1.5) as server:
+            runner = Player.objects.get(id=4)
+            runner.untappd_rss = None
+            runner.save()
+            contest_player = self.__start_feed_contest(server)
+            other = Player.objects.get(id=2)
+            other.untappd_rss = server.url('/rss/other')
+            other.save()
+            contest_player.contest.add_player(other)
+            out = io.StringIO()
+            call_command('load_checkins', '--concurrency', '1',
+                         '--deadline', '1', stdout=out)
+            self.assertEqual(len(server.requests), 1)
+        self.assertIn('1 failed, 1 skipped', out.getvalue())
+        self.assertIn('skipped', out.getvalue().splitlines()[-1])
+        self.assertEqual(Unvalidated_Checkin.objects.all().count(), 0)
+
+    def __write_partial_feed(self, count):
+        """Writes a temporary copy of the test feed with only the first count items"""
+        with open(TEST_CHECKINS_XML) as feed:
+            xml = feed.read()
+        items = re.findall(r'\s*<item>.*?</item>', xml, re.DOTALL)
+        start = xml.index(items[0])
+        end = xml.index(items[-1]) + len(items[-1])
+        rssfile = tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False)
+        with rssfile:
+            rssfile.write(xml[:start] + ''.join(items[:count]) + xml[end:])
+        self.addCleanup(os.remove, rssfile.name)
+        return rssfile.name
+
+    def test_duplicate_checkins_use_constant_queries(self):
+        """
+        Tests that reloading a feed whose entries are all loaded takes the
+        same number of queries no matter how many entries the feed has
+        """
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        contest = Contest.objects.create_contest('Contest',
+                                                 Player.objects.get(id=4),
+                                                 start_date,
+                                                 end_date)
+        query_counts = []
+        for player_id, size in ((1, 5), (2, 25)):
+            player = Player.objects.get(id=player_id)
+            player.untappd_rss = self.__write_partial_feed(size)
+            player.save()
+            contest_player = contest.add_player(player)
+            load_player_checkins(player)
+            self.assertEqual(Unvalidated_Checkin.objects.filter(
+                contest_player=contest_player).count(), size)
+            with CaptureQueriesContext(connection) as queries:
+                load_player_checkins(player, from_date=start_date)
+            query_counts.append(len(queries))
+            self.assertEqual(Unvalidated_Checkin.objects.filter(
+                contest_player=contest_player).count(), size)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_new_checkins_are_bulk_inserted(self):
+        """Tests that a player's new checkins are saved with a single insert"""
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        player = Player.objects.get(id=1)
+        player.untappd_rss = TEST_CHECKINS_XML
+        player.save()
+        for name in ('Contest', 'Another Contest'):
+            contest = Contest.objects.create_contest(name,
+                                                     Player.objects.get(id=4),
+                                                     start_date,
+                                                     end_date)
+            contest.add_player(player)
+        with CaptureQueriesContext(connection) as queries:
+            load_player_checkins(player)
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "beers_unvalidated_checkin"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Unvalidated_Checkin.objects.all().count(), 50)
+
+    def test_feed_stops_at_earliest_last_load(self):
+        """
+        Tests that a newest first feed is only parsed down to the earliest
+        last load date of the player's contests, and that each contest
+        only gets the checkins after its own last load date
+        """
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        player = Player.objects.get(id=1)
+        player.untappd_rss = TEST_CHECKINS_XML
+        player.save()
+        contest_players = []
+        for name, last_load in (('Contest', datetime.datetime(2017, 6, 1)),
+                                ('Another Contest', datetime.datetime(2017, 5, 27))):
+            contest = Contest.objects.create_contest(name,
+                                                     Player.objects.get(id=4),
+                                                     start_date,
+                                                     end_date)
+            contest_player = contest.add_player(player)
+            contest_player.last_checkin_load = timezone.make_aware(last_load)
+            contest_player.save()
+            contest_players.append(contest_player)
+        with patch('beers.utils.checkin.parse_entry',
+                   wraps=checkin_utils.parse_entry) as parse_entry:
+            load_player_checkins(player)
+        self.assertEqual(parse_entry.call_count, 16)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_players[0]).count(), 4)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_players[1]).count(), 16)
+        contest_players[0].refresh_from_db()
+        self.assertEqual(contest_players[0].last_checkin_load,
+                         datetime.datetime(2017, 6, 2, 22, 45, 8,
+                                           tzinfo=datetime.timezone.utc))
+
+    def test_streamed_feed_stops_reading_at_last_load(self):
+        """
+        Tests that the streaming parser yields the feed's items and that
+        only the entries down to the last load date are read from it
+        """
+        entries = list(iter_entries(TEST_CHECKINS_XML))
+        self.assertEqual(len(entries), 25)
+        self.assertEqual(entries[0], RssEntry(
+            'https://untappd.com/user/instagrahameileen/checkin/460106816',
+            'Eileen G. is drinking a Hopmouth Double IPA by  Arcadia Brewing '
+            + 'Company (Arcadia Ales) at Iron Horse Tap Room',
+            'Fri, 02 Jun 2017 22:45:08 +0000',
+            "There's a weird sour flavor in here."))
+        read = []
+        def _counting(entries):
+            for entry in entries:
+                read.append(entry)
+                yield entry
+        prepared = checkin_utils.prepare_entries(
+            _counting(iter_entries(TEST_CHECKINS_XML)),
+            timezone.make_aware(datetime.datetime(2017, 6, 1)))
+        self.assertEqual(len(prepared), 4)
+        self.assertEqual(len(read), 5)
+
+    def test_malformed_feed_is_not_loaded(self):
+        """Tests that a feed that isn't valid XML loads nothing"""
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        player = Player.objects.get(id=1)
+        with open(TEST_CHECKINS_XML) as feed:
+            xml = feed.read()
+        rssfile = tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False)
+        with rssfile:
+            rssfile.write(xml[:xml.index('</item>', len(xml) // 2)])
+        self.addCleanup(os.remove, rssfile.name)
+        player.untappd_rss = rssfile.name
+        player.save()
+        contest = Contest.objects.create_contest('Contest',
+                                                 Player.objects.get(id=4),
+                                                 start_date,
+                                                 timezone.make_aware(
+                                                     datetime.datetime(2017, 12, 31)))
+        contest_player = contest.add_player(player)
+        self.assertEqual(load_player_checkins(player), [])
+        contest_player.refresh_from_db()
+        self.assertEqual(contest_player.last_checkin_load, start_date)
+        self.assertEqual(Unvalidated_Checkin.objects.all().count(), 0)
+
+    def test_checkin_worker_reads_new_bonuses(self):
+        """
+        Tests that a worker that read the bonus tags before a bonus was
+        added, e.g. by the web tier, matches the new bonus on its next job
+        """
+        with FeedServer({'/rss/player': TEST_CHECKINS_XML}) as server:
+            contest_player = self.__start_feed_contest(server)
+            contest_id = contest_player.contest_id
+            self.assertEqual(Contest_Bonus.objects.matching_tags(
+                contest_id, ('holleymacctrimony',)), [])
+            # Added without clearing this process's index
+            bonus = Contest_Bonus.objects.create(contest_id=contest_id,
+                                                 name='wedding',
+                                                 hashtags=['holleymacctrimony'])
+            call_command('queue_checkins', stdout=io.StringIO())
+            call_command('checkin_worker', '--exit-when-empty', stdout=io.StringIO())
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            possible_bonuses__contains=[bonus.id]).count(), 2)
+
+    def test_bonus_tag_index_follows_add_bonus(self):
+        """
+        Tests that a contest's hash tags are matched to bonuses from memory
+        and that adding a bonus is picked up
+        """
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        contest = Contest.objects.create_contest('Contest',
+                                                 Player.objects.get(id=4),
+                                                 start_date,
+                                                 end_date)
+        bonus1 = contest.add_bonus('bonus1', 'Bonus 1', 'tag1,tag2')
+        self.assertEqual(Contest_Bonus.objects.matching_tags(contest.id, ('tag2',)),
+                         [bonus1.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(Contest_Bonus.objects.matching_tags(
+                contest.id, ('tag1', 'tag2', 'other')), [bonus1.id])
+            self.assertEqual(Contest_Bonus.objects.matching_tags(
+                contest.id, ('other',)), [])
+        bonus2 = contest.add_bonus('bonus2', 'Bonus 2', 'tag3')
+        self.assertEqual(Contest_Bonus.objects.matching_tags(contest.id,
+                                                             ('tag3', 'tag1')),
+                         sorted([bonus1.id, bonus2.id]))
+
+    def test_find_possible_matches_for_contest(self):
+        """
+        Tests that a contest's unvalidated checkins are matched against its
+        beers and breweries, and unmatched when those are removed
+        """
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        contest = Contest.objects.create_contest('Contest',
+                                                 Player.objects.get(id=4),
+                                                 start_date,
+                                                 end_date)
+        contest_player = contest.add_player(Player.objects.get(id=1))
+        checkins = [Unvalidated_Checkin.objects.create_checkin(
+                        contest_player, 'Drinking {}'.format(beer), brewery, beer,
+                        'https://untappd.com/checkin/{}'.format(i), start_date)
+                    for i, (beer, brewery) in enumerate((('Beer 1', 'Brewery 1'),
+                                                         ('Beer 2', 'Brewery 2'),
+                                                         ('Beer 3', 'Brewery 3')))]
+        contest_beer = contest.add_beer(Beer.objects.create_beer('Beer 1', 'Brewery 1'))
+        contest.add_brewery(Brewery.objects.create_brewery(
+            'Brewery 2', 'https://untappd.com/brewery/2'))
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                Unvalidated_Checkin.objects.find_possible_matches(contest.id), 2)
+        self.assertEqual([uv.has_possibles for uv in Unvalidated_Checkin.objects.filter(
+                              contest_player=contest_player).order_by('id')],
+                         [True, True, False])
+        contest_beer.delete()
+        self.assertEqual(
+            Unvalidated_Checkin.objects.find_possible_matches(contest.id), 1)
+        checkins[0].refresh_from_db()
+        self.assertFalse(checkins[0].has_possibles)
+
+    def test_failed_load_keeps_last_checkin_load(self):
+        """
+        Tests that a failure while saving a player's checkins leaves neither
+        checkins nor an advanced last load date behind
+        """
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = timezone.make_aware(datetime.datetime(2017, 12, 31))
+        player = Player.objects.get(id=1)
+        player.untappd_rss = TEST_CHECKINS_XML
+        player.save()
+        contest = Contest.objects.create_contest('Contest',
+                                                 Player.objects.get(id=4),
+                                                 start_date,
+                                                 end_date)
+        contest_player = contest.add_player(player)
+        with patch.object(Unvalidated_Checkin.objects, 'find_possible_matches',
+                          side_effect=RuntimeError('Failed matching')):
+            with self.assertRaises(RuntimeError):
+                load_player_checkins(player)
+        contest_player.refresh_from_db()
+        self.assertEqual(contest_player.last_checkin_load, start_date)
+        self.assertEqual(Unvalidated_Checkin.objects.all().count(), 0)
+
+    def __start_replay_contest(self):
+        """Creates a running contest with user1 and a feed URL that can't be reached"""
+        runner = Player.objects.get(id=4)
+        runner.untappd_rss = None
+        runner.save()
+        player = Player.objects.get(id=1)
+        player.untappd_rss = 'http://127.0.0.1:1/rss/player'
+        player.save()
+        contest = Contest.objects.create_contest(
+            'Contest', runner,
+            timezone.make_aware(datetime.datetime(2017, 1, 1)),
+            RUNNING_END_DATE)
+        return contest.add_player(player)
+
+    def test_checkin_command_from_source_directory(self):
+        """Tests loading checkins from a directory of saved feeds"""
+        contest_player = self.__start_replay_contest()
+        with tempfile.TemporaryDirectory() as source:
+            with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                    open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                saved.write(feed.read())
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source, stdout=out)
+        self.assertIn('1 loaded', out.getvalue())
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+        self.assertFalse(Player_Feed.objects.exists())
+
+    def test_checkin_command_source_without_rss(self):
+        """
+        Tests that a saved feed is loaded for a player who has no RSS URL,
+        as it is found by user name
+        """
+        contest_player = self.__start_replay_contest()
+        Player.objects.filter(id=contest_player.player_id).update(untappd_rss=None)
+        with tempfile.TemporaryDirectory() as source:
+            with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                    open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                saved.write(feed.read())
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source, stdout=out)
+        self.assertIn('1 loaded', out.getvalue())
+        self.assertIn('0 failed', out.getvalue())
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+
+    def test_checkin_command_from_source_archive(self):
+        """Tests loading checkins from a zip archive of saved feeds"""
+        contest_player = self.__start_replay_contest()
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'feeds.zip')
+            with zipfile.ZipFile(source, 'w') as archive:
+                archive.write(TEST_CHECKINS_XML, 'feeds/user1.xml')
+            call_command('load_checkins', '--source', source,
+                         stdout=io.StringIO())
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+
+    def test_checkin_command_json_report(self):
+        """Tests that --report json prints the run's metrics"""
+        self.__start_replay_contest()
+        with tempfile.TemporaryDirectory() as source:
+            with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                    open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                saved.write(feed.read())
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source,
+                         '--report', 'json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['feeds']['fetched'], 1)
+        self.assertEqual(report['rows_inserted'], 25)
+        self.assertEqual(report['bytes'], os.path.getsize(TEST_CHECKINS_XML))
+        self.assertGreaterEqual(report['entries']['seen'], 25)
+        for phase in ('select', 'fetch', 'parse', 'build', 'insert', 'match',
+                      'total'):
+            self.assertIn(phase, report['phases'])
+        self.assertEqual([feed['player'] for feed in report['slowest_feeds']],
+                         ['user1'])
+
+        # Loading again finds only duplicates
+        with tempfile.TemporaryDirectory() as source:
+            with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                    open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                saved.write(feed.read())
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source, '--after-date',
+                         '2016-12-31', '--report', 'json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['rows_inserted'], 0)
+        self.assertEqual(report['entries']['duplicate'], 25)
+
+    def test_checkin_command_report_counts_entries_once(self):
+        """
+        Tests that the report counts each skipped entry once for a player
+        in several contests, including the entries before a contest started
+        """
+        contest_player = self.__start_replay_contest()
+        june = Contest.objects.create_contest(
+            'June', contest_player.contest.creator,
+            timezone.make_aware(datetime.datetime(2017, 6, 1)),
+            RUNNING_END_DATE)
+        june.add_player(contest_player.player)
+
+        def report(*args):
+            with tempfile.TemporaryDirectory() as source:
+                with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                        open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                    saved.write(feed.read())
+                out = io.StringIO()
+                call_command('load_checkins', '--source', source,
+                             '--report', 'json', *args, stdout=out)
+            return json.loads(out.getvalue())
+
+        # The May entries are loaded for the first contest
+        first = report()
+        self.assertEqual(first['rows_inserted'], 29)
+        self.assertNotIn('out_of_window', first['entries'])
+        again = report('--after-date', '2016-12-31')
+        self.assertEqual(again['rows_inserted'], 0)
+        self.assertEqual(again['entries']['duplicate'], 25)
+        self.assertNotIn('out_of_window', again['entries'])
+        only_june = report('--after-date', '2016-12-31', '--contest', june.id)
+        self.assertEqual(only_june['entries']['duplicate'], 4)
+        self.assertEqual(only_june['entries']['out_of_window'], 21)
+
+    def test_checkin_command_table_report(self):
+        """Tests that --report table follows the summary with the metrics"""
+        self.__start_replay_contest()
+        with tempfile.TemporaryDirectory() as source:
+            with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                    open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                saved.write(feed.read())
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source,
+                         '--report', 'table', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('1 loaded', lines[0])
+        self.assertIn('Phases', lines)
+        self.assertIn('Slowest feeds', lines)
+        self.assertTrue(any(re.match(r'^\s+rows inserted\s+25$', line)
+                            for line in lines))
+
+    def __hold_lock(self, space, key=0):
+        """Takes an advisory lock from another database session"""
+        other = connection.get_new_connection(connection.get_connection_params())
+        self.addCleanup(other.close)
+        other.autocommit = True
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s, %s)', [space, key])
+        return other
+
+    def __held_advisory_locks(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory'"
+                           + ' AND pid = pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_checkin_command_skips_overlapping_run(self):
+        """Tests that a run is skipped while another run holds the loader lock"""
+        contest_player = self.__start_replay_contest()
+        other = self.__hold_lock(locks.LOADER_RUN)
+        with tempfile.TemporaryDirectory() as source:
+            with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                    open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                saved.write(feed.read())
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source,
+                         '--report', 'json', stdout=out)
+            report = json.loads(out.getvalue())
+            self.assertTrue(report['run_skipped'])
+            self.assertEqual(report['rows_inserted'], 0)
+            self.assertEqual(Unvalidated_Checkin.objects.filter(
+                contest_player=contest_player).count(), 0)
+
+            other.close()
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source, stdout=out)
+        self.assertIn('1 loaded', out.getvalue())
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 25)
+        self.assertEqual(self.__held_advisory_locks(), 0)
+
+    def test_checkin_command_skips_locked_players(self):
+        """Tests that players being loaded by another run are skipped"""
+        contest_player = self.__start_replay_contest()
+        self.__hold_lock(locks.PLAYER_LOAD, contest_player.player.id)
+        with tempfile.TemporaryDirectory() as source:
+            with open(TEST_CHECKINS_XML, 'rb') as feed, \
+                    open(os.path.join(source, 'user1.xml'), 'wb') as saved:
+                saved.write(feed.read())
+            out = io.StringIO()
+            call_command('load_checkins', '--source', source,
+                         '--report', 'json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertFalse(report['run_skipped'])
+        self.assertEqual(report['feeds']['locked'], 1)
+        self.assertEqual(report['feeds']['fetched'], 0)
+        self.assertEqual(report['bytes'], 0)
+        self.assertEqual(Unvalidated_Checkin.objects.filter(
+            contest_player=contest_player).count(), 0)
+        self.assertEqual(self.__held_advisory_locks(), 0)
+
+    def test_unsuccessful_checkin_command_with_bad_source(self):
+        """Test whether a checkin command with a missing source fails"""
+        with self.assertRaises(CommandError):
+            call_command('load_checkins', '--source', '/does/not/exist')
+
+    def test_unsuccessful_checkin_command_with_bad_concurrency(self):
+        """Test whether a checkin command with a bad concurrency fails"""
+        with self.assertRaises(CommandError):
+            call_command('load_checkins', '--concurrency', '0')
+
     def test_successful_reload_checkin(self):
         """Test whether the reload_checkin command works"""
         runner = Player.objects.get(id=4)
@@ -898,3 +1777,92 @@ Brewery 5,Beer 5,https://example.com/untapped4,ST,3
         pass
 
 
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CheckinWorkerTestCase(TransactionTestCase):
+    """
+    Runs checkin_worker in separate processes against the test database, so
+    the jobs have to be committed rather than kept in a test transaction
+    """
+
+    fixtures = ['permissions', 'users']
+    # Restores the content types the permissions fixture refers to, which
+    # the flush after test_contest.ConcurrentScoringTestCase removes
+    serialized_rollback = True
+
+    PLAYERS = 12
+    # Each feed takes this many seconds to answer, which is most of a job's
+    # time, so how long the jobs take depends on how many run at once
+    LATENCY = 1.0
+
+    def __database_url(self):
+        db = connection.settings_dict
+        return 'postgres://{}:{}@{}:{}/{}'.format(
+            quote(db['USER'] or '', safe=''), quote(db['PASSWORD'] or '', safe=''),
+            quote(db['HOST'] or '', safe=''), db['PORT'] or '', db['NAME'])
+
+    def __run_workers(self, count):
+        """
+        Queues a job for every player, runs count workers until the queue is
+        empty, and returns how long the jobs took from the first start to
+        the last finish
+        """
+        Feed_Job.objects.all().delete()
+        call_command('queue_checkins', stdout=io.StringIO())
+        env = dict(os.environ, DATABASE_URL=self.__database_url())
+        workers = [subprocess.Popen([sys.executable,
+                                     MANAGE_PY,
+                                     'checkin_worker', '--exit-when-empty',
+                                     '--name', 'worker-{}'.format(i)],
+                                    env=env, stdout=subprocess.DEVNULL)
+                   for i in range(count)]
+        for worker in workers:
+            self.assertEqual(worker.wait(timeout=120), 0)
+        jobs = list(Feed_Job.objects.all())
+        # One job per player, each finished by the one worker that claimed it
+        self.assertEqual(len(jobs), self.PLAYERS)
+        self.assertEqual(len({job.player_id for job in jobs}), self.PLAYERS)
+        self.assertTrue(all(job.status == Feed_Job.DONE and job.worker
+                            for job in jobs))
+        self.assertEqual(sum(job.checkins_loaded for job in jobs),
+                         25 * self.PLAYERS)
+        return (max(job.finished_on for job in jobs)
+                - min(job.started_on for job in jobs)).total_seconds()
+
+    def test_workers_scale(self):
+        """
+        Tests that several workers share the queue, fetching each feed and
+        running each job once between them, in well under half the time
+        one worker takes
+        """
+        start_date = timezone.make_aware(datetime.datetime(2017, 1, 1))
+        end_date = RUNNING_END_DATE
+        runner = Player.objects.get(id=4)
+        runner.untappd_rss = None
+        runner.save()
+        contest = Contest.objects.create_contest('Contest', runner,
+                                                 start_date, end_date)
+        feeds = {'/rss/{}'.format(i): TEST_CHECKINS_XML for i in range(self.PLAYERS)}
+        with FeedServer(feeds, latency=self.LATENCY) as server:
+            for i in range(self.PLAYERS):
+                user = User.objects.create_user('worker{}'.format(i),
+                                                password='password')
+                player = Player.objects.create_player(
+                    user, personal_statement='', untappd_username='worker',
+                    untappd_rss=server.url('/rss/{}'.format(i)))
+                contest.add_player(player)
+            single = self.__run_workers(1)
+            self.assertEqual(Unvalidated_Checkin.objects.count(), 25 * self.PLAYERS)
+            Unvalidated_Checkin.objects.all().delete()
+            Player_Feed.objects.all().delete()
+            Contest_Player.objects.filter(contest=contest).update(
+                last_checkin_load=start_date)
+            several = self.__run_workers(4)
+            # Each feed was only requested once per run
+            self.assertEqual(sorted(path for path, _ in server.requests),
+                             sorted(list(feeds) * 2))
+        self.assertEqual(Unvalidated_Checkin.objects.count(), 25 * self.PLAYERS)
+        self.assertGreater(len(set(Feed_Job.objects.values_list('worker', flat=True))), 1)
+        # Four workers running side by side take about a quarter of the time
+        self.assertLess(several, single / 2,
+                        '4 workers took {:.2f}s, 1 took {:.2f}s'.format(several,
+                                                                      single))
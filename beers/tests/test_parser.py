@@ -1,12 +1,26 @@
 """Tests the ability to parse from Untappd"""
 
+import io
 import os
 import datetime
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
 from django.test import TestCase, override_settings, Client
 from django.urls import reverse
+from django.core.management import call_command
 from django.utils import timezone
 from beers.utils import untappd
-from beers.models import Beer, Brewery, Unvalidated_Checkin
+from beers.utils import client as client_module
+from beers.utils.client import UntappdClient, TokenBucket, ClientError, \
+                               StatusError
+from beers.utils.page_cache import PageCache
+from beers.models import Beer, Brewery, Unvalidated_Checkin, Scrape_Job
+
+UNTAPPD_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'test-data', 'untappd')
 
 @override_settings(SECURE_SSL_REDIRECT=False, ROOTURL_CONF='beers.urls')
 class ParserTestCase(TestCase):
@@ -55,3 +69,394 @@ class ParserTestCase(TestCase):
         self.assertEqual(checkin.untappd_checkin_date, 
                          datetime.datetime(2018, 1, 3, hour=1, minute=27, second=32,
                                            tzinfo=datetime.timezone.utc))
+
+    def test_targeted_parsing_matches_full_parsing(self):
+        """
+        Tests that parsing only the scraped tags gives the same objects, or
+        the same errors, as parsing the whole of every test page
+        """
+        parsers = (untappd.parse_checkin, untappd.parse_brewery,
+                   lambda url: untappd.parse_beer(url, followBrewery=False))
+
+        def parse_all():
+            results = []
+            for name in sorted(os.listdir(UNTAPPD_DATA)):
+                url = 'file://' + os.path.join(UNTAPPD_DATA, name)
+                for parse in parsers:
+                    try:
+                        result = parse(url)
+                        results.append({field.attname: getattr(result, field.attname)
+                                        for field in result._meta.fields})
+                    except Exception as exc:
+                        results.append((type(exc), str(exc)))
+            return results
+
+        targeted = parse_all()
+        with patch.object(untappd, 'STRAINER', None), \
+                patch.object(untappd, 'TITLE_STRAINER', None):
+            full = parse_all()
+        self.assertEqual(targeted, full)
+        self.assertEqual(len([result for result in targeted
+                              if isinstance(result, dict) and result.get('name')]), 2)
+
+
+class PageServer:
+    """
+    A local HTTP/1.1 server that keeps connections alive and serves the
+    Untappd test pages by name, counting the connections it accepts. Each
+    path answers with the statuses queued for it in failures first.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = []
+        self.failures = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                server.requests.append(self.path)
+                statuses = server.failures.get(self.path)
+                if statuses:
+                    status = statuses.pop(0)
+                    self.send_response(status)
+                    if status == 302:
+                        self.send_header('Location', '/untappd.com-flyingdog')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                path = os.path.join(UNTAPPD_DATA, self.path.lstrip('/'))
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                with open(path, 'rb') as page:
+                    body = page.read()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+
+    def url(self, path):
+        """Returns the full URL for a path on this server"""
+        return 'http://127.0.0.1:{}{}'.format(self.httpd.server_port, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ClientTestCase(TestCase):
+    """The tests on the shared Untappd HTTP client"""
+
+    @override_settings(UNTAPPD_CACHE_DIR='')
+    def test_connections_are_reused(self):
+        """Tests that repeated requests share a keep-alive connection"""
+        with PageServer() as server:
+            client = UntappdClient(rate=0)
+            with patch('beers.utils.untappd.get_client', return_value=client):
+                for _ in range(5):
+                    brewery = untappd.parse_brewery(
+                        server.url('/untappd.com-flyingdog'))
+                    self.assertEqual(brewery.name, 'Flying Dog Brewery')
+            self.assertEqual(len(server.requests), 5)
+            self.assertEqual(server.connections, 1)
+
+    def test_redirects_are_followed(self):
+        """Tests that the response URL is where a redirect ended up"""
+        with PageServer() as server:
+            server.failures['/brewery/1'] = [302]
+            response = UntappdClient(rate=0).get(server.url('/brewery/1'))
+        self.assertEqual(response.url, server.url('/untappd.com-flyingdog'))
+        self.assertEqual(response.status, 200)
+
+    def test_transient_errors_are_retried(self):
+        """Tests that throttling and unavailable servers are tried again"""
+        with PageServer() as server:
+            server.failures['/untappd.com-flyingdog'] = [429, 503]
+            client = UntappdClient(rate=0, retries=2, backoff=0.01)
+            response = client.get(server.url('/untappd.com-flyingdog'))
+            self.assertEqual(response.status, 200)
+            self.assertEqual(len(server.requests), 3)
+
+            server.failures['/untappd.com-flyingdog'] = [503, 503]
+            client = UntappdClient(rate=0, retries=1, backoff=0.01)
+            with self.assertRaises(StatusError) as raised:
+                client.get(server.url('/untappd.com-flyingdog'))
+            self.assertEqual(raised.exception.status, 503)
+
+            # Other errors aren't retried
+            with self.assertRaises(StatusError):
+                client.get(server.url('/missing'))
+            self.assertEqual(server.requests[-1], '/missing')
+            self.assertEqual(server.requests.count('/missing'), 1)
+
+    def test_timeout_covers_retries(self):
+        """
+        Tests that retries stop when the timeout runs out, rather than
+        each attempt getting the whole timeout
+        """
+        with PageServer() as server:
+            server.failures['/untappd.com-flyingdog'] = [503] * 20
+            client = UntappdClient(rate=0, retries=20, backoff=0.1)
+            start = time.monotonic()
+            with self.assertRaises(StatusError):
+                client.get(server.url('/untappd.com-flyingdog'), timeout=0.5)
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertLess(len(server.requests), 20)
+
+    @override_settings(CHECKIN_FEED_REQUESTS_PER_SECOND=0)
+    def test_feeds_have_their_own_client(self):
+        """Tests that feeds don't share the rate limit on page scrapes"""
+        with patch('beers.utils.client._feed_client', None):
+            feed_client = client_module.get_feed_client()
+            self.assertIsNot(feed_client, client_module.get_client())
+            self.assertEqual(feed_client.bucket.rate, 0)
+            self.assertIs(client_module.get_feed_client(), feed_client)
+
+    def test_connection_failures_raise(self):
+        """Tests that a server that can't be reached fails after retrying"""
+        client = UntappdClient(rate=0, retries=1, backoff=0.01)
+        with self.assertRaises(ClientError):
+            client.get('http://127.0.0.1:1/')
+
+    def test_token_bucket_limits_rate(self):
+        """Tests that requests past the burst wait for the rate"""
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        waits = [bucket.acquire() for _ in range(4)]
+        elapsed = time.monotonic() - start
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertGreater(waits[3], 0)
+        self.assertGreaterEqual(elapsed, 0.09)
+
+
+class PageCacheTestCase(TestCase):
+    """The tests on the on-disk cache of Untappd pages"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = patch('beers.utils.untappd.get_client',
+                        return_value=UntappdClient(rate=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeat_lookups_use_the_cache(self):
+        """Tests that pages are only downloaded once"""
+        with self.settings(UNTAPPD_CACHE_DIR=self.directory), PageServer() as server:
+            url = server.url('/untappd.com-b-saint-arnold-brewing-company-santo-68727')
+            for _ in range(3):
+                beer = untappd.parse_beer(url, followBrewery=False)
+                self.assertEqual(beer.name, 'Santo')
+                self.assertEqual(beer.untappd_url, url)
+            self.assertEqual(len(server.requests), 1)
+
+    def test_redirects_are_cached(self):
+        """Tests that a URL that redirected finds the page at its target"""
+        with self.settings(UNTAPPD_CACHE_DIR=self.directory), PageServer() as server:
+            server.failures['/brewery/1'] = [302]
+            first = untappd.parse_brewery(server.url('/brewery/1'))
+            second = untappd.parse_brewery(server.url('/brewery/1'))
+            third = untappd.parse_brewery(server.url('/untappd.com-flyingdog'))
+            self.assertEqual(server.requests, ['/brewery/1', '/untappd.com-flyingdog'])
+        for brewery in (first, second, third):
+            self.assertEqual(brewery.name, 'Flying Dog Brewery')
+            self.assertEqual(brewery.untappd_url,
+                             server.url('/untappd.com-flyingdog'))
+
+    def test_expired_pages_are_downloaded_again(self):
+        """Tests that each kind of page is kept for its own TTL"""
+        ttls = {'beer': 3600, 'brewery': 0, 'checkin': 3600}
+        with self.settings(UNTAPPD_CACHE_DIR=self.directory,
+                           UNTAPPD_CACHE_TTLS=ttls), PageServer() as server:
+            untappd.parse_brewery(server.url('/untappd.com-flyingdog'))
+            untappd.parse_brewery(server.url('/untappd.com-flyingdog'))
+            self.assertEqual(len(server.requests), 2)
+
+    def test_least_recently_used_pages_are_evicted(self):
+        """Tests that the cache drops the pages used longest ago when full"""
+        ttls = {'beer': 3600, 'brewery': 3600, 'checkin': 3600}
+        cache = PageCache(self.directory, 250, ttls)
+        cache.put('http://a', 'http://a', 'beer', b'a' * 100)
+        cache.put('http://b', 'http://b2', 'beer', b'b' * 100)
+        self.assertIsNotNone(cache.get('http://a'))
+        cache.put('http://c', 'http://c', 'brewery', b'c' * 100)
+        self.assertIsNotNone(cache.get('http://a'))
+        self.assertIsNone(cache.get('http://b'))
+        self.assertIsNone(cache.get('http://b2'))
+        self.assertEqual(cache.get('http://c').body, b'c' * 100)
+        self.assertIsNone(cache.get('http://c', 'beer'))
+
+    def test_cache_command(self):
+        """Tests the command summarising and purging the cache"""
+        with self.settings(UNTAPPD_CACHE_DIR=self.directory), PageServer() as server:
+            untappd.parse_brewery(server.url('/untappd.com-flyingdog'))
+            out = io.StringIO()
+            call_command('untappd_cache', stdout=out)
+            self.assertRegex(out.getvalue(), r'brewery\s+1 pages')
+            out = io.StringIO()
+            call_command('untappd_cache', '--url', server.url('/untappd.com-flyingdog'),
+                         stdout=out)
+            self.assertIn('brewery page', out.getvalue())
+            out = io.StringIO()
+            call_command('untappd_cache', '--purge', 'expired', stdout=out)
+            self.assertIn('Removed 0 pages', out.getvalue())
+            out = io.StringIO()
+            call_command('untappd_cache', '--purge', 'all', '--kind', 'brewery',
+                         stdout=out)
+            self.assertIn('Removed 1 pages', out.getvalue())
+            untappd.parse_brewery(server.url('/untappd.com-flyingdog'))
+            self.assertEqual(len(server.requests), 2)
+
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, ROOTURL_CONF='beers.urls',
+                   UNTAPPD_CACHE_DIR='')
+class LookupTestCase(TestCase):
+    """The tests on looking up beers and breweries in the database first"""
+
+    BEER_PATH = '/untappd.com-b-saint-arnold-brewing-company-santo-68727'
+    BREWERY_PATH = '/w/saint-arnold-brewing-company/2940'
+
+    def setUp(self):
+        patcher = patch('beers.utils.untappd.get_client',
+                        return_value=UntappdClient(rate=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_canonical_url(self):
+        """Tests the form Untappd URLs are stored under"""
+        self.assertEqual(untappd.canonical_url('HTTP://www.Untappd.com/b/santo/68727/?ref=1#top'),
+                         'https://untappd.com/b/santo/68727')
+        self.assertEqual(untappd.canonical_url('https://untappd.com'),
+                         'https://untappd.com/')
+        self.assertEqual(untappd.canonical_url('file:///tmp/page/'), 'file:///tmp/page/')
+
+    def test_beer_lookup_stores_scraped_beer(self):
+        """
+        Tests that a beer and its brewery are scraped once by a scrape job,
+        stored, then read from the database
+        """
+        beer = {'name': 'Santo',
+                'brewery': 'Saint Arnold Brewing Company',
+                'style': 'Kölsch'}
+        with PageServer() as server:
+            # The brewery link on the beer page redirects to a brewery page
+            server.failures[self.BREWERY_PATH] = [302]
+            url = server.url(self.BEER_PATH)
+            beer.update({'untappd_url': url,
+                         'brewery_url': server.url('/untappd.com-flyingdog')})
+            response = Client().get(reverse('beer-lookup'), {'url': url},
+                                    HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 202)
+            job = response.json()
+            self.assertEqual((job['kind'], job['status']), ('beer', 'pending'))
+            self.assertEqual(server.requests, [])
+            call_command('scrape_worker', '--exit-when-empty', stdout=io.StringIO())
+            job = Client().get(job['url'], HTTP_ACCEPT='application/json').json()
+            self.assertEqual(job['status'], 'done')
+            self.assertEqual(job['result'], beer)
+            for _ in range(2):
+                response = Client().get(reverse('beer-lookup'), {'url': url},
+                                        HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), beer)
+            self.assertEqual(server.requests, [self.BEER_PATH, self.BREWERY_PATH,
+                                               '/untappd.com-flyingdog'])
+            self.assertEqual(Beer.objects.filter(untappd_url=url).count(), 1)
+            self.assertEqual(Brewery.objects.filter(
+                untappd_url=server.url('/untappd.com-flyingdog')).count(), 1)
+            # The stored brewery is found without following the redirect again
+            response = Client().get(reverse('brewery-lookup'),
+                                    {'url': server.url('/untappd.com-flyingdog/')},
+                                    HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['name'], 'Flying Dog Brewery')
+            self.assertEqual(len(server.requests), 3)
+
+    def test_failed_lookup_job(self):
+        """Tests that a page that can't be scraped fails its job"""
+        with PageServer() as server:
+            response = Client().get(reverse('brewery-lookup'),
+                                    {'url': server.url('/missing')},
+                                    HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 202)
+            call_command('scrape_worker', '--exit-when-empty', stdout=io.StringIO())
+        job = Client().get(response.json()['url'], HTTP_ACCEPT='application/json').json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['errors'], {'non_field_errors': ['HTTP Error 404: Not Found']})
+        self.assertEqual(Scrape_Job.objects.get(id=job['id']).status, Scrape_Job.FAILED)
+
+    def test_job_lease(self):
+        """
+        Tests that a job whose worker died is failed once it's past its
+        lease, and isn't handed to later lookups of the same page
+        """
+        url = 'https://untappd.com/w/dead/1'
+        response = Client().get(reverse('brewery-lookup'), {'url': url},
+                                HTTP_ACCEPT='application/json')
+        self.assertEqual(Scrape_Job.objects.claim('dead').id, response.json()['id'])
+        response = Client().get(reverse('brewery-lookup'), {'url': url},
+                                HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['status'], 'running')
+        job = Scrape_Job.objects.get(id=response.json()['id'])
+        job.started_on = timezone.now() - Scrape_Job.lease() - datetime.timedelta(seconds=1)
+        job.save()
+        response = Client().get(reverse('brewery-lookup'), {'url': url},
+                                HTTP_ACCEPT='application/json')
+        self.assertNotEqual(response.json()['id'], job.id)
+        self.assertEqual(response.json()['status'], 'pending')
+        old = Client().get(reverse('scrape-job-detail', kwargs={'job_id': job.id}),
+                           HTTP_ACCEPT='application/json').json()
+        self.assertEqual(old['status'], 'failed')
+        self.assertEqual(old['errors'], {'non_field_errors': ['lease expired']})
+        # Only a worker's claim records the expiry
+        job.refresh_from_db()
+        self.assertEqual(job.status, Scrape_Job.RUNNING)
+        self.assertEqual(Scrape_Job.objects.claim('alive').id, response.json()['id'])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Scrape_Job.FAILED)
+        self.assertEqual(job.error, 'lease expired')
+
+    def test_stored_beer_is_not_scraped(self):
+        """Tests that a beer already stored under a URL is returned as is"""
+        Beer.objects.create_beer('Stored', 'Stored Brewery',
+                                 untappd_url='https://untappd.com/b/stored/1',
+                                 brewery_url='https://untappd.com/w/stored/2')
+        with patch.object(untappd, 'fetch_page') as fetch_page:
+            beer = untappd.lookup_beer('http://www.untappd.com/b/stored/1/')
+        fetch_page.assert_not_called()
+        self.assertEqual(beer.name, 'Stored')
+
+    def test_stored_beer_without_brewery_url_is_completed(self):
+        """Tests that a stored beer missing its brewery URL is filled in"""
+        with PageServer() as server:
+            url = server.url(self.BEER_PATH)
+            stored = Beer.objects.create_beer('Santo', 'Saint Arnold Brewing Company',
+                                              untappd_url=url)
+            Brewery.objects.create_brewery('Saint Arnold Brewing Company',
+                                           server.url(self.BREWERY_PATH))
+            beer = untappd.lookup_beer(url)
+            self.assertEqual(server.requests, [self.BEER_PATH])
+        self.assertEqual(beer.id, stored.id)
+        self.assertEqual(Beer.objects.get(id=stored.id).brewery_url,
+                         server.url(self.BREWERY_PATH))
@@ -37,9 +37,18 @@ api_patterns = [
     path('contests/<int:contest_id>/unvalidated_checkins',
          api_views.UnvalidatedCheckinList.as_view(),
          name='unvalidated-checkin-list',),
+    path('contests/<int:contest_id>/unvalidated_checkins/bulk',
+         api_views.UnvalidatedCheckinBulkCreate.as_view(),
+         name='unvalidated-checkin-bulk',),
+    path('contests/<int:contest_id>/checkins/validate',
+         api_views.CheckinBatchValidate.as_view(),
+         name='checkin-batch-validate',),
     path('unvalidated_checkins/<int:id>',
          api_views.UnvalidatedCheckinDetail.as_view(),
          name='unvalidated-checkin-detail',),
+    path('scrape_jobs/<int:job_id>',
+         api_views.ScrapeJobDetail.as_view(),
+         name='scrape-job-detail',),
     path('lookup/beer', api_views.BeerLookup.as_view(), name='beer-lookup'),
     path('lookup/brewery', api_views.BreweryLookup.as_view(), name='brewery-lookup'),
 ]
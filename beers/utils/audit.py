@@ -0,0 +1,103 @@
+"""Audits the players' stored scores against the ledger of contest checkins"""
+
+import logging
+from collections import namedtuple
+from beers.models import Contest_Player, Contest_Checkin
+from beers.models.contest_player import SCORE_FIELDS, SCORE_TX_TYPES, \
+                                        BEER_TX_TYPES, SCORE_AGGREGATES, ScoreDrift, \
+                                        score_aggregates, scores_from_aggregates
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# What an audit read: the number of checkins and players and the number of
+# chunks they were read in, and a ScoreDrift for each mismatched player
+AuditResult = namedtuple('AuditResult', ['checkins', 'players', 'chunks', 'mismatches'])
+
+# The score field for each transaction type
+TX_SCORE_FIELDS = {tx_type: field for field, tx_types in SCORE_TX_TYPES.items()
+                   for tx_type in tx_types}
+
+def _chunks(queryset, chunk_size, counts):
+    """
+    Yields the values rows of a queryset, which must include the id, by
+    reading chunk_size rows at a time after the last ID read. Unlike an
+    offset, each chunk is a short index range scan however far into the
+    table it is, and each is its own query, so nothing is held open
+    between them. counts['chunks'] is incremented for each query.
+    """
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id')[:chunk_size])
+        counts['chunks'] += 1
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]['id']
+
+def audit_scores(contest_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compares the scores stored on every Contest_Player, in one contest or
+    all of them, with the scores their Contest_Checkin rows add up to,
+    returning an AuditResult. The checkins and then the players are read
+    in chunks of chunk_size rows in ID order and summed in memory, so only
+    a few counters per player are kept and nothing is locked.
+
+    As the reads aren't in one transaction, a checkin validated during the
+    audit can make a player look mismatched. The players that do are
+    checked again with a single query that sums their checkins alongside
+    their stored scores, and only those that still disagree are reported.
+    """
+    if chunk_size < 1:
+        raise ValueError('Chunk size must be at least 1')
+    counts = {'chunks': 0}
+    checkins = Contest_Checkin.objects.all()
+    players = Contest_Player.objects.all()
+    if contest_id is not None:
+        checkins = checkins.filter(contest_player__contest_id=contest_id)
+        players = players.filter(contest_id=contest_id)
+
+    ledger = {}
+    checkin_count = 0
+    for row in _chunks(checkins.values('id', 'contest_player_id', 'tx_type',
+                                       'checkin_points'),
+                       chunk_size, counts):
+        checkin_count += 1
+        totals = ledger.setdefault(row['contest_player_id'],
+                                   dict.fromkeys(SCORE_AGGREGATES, 0))
+        field = TX_SCORE_FIELDS.get(row['tx_type'])
+        if field is not None:
+            totals[field] += row['checkin_points']
+        if row['tx_type'] in BEER_TX_TYPES:
+            totals['beer_count'] += 1
+
+    suspects = []
+    player_count = 0
+    for row in _chunks(players.values('id', *SCORE_FIELDS), chunk_size, counts):
+        player_count += 1
+        scores = scores_from_aggregates(ledger.pop(row['id'], None))
+        if any(row[field] != value for field, value in scores.items()):
+            suspects.append(row['id'])
+    if ledger:
+        # Only players deleted during the audit, whose checkins go with them
+        logger.info('Ignoring checkins of %s players that are gone', len(ledger))
+
+    mismatches = []
+    for start in range(0, len(suspects), chunk_size):
+        counts['chunks'] += 1
+        for player in Contest_Player.objects.filter(
+                id__in=suspects[start:start + chunk_size]).annotate(
+                    **{'ledger_' + field: aggregate for field, aggregate
+                       in score_aggregates('contest_checkin__').items()}).order_by('id'):
+            scores = scores_from_aggregates(
+                {field: getattr(player, 'ledger_' + field) for field in SCORE_AGGREGATES})
+            changes = {field: (getattr(player, field), value)
+                       for field, value in scores.items()
+                       if getattr(player, field) != value}
+            if changes:
+                mismatches.append(ScoreDrift(player, changes))
+    if mismatches:
+        logger.warning('Scores of %s of %s players disagree with their checkins',
+                       len(mismatches), player_count)
+    return AuditResult(checkin_count, player_count, counts['chunks'], mismatches)
@@ -1,40 +1,209 @@
 from beers.models import Player, Contest_Player, Contest, \
-                         Unvalidated_Checkin, Contest_Checkin, \
-                         Brewery, Contest_Brewery, Contest_Bonus
+                         Unvalidated_Checkin, Contest_Checkin, Contest_Beer, \
+                         Brewery, Contest_Brewery, Contest_Bonus, Player_Feed, \
+                         Feed_Job
+from beers.models.contest_player import LAST_CHECKIN_FIELDS
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from beers.utils.untappd import parse_checkin
-import feedparser
+from beers.utils.feeds import fetch_feed, fetch_feeds, FETCHED, FAILED, BROKEN, \
+                              LOCKED
+from beers.utils.metrics import RunMetrics
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
 import datetime
 import html
+import time
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
-def load_player_checkins(p, contest_id=None, from_date=None):
+RE_HAS_LOC = re.compile(r'^(.+)\s+at\s+(.+)$')
+RE_TITLE = re.compile(r'^(?P<user>.+)\s+is\s+drinking\s+a(n){0,1}\s+(?P<beer>.+)\s+by\s+(?P<brewery>.+)(\s+at\s+.+){0,1}$')
+RE_TAGS = re.compile(r'#(\w+)')
+
+# The outcome of submitting one checkin URL: status is one of the statuses
+# below, and checkin is the new Unvalidated_Checkin if it was CREATED
+SubmitResult = namedtuple('SubmitResult', ['url', 'status', 'error', 'checkin'])
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+UNKNOWN_PLAYER = 'unknown_player'
+
+# The outcome of validating one unvalidated checkin: status is VALIDATED,
+# INVALID or UNKNOWN_CHECKIN, and points is how many points the checkin's
+# player gained from it
+ValidateResult = namedtuple('ValidateResult', ['checkin_id', 'status', 'error', 'points'])
+VALIDATED = 'validated'
+UNKNOWN_CHECKIN = 'unknown_checkin'
+
+# One checkin to validate, read from a request. error is set if it couldn't
+# be read.
+Assignment = namedtuple('Assignment', ['checkin_id', 'beer_id', 'brewery_id',
+                                       'bonuses', 'preserve', 'error'])
+
+# A feed entry with everything the loader needs parsed out of it. beer and
+# brewery are None when the title isn't in the form Untappd uses for checkins.
+FeedEntry = namedtuple('FeedEntry',
+                       ['link', 'title', 'published', 'beer', 'brewery', 'tags'])
+
+def parse_published(published):
+    """Parses an RSS date like 'Wed, 02 Dec 2015 00:45:37 +0000'"""
+    return datetime.datetime.strptime(published, '%a, %d %b %Y %H:%M:%S %z')
+
+def parse_entry(entry, published):
+    """Builds the FeedEntry for an RssEntry published at published"""
+    title = entry.title
+    lmatch = RE_HAS_LOC.match(title)
+    if lmatch:
+        title = lmatch.group(1)
+    match = RE_TITLE.match(title)
+    beer, brewery = None, None
+    if match:
+        beer = match.group('beer').strip()
+        brewery = match.group('brewery').strip()
+    tags = ()
+    if entry.description:
+        tags = tuple(RE_TAGS.findall(html.unescape(entry.description)))
+    return FeedEntry(entry.link, entry.title, published, beer, brewery, tags)
+
+def prepare_entries(entries, after_date=None, counts=None):
+    """
+    Parses the feed entries once so the result can be shared by all of a
+    player's contests, returning them newest first. entries can be any
+    iterable of RssEntry tuples, including one that is parsed as it is read.
+    Entries at or before after_date are dropped. Untappd feeds are in reverse
+    chronological order, so once the entries seen so far are in that order,
+    reaching one that is too old stops the walk without reading the rest of
+    the feed. Other feeds are read in full and sorted.
+
+    If counts is given, a collections.Counter, the entries read are counted
+    as 'seen' along with why any were dropped.
+    """
+    if counts is None:
+        counts = Counter()
+    result = []
+    newest_first = True
+    previous = None
+    for entry in entries:
+        counts['seen'] += 1
+        if not entry.link or not entry.title or not entry.published:
+            logger.debug('Ignoring incomplete entry {}'.format(entry))
+            counts['incomplete'] += 1
+            continue
+        published = parse_published(entry.published)
+        if previous is not None and published > previous:
+            newest_first = False
+        if after_date is not None and published <= after_date:
+            counts['already_loaded'] += 1
+            # A single entry doesn't show which way the feed is ordered
+            if newest_first and previous is not None:
+                logger.debug('Stopping at "{}" as {} is before {}'.format(
+                    entry.title, entry.published, after_date))
+                break
+        else:
+            result.append(parse_entry(entry, published))
+        previous = published
+    if not newest_first:
+        result.sort(key=lambda e: e.published, reverse=True)
+    return result
+
+
+def known_checkin_urls(cps):
+    """
+    Returns a dictionary of contest player ID to the set of Untappd checkin
+    URLs that are already waiting for validation or were validated for that
+    contest player. This is a single query no matter how many contest
+    players or checkins there are.
+    """
+    known = {cp.id: set() for cp in cps}
+    unvalidated = Unvalidated_Checkin.objects.filter(
+        contest_player__in=cps).values_list('contest_player_id', 'untappd_checkin')
+    validated = Contest_Checkin.objects.filter(
+        contest_player__in=cps,
+        untappd_checkin__isnull=False).values_list('contest_player_id',
+                                                   'untappd_checkin')
+    for cp_id, url in unvalidated.union(validated, all=True):
+        known[cp_id].add(url)
+    return known
+
+def load_player_checkins(p, contest_id=None, from_date=None, feed=None,
+                         find_matches=True, record_feed=True, metrics=None,
+                         contest_players=None):
     """
     Loads a players checkins, potentially after the from_date. If from_date
     is provided, then it loads anything after that date within a contest.
     Otherwise, it loads based on the last checkin that was logged.
-    """
 
-    re_has_loc = re.compile(r'^(.+)\s+at\s+(.+)$')
-    re_title = re.compile(r'^(?P<user>.+)\s+is\s+drinking\s+a(n){0,1}\s+(?P<beer>.+)\s+by\s+(?P<brewery>.+)(\s+at\s+.+){0,1}$')
-    re_tags = re.compile(r'#(\w+)')
+    If feed is provided, it is the FeedResult from already downloading the
+    player's RSS feed, or a saved feed which is loaded even if the player
+    has no RSS URL. Feeds that were not modified since the last load are
+    skipped. When loading every contest from the last checkin, the feed's
+    validators are saved so an unchanged feed can be skipped next time,
+    unless record_feed is False, e.g. for a feed replayed from disk.
+
+    Unless find_matches is False, the possible matches are then found for
+    each contest that got new checkins. Callers loading many players can
+    pass False and run Unvalidated_Checkin.objects.find_possible_matches
+    once per contest at the end instead. Returns the new checkins.
+
+    If metrics is given, a RunMetrics, the time spent in each phase of the
+    load, the entries skipped and the rows inserted are added to it. An
+    entry that none of the contests loaded is counted once, under the
+    reason the first contest skipped it for.
+
+    contest_players can be the player's Contest_Player rows to load, with
+    their contests and users, e.g. from Contest_Player.objects.loadable, in
+    which case contest_id is ignored and they aren't queried again.
+    """
+    if metrics is None:
+        metrics = RunMetrics()
 
     logger.debug('Parsing "{}" for player {}'.format(p.untappd_rss, p.user.username))
-    if p.untappd_rss:
+    if p.untappd_rss or feed is not None:
         # Only load the RSS feed if there is at least one contest the player is taking
         # part in.
-        feed = None
-        cps = None
-        if contest_id is None:
-            cps = Contest_Player.objects.filter(player=p)
-        else:
-            cps = Contest_Player.objects.filter(contest_id=contest_id, player=p)
-        if cps.count() > 0:
-            feed = feedparser.parse(p.untappd_rss)
-            logger.debug('Got {} entries'.format(len(feed.entries)))
+        cps = contest_players
+        if cps is None:
+            if contest_id is None:
+                cps = Contest_Player.objects.filter(player=p)
+            else:
+                cps = Contest_Player.objects.filter(contest_id=contest_id, player=p)
+            cps = list(cps.select_related('contest', 'player__user'))
+        if len(cps) > 0:
+            if feed is None:
+                feed = fetch_feed(p.untappd_rss)
+            if feed.status != FETCHED:
+                logger.debug('Skipping feed for {}: {}'.format(p.user.username,
+                                                               feed.status))
+                return []
+            with metrics.phase('known'):
+                known = known_checkin_urls(cps)
+            # Nothing at or before the earliest load date is needed by any
+            # of the contests
+            try:
+                with metrics.phase('parse'):
+                    entries = prepare_entries(
+                        feed.entries,
+                        from_date if from_date is not None
+                        else min(cp.last_checkin_load for cp in cps),
+                        counts=metrics.entries)
+            except ElementTree.ParseError as exc:
+                logger.warning('Unable to parse feed "{}" for {}: {}'.format(
+                    feed.url, p.user.username, exc))
+                feed.fail('unable to parse feed: {}'.format(exc))
+                return []
+            logger.debug('Got {} new entries'.format(len(entries)))
+        new_checkins = []
+        # The reason each entry was skipped by the first contest to skip it,
+        # and the entries some contest loaded, which aren't counted as skipped
+        skipped = {}
+        loaded = set()
+        build_start = time.perf_counter()
         for cp in cps:
             contest = cp.contest
             # after_date is set from from_date so that in case after_date changes
@@ -47,51 +216,398 @@ def load_player_checkins(p, contest_id=None, from_date=None):
                 cp.player.user.username, contest.name,
                 cp.last_checkin_load))
 
-            for c in feed.entries:
-                # Example: Wed, 02 Dec 2015 00:45:37 +0000
-                dt = datetime.datetime.strptime(c.published, '%a, %d %b %Y %H:%M:%S %z')
-                # the checkin has to be in the contest timeframe and
-                # after the last checkin from the user
-                if (dt < contest.start_date or dt > contest.end_date or dt <= after_date):
-                    logger.debug('Ignoring "{0}" as {1} is out of bounds'.format(c.title, c.published))
+            # entries are newest first, so the first entry that is too old
+            # means the rest are too
+            for i, c in enumerate(entries):
+                dt = c.published
+                if dt <= after_date or dt < contest.start_date:
+                    for older in entries[i:]:
+                        skipped.setdefault(older.link,
+                                           'already_loaded'
+                                           if older.published <= after_date
+                                           else 'out_of_window')
+                    break
+                if dt > contest.end_date:
+                    logger.debug('Ignoring "{0}" as {1} is out of bounds'.format(c.title, dt))
+                    skipped.setdefault(c.link, 'out_of_window')
                     continue
-                if (Unvalidated_Checkin.objects.filter(contest_player_id=cp.id,
-                            untappd_checkin=c.link).count() == 0
-                        and Contest_Checkin.objects.filter(contest_player_id=cp.id,
-                            untappd_checkin=c.link).count() == 0):
+                if c.link not in known[cp.id]:
                     if last_date is None:
                         last_date = dt
                     elif last_date < dt:
                         last_date = dt
-                    """
-                    uv = parse_checkin(c.link)
-                    uv.contest_player = cp
-                    """
-                    lmatch = re.match(re_has_loc, c.title)
-                    title = c.title
-                    if lmatch:
-                        title = lmatch.group(1)
-                    match = re.match(re_title, title)
-                    if not match:
+                    if c.beer is None:
                         logger.info("'{0}' was not in the proper format: {1}".format(
                                     c.title, c.link))
+                        skipped.setdefault(c.link, 'not_a_checkin')
                         continue
-                        
+
                     logger.info("Adding unvalidated checkin at {}".format(c.link))
-                    uv = Unvalidated_Checkin.objects.create_checkin(cp, c.title,
-                            match.group('brewery').strip(),
-                            match.group('beer').strip(), c.link, dt)
-                    if hasattr(c, "description"):
-                        description = html.unescape(c.description)
-                        tags = re.findall(re_tags, description)
-                        if len(tags) > 0:
-                            pbonuses = list(
-                                Contest_Bonus.objects.filter(contest=contest,
-                                         hashtags__overlap=tags).iterator())
-                            uv.possible_bonuses = [b.id for b in pbonuses]
-                    uv.save()
+                    known[cp.id].add(c.link)
+                    loaded.add(c.link)
+                    possible_bonuses = None
+                    if len(c.tags) > 0:
+                        possible_bonuses = Contest_Bonus.objects.matching_tags(
+                            contest.id, c.tags)
+                    new_checkins.append(Unvalidated_Checkin.objects.build_checkin(
+                            cp, c.title, c.brewery, c.beer, c.link, dt,
+                            possible_bonuses=possible_bonuses))
                 else:
                     logger.debug('Ignoring "{0}" as it already exists in database'.format(c.title))
-            cp.find_possible_matches()
+                    skipped.setdefault(c.link, 'duplicate')
             cp.last_checkin_load = last_date
-            cp.save()
+        for link, reason in skipped.items():
+            if link not in loaded:
+                metrics.entries[reason] += 1
+        metrics.add_time('build', time.perf_counter() - build_start)
+        # The new checkins and the load dates are saved together so that a
+        # failure can't leave a load date ahead of checkins that weren't saved
+        with metrics.phase('insert'), transaction.atomic():
+            Unvalidated_Checkin.objects.bulk_create(new_checkins)
+            for cp in cps:
+                cp.save(update_fields=['last_checkin_load'])
+            if find_matches:
+                for match_contest_id in sorted({uv.contest_player.contest_id
+                                                for uv in new_checkins}):
+                    Unvalidated_Checkin.objects.find_possible_matches(
+                        match_contest_id)
+            if (record_feed and feed is not None and contest_id is None
+                    and from_date is None):
+                Player_Feed.objects.record(p, feed.url,
+                                           etag=feed.etag,
+                                           last_modified=feed.last_modified,
+                                           content_hash=feed.content_hash)
+        metrics.rows_inserted += len(new_checkins)
+        return new_checkins
+    return []
+
+def run_feed_job(job):
+    """
+    Loads the checkins of the player for a claimed Feed_Job, then records
+    the result and how long it took on the job. The bonuses are read again
+    for each job, so a long-running worker sees bonuses changed since it
+    started. Only the player's running contests get checkins.
+    """
+    player = job.player
+    Contest_Bonus.objects.invalidate_tag_index()
+    contest_players = list(Contest_Player.objects.loadable(timezone.now())
+                           .filter(player=player))
+    feeds = fetch_feeds([player], concurrency=1, lock_players=True)
+    try:
+        _, feed = next(feeds)
+        new_checkins = load_player_checkins(player, feed=feed,
+                                            contest_players=contest_players)
+    except Exception as exc:
+        logger.exception('Feed job for {} failed'.format(player.user.username))
+        job.finish(Feed_Job.FAILED, '{}: {}'.format(type(exc).__name__, exc))
+        return job
+    finally:
+        # Releases the player's lock
+        feeds.close()
+    if feed is None:
+        job.finish(Feed_Job.DONE, 'no feed')
+    elif feed.status == FAILED:
+        job.finish(Feed_Job.FAILED, '{}: {}'.format(feed.status, feed.error))
+    elif feed.status in (BROKEN, LOCKED):
+        job.finish(Feed_Job.DONE, '{}: {}'.format(feed.status, feed.error))
+    else:
+        job.finish(Feed_Job.DONE,
+                   '{}: {} new checkins'.format(feed.status, len(new_checkins)),
+                   checkins_loaded=len(new_checkins))
+    return job
+
+def contest_checkin_urls(contest_id, urls):
+    """
+    Returns those of the Untappd checkin URLs that are already waiting for
+    validation or were validated in a contest
+    """
+    unvalidated = Unvalidated_Checkin.objects.filter(
+        contest_player__contest_id=contest_id,
+        untappd_checkin__in=urls).values_list('untappd_checkin', flat=True)
+    validated = Contest_Checkin.objects.filter(
+        contest_player__contest_id=contest_id,
+        untappd_checkin__in=urls).values_list('untappd_checkin', flat=True)
+    return set(unvalidated.union(validated, all=True))
+
+def submit_checkin_urls(contest_id, urls, concurrency=None):
+    """
+    Adds the Untappd checkins at the given URLs to a contest's unvalidated
+    checkins, returning a SubmitResult for each URL in the order given.
+    URLs repeated in the list, or already waiting for validation or
+    validated in the contest, are DUPLICATE without being downloaded. The
+    rest are parsed through a bounded thread pool of concurrency threads,
+    defaulting to the CHECKIN_LOADER_CONCURRENCY setting, and the new
+    checkins are inserted together.
+    """
+    if concurrency is None:
+        concurrency = settings.CHECKIN_LOADER_CONCURRENCY
+    if concurrency < 1:
+        raise ValueError('Concurrency must be at least 1')
+    unique_urls = list(dict.fromkeys(urls))
+    known = contest_checkin_urls(contest_id, unique_urls)
+    results = {url: SubmitResult(url, DUPLICATE, 'already in the contest', None)
+               for url in unique_urls if url in known}
+    to_parse = [url for url in unique_urls if url not in known]
+
+    def _parse(url):
+        try:
+            return parse_checkin(url), None
+        except Exception as exc:
+            # A page that can't be read or parsed only fails its own URL
+            logger.warning('Unable to parse checkin at %s: %s', url, exc)
+            return None, '{}'.format(exc) or type(exc).__name__
+
+    parsed = []
+    if to_parse:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            parsed = list(zip(to_parse, executor.map(_parse, to_parse)))
+    checkins = [uv for _, (uv, _) in parsed if uv is not None]
+    # Pages can redirect to a checkin URL that is already in the contest
+    known.update(contest_checkin_urls(
+        contest_id, {uv.untappd_checkin for uv in checkins} - known))
+    contest_players = {cp.player.untappd_username: cp for cp in
+                       Contest_Player.objects.filter(
+                           contest_id=contest_id,
+                           player__untappd_username__in={uv.untappd_user
+                                                         for uv in checkins})
+                       .select_related('player')}
+    new_checkins = []
+    for url, (uv, error) in parsed:
+        if uv is None:
+            results[url] = SubmitResult(url, INVALID, error, None)
+        elif uv.untappd_checkin_date is None:
+            results[url] = SubmitResult(url, INVALID,
+                                        'Unable to find the checkin time', None)
+        elif uv.untappd_user not in contest_players:
+            results[url] = SubmitResult(
+                url, UNKNOWN_PLAYER, "Can't link Untappd user {} to contest {}".format(
+                    uv.untappd_user, contest_id), None)
+        elif uv.untappd_checkin in known:
+            results[url] = SubmitResult(url, DUPLICATE,
+                                        'already in the contest', None)
+        else:
+            known.add(uv.untappd_checkin)
+            uv.contest_player = contest_players[uv.untappd_user]
+            new_checkins.append(uv)
+            results[url] = SubmitResult(url, CREATED, None, uv)
+    if new_checkins:
+        Unvalidated_Checkin.objects.bulk_create(new_checkins)
+        logger.info('Saved %s unvalidated checkins for contest %s',
+                    len(new_checkins), contest_id)
+    submitted = []
+    seen = set()
+    for url in urls:
+        if url in seen:
+            submitted.append(SubmitResult(url, DUPLICATE, 'repeated in the list', None))
+        else:
+            seen.add(url)
+            submitted.append(results[url])
+    return submitted
+
+def _optional_id(value):
+    """Returns an ID from a request as an integer, or None if it's missing"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError('{} is not an ID'.format(value))
+    return int(value)
+
+def parse_assignment(data):
+    """
+    Reads an Assignment from a dictionary in the form that validate_checkin
+    takes: 'checkin', the Unvalidated_Checkin ID, either 'as_beer', a
+    Contest_Beer ID, or 'as_brewery', a Contest_Brewery ID, 'bonuses', a list
+    of bonus names, and 'preserve', whether to keep the unvalidated checkin
+    """
+    if not isinstance(data, dict):
+        return Assignment(None, None, None, [], False, 'Expected an object')
+    try:
+        checkin_id = _optional_id(data.get('checkin'))
+    except (TypeError, ValueError):
+        return Assignment(None, None, None, [], False,
+                          'Checkin ID should be an integer')
+    if checkin_id is None:
+        return Assignment(None, None, None, [], False, 'Expected checkin ID')
+    error = None
+    beer_id, brewery_id = None, None
+    try:
+        beer_id = _optional_id(data.get('as_beer'))
+        brewery_id = _optional_id(data.get('as_brewery'))
+    except (TypeError, ValueError):
+        error = 'Beer and brewery IDs should be integers'
+    bonuses = data.get('bonuses') or []
+    if beer_id is not None and brewery_id is not None:
+        error = 'Only one of as_beer and as_brewery can be given'
+    elif not isinstance(bonuses, list) \
+            or not all(isinstance(bonus, str) for bonus in bonuses):
+        error = 'Bonuses should be a list of bonus names'
+    return Assignment(checkin_id, beer_id, brewery_id, bonuses,
+                      bool(data.get('preserve')), error)
+
+def _contest_checkin(uv, contest_player, tx_type, points, **target):
+    """Builds a Contest_Checkin from an unvalidated checkin"""
+    return Contest_Checkin(contest_player=contest_player,
+                           tx_type=tx_type,
+                           checkin_points=points,
+                           checkin_time=uv.untappd_checkin_date,
+                           untappd_checkin=uv.untappd_checkin,
+                           **target)
+
+def validate_checkins(contest_id, assignments):
+    """
+    Validates many of a contest's unvalidated checkins at once, returning a
+    ValidateResult for each Assignment in the order given. The points are
+    the same as validating each checkin in turn with drink_beer,
+    drink_at_brewery and drink_bonus, but everything the assignments refer
+    to is loaded in a fixed number of queries, the points are added up in
+    memory, and the new Contest_Checkins are inserted together followed by
+    one update for each player whose points changed.
+
+    The players and challengers involved are locked until the end, so
+    single validations of the same players can run at the same time. An
+    assignment that refers to something not in the contest is skipped and
+    doesn't stop the rest from being validated.
+    """
+    results = []
+    checkin_ids = {a.checkin_id for a in assignments if a.error is None}
+    beer_ids = {a.beer_id for a in assignments
+                if a.error is None and a.beer_id is not None}
+    brewery_ids = {a.brewery_id for a in assignments
+                   if a.error is None and a.brewery_id is not None}
+    bonus_names = {bonus for a in assignments if a.error is None for bonus in a.bonuses}
+    with transaction.atomic():
+        uv_checkins = Unvalidated_Checkin.objects.filter(
+            id__in=checkin_ids, contest_player__contest_id=contest_id)
+        beers = {beer.id: beer for beer in Contest_Beer.objects.filter(
+            id__in=beer_ids, contest_id=contest_id)}
+        breweries = {brewery.id: brewery for brewery in Contest_Brewery.objects.filter(
+            id__in=brewery_ids, contest_id=contest_id)}
+        bonuses = {bonus.name: bonus for bonus in Contest_Bonus.objects.filter(
+            name__in=bonus_names, contest_id=contest_id)}
+        player_ids = (set(uv_checkins.values_list('contest_player_id', flat=True))
+                      | {beer.challenger_id for beer in beers.values()
+                         if beer.challenger_id is not None})
+        # The players are locked in ID order, as Contest_Player does, and
+        # then the checkins, which a concurrent validation may have deleted
+        # in the meantime
+        players = {cp.id: cp for cp in Contest_Player.objects.select_for_update()
+                   .filter(id__in=player_ids).order_by('id')}
+        uvs = {uv.id: uv for uv in uv_checkins.select_for_update(of=('self',))
+               .filter(contest_player_id__in=players.keys()).order_by('id')}
+        # What the players have already drunk, and what each challenger has
+        # already lost to their beer
+        drunk = set()
+        lost = Counter()
+        for player_id, beer_id, brewery_id, tx_type, points in \
+                Contest_Checkin.objects.filter(
+                    Q(contest_beer_id__in=beers.keys(),
+                      contest_player_id__in=player_ids)
+                    | Q(contest_beer_id__in=beers.keys(), tx_type='CL')
+                    | Q(contest_brewery_id__in=breweries.keys(),
+                        contest_player_id__in=player_ids)).values_list(
+                            'contest_player_id', 'contest_beer_id',
+                            'contest_brewery_id', 'tx_type', 'checkin_points'):
+            if tx_type == 'CL':
+                if player_id == beers[beer_id].challenger_id:
+                    lost[beer_id] += points
+            elif beer_id is not None:
+                drunk.add((player_id, 'beer', beer_id))
+            else:
+                drunk.add((player_id, 'brewery', brewery_id))
+
+        new_checkins = []
+        changed = {}
+        to_delete = []
+        validated = set()
+        for assignment in assignments:
+            if assignment.error is not None:
+                results.append(ValidateResult(assignment.checkin_id, INVALID,
+                                              assignment.error, 0))
+                continue
+            uv = uvs.get(assignment.checkin_id)
+            error = None
+            if uv is None:
+                results.append(ValidateResult(assignment.checkin_id, UNKNOWN_CHECKIN,
+                                              'No such checkin in contest', 0))
+                continue
+            if uv.id in validated:
+                error = 'repeated in the list'
+            elif assignment.beer_id is not None and assignment.beer_id not in beers:
+                error = 'No such beer with id {} in contest'.format(assignment.beer_id)
+            elif assignment.brewery_id is not None \
+                    and assignment.brewery_id not in breweries:
+                error = 'No such brewery with id {} in contest'.format(
+                    assignment.brewery_id)
+            else:
+                for bonus in assignment.bonuses:
+                    if bonus not in bonuses:
+                        error = 'No such bonus {} for contest'.format(bonus)
+                        break
+            if error is not None:
+                results.append(ValidateResult(uv.id, INVALID, error, 0))
+                continue
+            validated.add(uv.id)
+            player = players[uv.contest_player_id]
+            fields = changed.setdefault(player.id, set())
+            before = player.total_points
+
+            if assignment.brewery_id is not None:
+                brewery = breweries[assignment.brewery_id]
+                if (player.id, 'brewery', brewery.id) not in drunk:
+                    drunk.add((player.id, 'brewery', brewery.id))
+                    new_checkins.append(_contest_checkin(
+                        uv, player, 'BR', brewery.point_value, contest_brewery=brewery))
+                    fields.update(player.add_points('brewery_points', brewery.point_value))
+                    player.last_checkin_date = uv.untappd_checkin_date
+                    player.last_checkin_beer = None
+                    player.last_checkin_brewery = brewery.brewery_name
+                    fields.update(LAST_CHECKIN_FIELDS)
+            elif assignment.beer_id is not None:
+                beer = beers[assignment.beer_id]
+                if (player.id, 'beer', beer.id) not in drunk:
+                    drunk.add((player.id, 'beer', beer.id))
+                    if beer.challenger_id == player.id:
+                        new_checkins.append(_contest_checkin(
+                            uv, player, 'CS', beer.challenge_point_value, contest_beer=beer))
+                        fields.update(player.add_points('challenge_point_gain',
+                                                        beer.challenge_point_value))
+                    else:
+                        new_checkins.append(_contest_checkin(
+                            uv, player, 'CO' if beer.challenger_id else 'BE',
+                            beer.point_value, contest_beer=beer))
+                        fields.update(player.add_points('beer_points', beer.point_value))
+                    if beer.challenger_id is not None and beer.challenger_id != player.id \
+                            and -(lost[beer.id] - beer.challenge_point_loss) \
+                                <= beer.max_point_loss:
+                        challenger = players[beer.challenger_id]
+                        lost[beer.id] -= beer.challenge_point_loss
+                        new_checkins.append(_contest_checkin(
+                            uv, challenger, 'CL', -beer.challenge_point_loss,
+                            contest_beer=beer))
+                        changed.setdefault(challenger.id, set()).update(
+                            challenger.add_points('challenge_point_loss',
+                                                  beer.challenge_point_loss))
+                    player.beer_count = player.beer_count + 1
+                    player.last_checkin_date = uv.untappd_checkin_date
+                    player.last_checkin_beer = beer.beer_name
+                    player.last_checkin_brewery = None
+                    fields.update(['beer_count'] + LAST_CHECKIN_FIELDS)
+            for bonus in assignment.bonuses:
+                contest_bonus = bonuses[bonus]
+                new_checkins.append(_contest_checkin(
+                    uv, player, 'BO', contest_bonus.point_value, contest_bonus=contest_bonus))
+                fields.update(player.add_points('bonus_points', contest_bonus.point_value))
+            if not assignment.preserve:
+                to_delete.append(uv.id)
+            results.append(ValidateResult(uv.id, VALIDATED, None,
+                                          player.total_points - before))
+
+        Contest_Checkin.objects.bulk_create(new_checkins)
+        for player_id in sorted(changed):
+            if changed[player_id]:
+                players[player_id].save(update_fields=sorted(changed[player_id]))
+        if to_delete:
+            Unvalidated_Checkin.objects.filter(id__in=to_delete).delete()
+    logger.info('Validated %s of %s checkins for contest %s with %s new contest checkins',
+                len(validated), len(assignments), contest_id, len(new_checkins))
+    return results
@@ -0,0 +1,224 @@
+"""The HTTP client shared by everything that reads from Untappd"""
+
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from http.client import HTTPException
+from urllib.error import URLError
+from urllib.parse import urljoin, urlparse
+from urllib.request import urlopen, Request
+import urllib3
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth trying again after a pause: Untappd throttling us, or a
+# server or gateway that is briefly unavailable
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+REDIRECT_STATUSES = frozenset([301, 302, 303, 307, 308])
+MAX_REDIRECTS = 5
+# The longest pause between attempts, including one asked for by Retry-After
+MAX_RETRY_WAIT = 30
+
+# A downloaded page. url is where it was finally read from, after any
+# redirects, and headers can be read without regard to case.
+HttpResponse = namedtuple('HttpResponse', ['url', 'status', 'headers', 'body'])
+
+
+class ClientError(Exception):
+    """A request that failed, after any retries"""
+
+
+class StatusError(ClientError):
+    """A request answered with an error status"""
+
+    def __init__(self, url, status, reason=''):
+        super().__init__('HTTP Error {}: {}'.format(status, reason))
+        self.url = url
+        self.status = status
+
+
+class TokenBucket:
+    """
+    Limits requests to rate a second on average, allowing bursts of up to
+    capacity at once. Callers that find the bucket empty reserve the next
+    token and sleep until it is due, so waiting threads are served in turn.
+    A rate of 0 turns the limit off.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a request can be made, returning the seconds waited"""
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class UntappdClient:
+    """
+    Makes GET requests through a pool of keep-alive connections, so
+    repeated requests to a host don't each pay for a new TCP and TLS
+    handshake. Requests are rate limited with a TokenBucket, and ones whose
+    connection is refused or dropped, or that get a status in
+    RETRY_STATUSES, are retried up to retries times after a random pause of
+    up to backoff * 2 ** attempt seconds. The timeout is the budget for the
+    whole of a get, including redirects, retries, the pauses between them
+    and waiting for the rate limit. Attempts stop when it runs out, and
+    timeouts themselves aren't retried. file: URLs are read directly, which
+    the tests use.
+
+    One client is safe to share between threads; see get_client.
+    """
+
+    def __init__(self, rate=None, burst=None, retries=None, backoff=None,
+                 pool_size=None, timeout=None):
+        if rate is None:
+            rate = settings.UNTAPPD_REQUESTS_PER_SECOND
+        if burst is None:
+            burst = settings.UNTAPPD_BURST
+        if retries is None:
+            retries = settings.UNTAPPD_RETRIES
+        if backoff is None:
+            backoff = settings.UNTAPPD_RETRY_BACKOFF
+        if pool_size is None:
+            pool_size = settings.CHECKIN_LOADER_CONCURRENCY
+        if timeout is None:
+            timeout = settings.CHECKIN_FEED_TIMEOUT
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pool = urllib3.PoolManager(maxsize=pool_size)
+
+    def get(self, url, headers=None, timeout=None):
+        """
+        Returns the HttpResponse for url, following redirects. Statuses
+        below 400, including a 304 for a conditional request, are returned;
+        others raise a StatusError. Anything else that goes wrong raises a
+        ClientError.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if urlparse(url).scheme == 'file':
+            return self.__read_file(url, headers, timeout)
+        give_up = time.monotonic() + timeout
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.__request(url, headers, give_up)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                break
+            url = urljoin(url, location)
+        else:
+            raise ClientError('Too many redirects from {}'.format(url))
+        if response.status >= 400:
+            raise StatusError(url, response.status, response.reason)
+        return HttpResponse(url, response.status, response.headers, response.data)
+
+    @staticmethod
+    def __remaining(url, give_up):
+        """The seconds left until give_up, raising a ClientError if none"""
+        remaining = give_up - time.monotonic()
+        if remaining <= 0:
+            raise ClientError('Timed out requesting {}'.format(url))
+        return remaining
+
+    def __request(self, url, headers, give_up):
+        """
+        Makes one request, retrying transient failures until the
+        time.monotonic() value give_up
+        """
+        attempt = 0
+        while True:
+            self.__remaining(url, give_up)
+            self.bucket.acquire()
+            timeout = urllib3.Timeout(total=self.__remaining(url, give_up))
+            retry_after = None
+            try:
+                response = self.pool.request('GET', url, headers=headers,
+                                             timeout=timeout, retries=False,
+                                             redirect=False)
+                if response.status not in RETRY_STATUSES:
+                    return response
+                failure = StatusError(url, response.status, response.reason)
+                retry_after = response.headers.get('Retry-After')
+            except (urllib3.exceptions.NewConnectionError,
+                    urllib3.exceptions.ProtocolError) as exc:
+                failure = ClientError(exc)
+            except (urllib3.exceptions.HTTPError, OSError, ValueError,
+                    HTTPException) as exc:
+                raise ClientError(exc) from exc
+            pause = self.__pause(attempt, retry_after)
+            if attempt >= self.retries or time.monotonic() + pause >= give_up:
+                if isinstance(failure, StatusError):
+                    return response
+                raise failure
+            time.sleep(pause)
+            attempt += 1
+            logger.info('Retrying %s, attempt %s: %s', url, attempt, failure)
+
+    def __pause(self, attempt, retry_after=None):
+        """The seconds to wait before trying again, with jitter"""
+        if retry_after is not None and retry_after.isdigit():
+            return min(MAX_RETRY_WAIT, int(retry_after))
+        return random.uniform(0, min(MAX_RETRY_WAIT, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def __read_file(url, headers, timeout):
+        try:
+            with urlopen(Request(url, headers=headers or {}),
+                         timeout=timeout) as response:
+                return HttpResponse(response.geturl(), 200, response.headers,
+                                    response.read())
+        except (URLError, OSError, ValueError) as exc:
+            raise ClientError(exc) from exc
+
+
+_client = None
+_feed_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the UntappdClient the process scrapes Untappd pages with,
+    creating it if needed
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = UntappdClient()
+        return _client
+
+
+def get_feed_client():
+    """
+    Returns the UntappdClient the process downloads RSS feeds with,
+    creating it if needed. It has its own rate limit,
+    CHECKIN_FEED_REQUESTS_PER_SECOND, so the loader's concurrency isn't
+    capped by the limit on page scrapes, and feeds and scrapes don't hold
+    each other up.
+    """
+    global _feed_client
+    with _client_lock:
+        if _feed_client is None:
+            _feed_client = UntappdClient(
+                rate=settings.CHECKIN_FEED_REQUESTS_PER_SECOND,
+                burst=settings.CHECKIN_LOADER_CONCURRENCY)
+        return _feed_client
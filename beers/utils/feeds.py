@@ -0,0 +1,363 @@
+"""Fetches the Untappd RSS feeds for players ahead of loading checkins"""
+
+import hashlib
+import io
+import logging
+import os
+import pathlib
+import tarfile
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+from urllib.parse import urlparse
+from django.conf import settings
+from django.utils import timezone
+from beers.models import Player_Feed
+from beers.utils.client import get_feed_client, ClientError
+from beers.utils.locks import try_lock, unlock, PLAYER_LOAD
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {'User-Agent': 'onehundredbeers feed loader'}
+
+FETCHED = 'fetched'
+NOT_MODIFIED = 'not_modified'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+BROKEN = 'broken'
+LOCKED = 'locked'
+
+# One item of an RSS feed. published is the text of its pubDate.
+RssEntry = namedtuple('RssEntry', ['link', 'title', 'published', 'description'])
+
+
+def _text(elem, tag):
+    text = elem.findtext(tag)
+    return text.strip() if text is not None else None
+
+
+def iter_entries(source):
+    """
+    Parses an RSS feed incrementally, yielding an RssEntry for each item as
+    soon as it has been read. Items are dropped once they are yielded, so
+    memory stays bounded however long the feed is, and nothing past the
+    point where the caller stops is read. source is a file name or a binary
+    file object. Malformed XML raises xml.etree.ElementTree.ParseError
+    while iterating.
+    """
+    channel = None
+    for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'channel':
+                channel = elem
+        elif elem.tag == 'item':
+            yield RssEntry(_text(elem, 'link'), _text(elem, 'title'),
+                           _text(elem, 'pubDate'), _text(elem, 'description'))
+            if channel is not None:
+                channel.clear()
+            else:
+                elem.clear()
+
+
+class FeedResult:
+    """
+    The outcome of downloading one feed. There are only entries to load
+    when the status is FETCHED; for NOT_MODIFIED (an HTTP 304) and UNCHANGED
+    (the same body as last time) there is nothing new. SKIPPED feeds weren't
+    downloaded because the run's deadline passed, and BROKEN ones because
+    they failed recently. LOCKED feeds weren't downloaded because another
+    run was already loading the player. entries is an iterator of RssEntry
+    tuples, parsed as it is consumed, so it can only be read once. size is
+    the number of bytes downloaded or read, and elapsed the seconds it took.
+    """
+
+    def __init__(self, url, status, entries=None, etag=None, last_modified=None,
+                 content_hash=None, error=None, size=0):
+        self.url = url
+        self.status = status
+        self.entries = entries
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.error = error
+        self.size = size
+        self.elapsed = 0.0
+
+    def fail(self, error):
+        """
+        Marks a downloaded feed as FAILED, e.g. when its body turns out not
+        to be valid XML as its entries are read
+        """
+        self.status = FAILED
+        self.entries = None
+        self.error = error
+
+    def __str__(self):
+        return 'FeedResult[url={}, status={}]'.format(self.url, self.status)
+
+
+class FeedStats:
+    """
+    Counts the outcome of every feed download in a loader run, and keeps
+    the players whose feeds failed or were skipped for the run summary
+    """
+
+    def __init__(self):
+        self.counts = {FETCHED: 0, NOT_MODIFIED: 0, UNCHANGED: 0, FAILED: 0,
+                       SKIPPED: 0, BROKEN: 0, LOCKED: 0}
+        self.problems = []
+
+    def add(self, result, player=None):
+        """Counts a FeedResult for the player"""
+        self.counts[result.status] += 1
+        if result.status in (FAILED, SKIPPED, BROKEN, LOCKED):
+            self.problems.append((player, result))
+
+    @property
+    def hits(self):
+        """Feeds that were skipped because nothing changed since the last load"""
+        return self.counts[NOT_MODIFIED] + self.counts[UNCHANGED]
+
+    @property
+    def misses(self):
+        """Feeds that had to be parsed and loaded"""
+        return self.counts[FETCHED]
+
+    def details(self):
+        """Returns a line for each feed that failed or was skipped"""
+        return ['  {} {}: {}'.format(result.status,
+                                     player if player is not None else result.url,
+                                     result.error)
+                for player, result in self.problems]
+
+    def __str__(self):
+        return ('Feeds: {} loaded, {} not modified, {} unchanged, '
+                + '{} failed, {} skipped, {} broken, {} locked').format(
+                    self.counts[FETCHED], self.counts[NOT_MODIFIED],
+                    self.counts[UNCHANGED], self.counts[FAILED],
+                    self.counts[SKIPPED], self.counts[BROKEN],
+                    self.counts[LOCKED])
+
+
+class FeedSource:
+    """
+    Saved feeds to load instead of downloading them from Untappd, so loads
+    can be replayed and timed without the network. path is a directory or a
+    zip or tar archive holding one <username>.xml feed per player, named
+    after the player's user name.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.archived = {}
+        if os.path.isdir(path):
+            return
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    self.__add(name, archive.read(name))
+        elif os.path.isfile(path) and tarfile.is_tarfile(path):
+            with tarfile.open(path) as archive:
+                for member in archive.getmembers():
+                    if member.isfile():
+                        self.__add(member.name, archive.extractfile(member).read())
+        else:
+            raise ValueError('Expected a directory or an archive of feeds: '
+                             + '{}'.format(path))
+
+    def __add(self, name, body):
+        base = os.path.basename(name)
+        if base.endswith('.xml'):
+            self.archived[base[:-len('.xml')]] = body
+
+    def has_feed(self, player):
+        """Whether there is a saved feed for the player"""
+        username = player.user.username
+        return username in self.archived or (
+            os.path.isdir(self.path)
+            and os.path.isfile(os.path.join(self.path, username + '.xml')))
+
+    def fetch(self, player):
+        """Returns the FeedResult for the player's saved feed"""
+        username = player.user.username
+        url = os.path.join(self.path, username + '.xml')
+        if os.path.isdir(self.path) and os.path.isfile(url):
+            # Saved feeds are streamed from disk rather than read up front
+            return FeedResult(url, FETCHED, entries=iter_entries(url),
+                              size=os.path.getsize(url))
+        if username in self.archived:
+            body = self.archived[username]
+            return FeedResult(url, FETCHED, entries=iter_entries(io.BytesIO(body)),
+                              size=len(body))
+        logger.warning('No saved feed for %s in "%s"', username, self.path)
+        return FeedResult(url, FAILED,
+                          error='No saved feed for {}'.format(username))
+
+
+def _to_url(location):
+    """Allows feeds to be given as plain file paths"""
+    if urlparse(location).scheme:
+        return location
+    return pathlib.Path(location).absolute().as_uri()
+
+
+def fetch_feed(url, state=None, timeout=None):
+    """
+    Downloads a single RSS feed through the feed UntappdClient, returning
+    a FeedResult. If state is a Player_Feed for the same URL, its ETag and
+    Last-Modified values are sent as a conditional request, and a body
+    matching its content hash is not parsed again. A download taking longer
+    than timeout seconds, by default the CHECKIN_FEED_TIMEOUT setting,
+    fails. This does not touch the database, so it is safe to call from a
+    worker thread.
+    """
+    if timeout is None:
+        timeout = settings.CHECKIN_FEED_TIMEOUT
+    if state is not None and not state.matches(url):
+        state = None
+    logger.debug('Fetching feed "%s"', url)
+    headers = dict(HEADERS)
+    if state is not None and state.etag:
+        headers['If-None-Match'] = state.etag
+    if state is not None and state.last_modified:
+        headers['If-Modified-Since'] = state.last_modified
+    try:
+        response = get_feed_client().get(_to_url(url), headers=headers,
+                                         timeout=timeout)
+    except ClientError as exc:
+        logger.warning('Unable to fetch feed "%s": %s', url, exc)
+        return FeedResult(url, FAILED, error=exc)
+    if response.status == 304:
+        if state is not None:
+            return FeedResult(url, NOT_MODIFIED,
+                              etag=state.etag, last_modified=state.last_modified,
+                              content_hash=state.content_hash)
+        logger.warning('Unexpected 304 for feed "%s"', url)
+        return FeedResult(url, FAILED, error='HTTP Error 304: Not Modified')
+    body = response.body
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    content_hash = hashlib.sha256(body).hexdigest()
+    if state is not None and state.content_hash == content_hash:
+        return FeedResult(url, UNCHANGED, etag=etag, last_modified=last_modified,
+                          content_hash=content_hash, size=len(body))
+    return FeedResult(url, FETCHED, entries=iter_entries(io.BytesIO(body)),
+                      etag=etag, last_modified=last_modified,
+                      content_hash=content_hash, size=len(body))
+
+
+def fetch_feeds(players, concurrency=None, conditional=True, stats=None,
+                source=None, deadline=None, lock_players=False):
+    """
+    Downloads the feeds for the given players through a bounded thread pool.
+    Yields (player, FeedResult) pairs in the same order as the players are
+    passed in, so the caller can process one player's feed while the rest
+    are still downloading. Players without a feed are yielded with a result
+    of None. When reading from a source, a player's saved feed is found by
+    their user name, so it is read even if they have no RSS URL.
+
+    A feed that fails is skipped as BROKEN until its retry time, which backs
+    off with each consecutive failure; see Player_Feed.record_failure. The
+    caller can mark a feed it was unable to read as failed with
+    FeedResult.fail before asking for the next one. Feeds are counted and
+    their failures recorded once the caller is done with them.
+
+    concurrency: the maximum number of simultaneous downloads, defaulting to
+                 the CHECKIN_LOADER_CONCURRENCY setting
+    conditional: whether to use the players' Player_Feed rows, to skip
+                 feeds that haven't changed since their last load and to
+                 back off from broken ones. Without it, players don't need
+                 to be saved.
+    stats: an optional FeedStats that counts the results
+    source: an optional FeedSource to read saved feeds from rather than
+            downloading them, in which case conditional is ignored
+    deadline: an optional time.monotonic() value after which no more
+              downloads are started; the remaining feeds are SKIPPED
+    lock_players: whether to take each player's PLAYER_LOAD advisory lock
+                  before downloading their feed. Players that another run
+                  is loading are LOCKED rather than downloaded. A player's
+                  lock is held until the caller asks for the next feed, so
+                  it covers loading the checkins too.
+    """
+    if concurrency is None:
+        concurrency = settings.CHECKIN_LOADER_CONCURRENCY
+    if concurrency < 1:
+        raise ValueError('Concurrency must be at least 1')
+
+    players = list(players)
+    states = {}
+    if source is None and conditional:
+        states = {state.player_id: state for state in
+                  Player_Feed.objects.filter(player__in=players)}
+    now = timezone.now()
+    with_feed = frozenset(player.id for player in players
+                          if player.untappd_rss
+                          or (source is not None and source.has_feed(player)))
+    # Locks are taken up front by this thread, as they belong to its
+    # database connection
+    held = set()
+    if lock_players:
+        held = {player.id for player in players
+                if player.id in with_feed and try_lock(PLAYER_LOAD, player.id)}
+    locked = frozenset(player.id for player in players
+                       if lock_players and player.id not in held)
+
+    def _fetch(player):
+        if player.id not in with_feed:
+            return None
+        start = time.perf_counter()
+        result = _download(player)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def _download(player):
+        if player.id in locked:
+            return FeedResult(player.untappd_rss, LOCKED,
+                              error='being loaded by another run')
+        if source is not None:
+            return source.fetch(player)
+        state = states.get(player.id)
+        if state is not None and state.is_broken(now):
+            return FeedResult(player.untappd_rss, BROKEN,
+                              error='{} failures, retrying after {}'.format(
+                                  state.failures, state.retry_after.isoformat()))
+        timeout = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return FeedResult(player.untappd_rss, SKIPPED,
+                                  error='run deadline passed')
+            timeout = min(settings.CHECKIN_FEED_TIMEOUT, remaining)
+        return fetch_feed(player.untappd_rss, state, timeout=timeout)
+
+    def _record(player, result):
+        if source is None and conditional:
+            state = states.get(player.id)
+            if result.status == FAILED:
+                Player_Feed.objects.record_failure(player, result.url,
+                                                   result.error)
+            elif (result.status in (FETCHED, NOT_MODIFIED, UNCHANGED)
+                  and state is not None and state.failures > 0):
+                Player_Feed.objects.reset_failures(player)
+        if stats is not None:
+            stats.add(result, player)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for player, result in zip(players, executor.map(_fetch, players)):
+                try:
+                    yield player, result
+                finally:
+                    # The caller may have found the feed unreadable
+                    if result is not None:
+                        _record(player, result)
+                    if player.id in held:
+                        unlock(PLAYER_LOAD, player.id)
+                        held.discard(player.id)
+    finally:
+        # Anything left over if the caller stopped early or failed
+        for player_id in held:
+            unlock(PLAYER_LOAD, player_id)
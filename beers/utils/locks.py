@@ -0,0 +1,59 @@
+"""Postgres advisory locks that keep checkin loads from overlapping"""
+
+import logging
+from contextlib import contextmanager
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Advisory locks are keyed by two integers. The first says what is being
+# locked, so these can't collide with locks taken by anything else sharing
+# the database, and the second is the ID of the thing locked.
+LOADER_RUN = 0x68620001
+PLAYER_LOAD = 0x68620002
+
+
+def try_lock(space, key=0):
+    """
+    Takes the advisory lock for (space, key) if no other database session
+    holds it, returning whether it was taken. The lock belongs to the
+    session rather than a transaction, so it is held until unlock is called
+    or the connection closes, e.g. when a crashed run's process exits.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [space, key])
+        return cursor.fetchone()[0]
+
+
+def lock(space, key=0):
+    """Waits for and takes the advisory lock for (space, key)"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(%s, %s)', [space, key])
+
+
+def unlock(space, key=0):
+    """Releases an advisory lock taken with try_lock or lock"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [space, key])
+        if not cursor.fetchone()[0]:
+            logger.warning('Advisory lock (%s, %s) was not held', space, key)
+
+
+@contextmanager
+def advisory_lock(space, key=0, wait=False):
+    """
+    Holds the advisory lock for (space, key) for the body of a with
+    statement, yielding whether it was taken. Unless wait is True, the body
+    runs without the lock, and should skip its work, when another session
+    already holds it.
+    """
+    if wait:
+        lock(space, key)
+        acquired = True
+    else:
+        acquired = try_lock(space, key)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            unlock(space, key)
@@ -0,0 +1,104 @@
+"""Measures where the time and data of a checkin loader run go"""
+
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+
+class RunMetrics:
+    """
+    Collects the timings, sizes and counts for load_checkins --report:
+    the wall time of each phase of the run, the bytes downloaded, why feed
+    entries were or weren't loaded, the rows inserted and the slowest feeds.
+    run_skipped is set when the run did nothing because another run held
+    the loader lock.
+    """
+
+    def __init__(self):
+        self.run_skipped = False
+        self.phases = OrderedDict()
+        self.entries = Counter()
+        self.bytes = 0
+        self.rows_inserted = 0
+        self.feeds = []
+
+    def add_time(self, name, seconds):
+        """Adds seconds to the time spent in the named phase"""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Times the body of a with statement as part of the named phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of iterable, counting the time spent waiting for
+        each of them as part of the named phase
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def add_feed(self, player, result):
+        """Records the size and download time of a player's FeedResult"""
+        self.bytes += result.size
+        self.feeds.append((result.elapsed, str(player), result))
+
+    def slowest(self, count=5):
+        """Returns the count slowest feeds as (seconds, player, FeedResult)"""
+        return sorted(self.feeds, key=lambda feed: feed[0], reverse=True)[:count]
+
+    def as_dict(self, stats=None):
+        """Returns the metrics, and the FeedStats if given, as a dictionary"""
+        result = OrderedDict()
+        result['run_skipped'] = self.run_skipped
+        if stats is not None:
+            result['feeds'] = dict(stats.counts)
+        result['phases'] = OrderedDict((name, round(seconds, 4))
+                                       for name, seconds in self.phases.items())
+        result['bytes'] = self.bytes
+        result['entries'] = dict(self.entries)
+        result['rows_inserted'] = self.rows_inserted
+        result['slowest_feeds'] = [OrderedDict([('player', player),
+                                                ('url', feed.url),
+                                                ('status', feed.status),
+                                                ('seconds', round(seconds, 4)),
+                                                ('bytes', feed.size)])
+                                   for seconds, player, feed in self.slowest()]
+        return result
+
+    def as_table(self, stats=None):
+        """Returns the metrics, and the FeedStats if given, as lines of text"""
+        lines = []
+        if self.run_skipped:
+            lines.append('Run skipped: another run is in progress')
+        if stats is not None:
+            lines.append('Feeds')
+            lines.extend('  {:<22}{:>10}'.format(status, count)
+                         for status, count in stats.counts.items())
+        lines.append('Phases')
+        lines.extend('  {:<22}{:>10.3f}s'.format(name, seconds)
+                     for name, seconds in self.phases.items())
+        lines.append('Data')
+        lines.append('  {:<22}{:>10}'.format('bytes', self.bytes))
+        lines.append('  {:<22}{:>10}'.format('rows inserted', self.rows_inserted))
+        lines.append('Entries')
+        lines.extend('  {:<22}{:>10}'.format(reason, count)
+                     for reason, count in sorted(self.entries.items()))
+        lines.append('Slowest feeds')
+        lines.extend('  {:<22}{:>10.3f}s {:>10} bytes  {}'.format(
+                         player, seconds, feed.size, feed.status)
+                     for seconds, player, feed in self.slowest())
+        return lines
@@ -0,0 +1,183 @@
+"""An on-disk cache of the Untappd pages read by the scrapers"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BEER = 'beer'
+BREWERY = 'brewery'
+CHECKIN = 'checkin'
+KINDS = (BEER, BREWERY, CHECKIN)
+
+# A cached page. url is where the page was finally read from, after any
+# redirects, and age is the number of seconds since it was downloaded.
+CachedPage = namedtuple('CachedPage', ['url', 'kind', 'body', 'size', 'age'])
+
+# The summary of one kind of page in the cache
+CacheSummary = namedtuple('CacheSummary', ['kind', 'entries', 'size', 'expired'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_used_at ON pages (used_at);
+CREATE TABLE IF NOT EXISTS redirects (
+    url TEXT PRIMARY KEY,
+    target TEXT NOT NULL
+);
+"""
+
+
+class PageCache:
+    """
+    Untappd pages kept in a SQLite database in directory, keyed by the URL
+    they were read from. A URL that redirected is recorded against its
+    target, so either finds the page. Pages expire after the TTL in ttls,
+    in seconds, for their kind. Once the pages take up more than max_size
+    bytes, the least recently used are dropped. The database can be shared
+    by threads and processes.
+    """
+
+    def __init__(self, directory, max_size, ttls):
+        self.path = os.path.join(directory, 'pages.sqlite3')
+        self.max_size = max_size
+        self.ttls = ttls
+        os.makedirs(directory, exist_ok=True)
+        with self.__connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def __connect(self):
+        # A connection per call keeps threads from sharing one
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def __target(self, db, url):
+        row = db.execute('SELECT target FROM redirects WHERE url = ?',
+                         [url]).fetchone()
+        return row['target'] if row is not None else url
+
+    def get(self, url, kind=None):
+        """
+        Returns the CachedPage for url, or None if it isn't cached or has
+        expired. Unless kind is None, pages of other kinds aren't returned.
+        """
+        now = time.time()
+        with self.__connect() as db:
+            target = self.__target(db, url)
+            row = db.execute('SELECT * FROM pages WHERE url = ?',
+                             [target]).fetchone()
+            if row is None or (kind is not None and row['kind'] != kind):
+                return None
+            if now - row['fetched_at'] > self.ttls[row['kind']]:
+                return None
+            db.execute('UPDATE pages SET used_at = ? WHERE url = ?',
+                       [now, target])
+        return CachedPage(target, row['kind'], row['body'], row['size'],
+                          now - row['fetched_at'])
+
+    def put(self, url, target, kind, body):
+        """
+        Caches the page of the given kind that was read from target after
+        requesting url, then drops the least recently used pages if the
+        cache is over its size
+        """
+        now = time.time()
+        with self.__connect() as db:
+            db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                       [target, kind, body, len(body), now, now])
+            if url != target:
+                db.execute('INSERT OR REPLACE INTO redirects VALUES (?, ?)',
+                           [url, target])
+            self.__evict(db)
+
+    def __evict(self, db):
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if total <= self.max_size:
+            return
+        evicted = 0
+        rows = db.execute('SELECT url, size FROM pages ORDER BY used_at').fetchall()
+        for row in rows:
+            if total <= self.max_size:
+                break
+            db.execute('DELETE FROM pages WHERE url = ?', [row['url']])
+            total -= row['size']
+            evicted += 1
+        db.execute('DELETE FROM redirects WHERE target NOT IN (SELECT url FROM pages)')
+        logger.debug('Evicted %s pages from the Untappd cache', evicted)
+
+    def summary(self):
+        """Returns a CacheSummary for each kind of page"""
+        now = time.time()
+        result = []
+        with self.__connect() as db:
+            for kind in KINDS:
+                row = db.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0), '
+                    + 'COALESCE(SUM(fetched_at < ?), 0) FROM pages WHERE kind = ?',
+                    [now - self.ttls[kind], kind]).fetchone()
+                result.append(CacheSummary(kind, row[0], row[1], row[2]))
+        return result
+
+    def purge(self, kind=None, url=None, expired_only=False):
+        """
+        Removes pages, all of them by default, or only those of a kind, for
+        a URL or that have expired, returning how many were removed
+        """
+        now = time.time()
+        removed = 0
+        with self.__connect() as db:
+            for each in KINDS:
+                if kind is not None and each != kind:
+                    continue
+                query = 'DELETE FROM pages WHERE kind = ?'
+                params = [each]
+                if url is not None:
+                    query += ' AND url = ?'
+                    params.append(self.__target(db, url))
+                if expired_only:
+                    query += ' AND fetched_at < ?'
+                    params.append(now - self.ttls[each])
+                removed += db.execute(query, params).rowcount
+            db.execute('DELETE FROM redirects WHERE target NOT IN (SELECT url FROM pages)')
+        return removed
+
+
+_cache = None
+_cache_settings = None
+_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """
+    Returns the process's PageCache, or None if the UNTAPPD_CACHE_DIR
+    setting is empty
+    """
+    global _cache, _cache_settings
+    if not settings.UNTAPPD_CACHE_DIR:
+        return None
+    current = (settings.UNTAPPD_CACHE_DIR, settings.UNTAPPD_CACHE_MAX_SIZE,
+               settings.UNTAPPD_CACHE_TTLS)
+    with _cache_lock:
+        if _cache is None or _cache_settings != current:
+            _cache = PageCache(*current)
+            _cache_settings = current
+        return _cache
@@ -0,0 +1,38 @@
+"""Runs the Untappd scrape jobs queued by the web tier"""
+
+import logging
+from beers.models import Scrape_Job
+from beers.utils.checkin import submit_checkin_urls, CREATED
+from beers.utils.client import ClientError
+from beers.utils.untappd import lookup_beer, lookup_brewery, UntappdParseException
+
+logger = logging.getLogger(__name__)
+
+def run_scrape_job(job):
+    """
+    Scrapes the page for a claimed Scrape_Job, then records the result and
+    how long it took on the job. A checkin is added to the job's contest
+    for validation; a beer or brewery is looked up and stored as for the
+    lookup endpoints.
+    """
+    try:
+        if job.kind == Scrape_Job.CHECKIN:
+            result = submit_checkin_urls(job.contest_id, [job.url], concurrency=1)[0]
+            if result.status != CREATED:
+                job.finish(Scrape_Job.FAILED, result.error)
+                return job
+            object_id = result.checkin.id
+        elif job.kind == Scrape_Job.BEER:
+            object_id = lookup_beer(job.url).id
+        else:
+            object_id = lookup_brewery(job.url).id
+    except (UntappdParseException, ClientError) as exc:
+        logger.warning('Unable to scrape %s: %s', job.url, exc)
+        job.finish(Scrape_Job.FAILED, '{}'.format(exc))
+        return job
+    except Exception as exc:
+        logger.exception('Scrape job for {} failed'.format(job.url))
+        job.finish(Scrape_Job.FAILED, '{}: {}'.format(type(exc).__name__, exc))
+        return job
+    job.finish(Scrape_Job.DONE, object_id=object_id)
+    return job
@@ -1,12 +1,13 @@
 
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, SoupStrainer, Tag
 import datetime
 import logging
 import re
-from urllib.request import urlopen, Request
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse, urlunparse
 from django.utils import timezone
 from beers.models import Unvalidated_Checkin, Beer, Brewery
+from beers.utils.client import get_client, HttpResponse
+from beers.utils.page_cache import get_page_cache, BEER, BREWERY, CHECKIN
 
 logger = logging.getLogger(__name__)
 
@@ -14,126 +15,245 @@ RE_RATING = re.compile('r[0-9]{3}')
 HEADERS= {'User-Agent':
           'Mozilla/5.0 (Windows NT 10.0; WOW64; rv:66.0) Gecko/20100101 Firefox/66.0'}
 
+# The classes of the only tags on an Untappd page that the scrapers read,
+# apart from the title
+SCRAPED_CLASSES = frozenset(['beer', 'user-info', 'photo', 'name', 'time', 'rating'])
+
+def _is_scraped(classes):
+    """Whether a tag with the given class attribute is one the scrapers read"""
+    return classes is not None and not SCRAPED_CLASSES.isdisjoint(classes.split())
+
+# Only the scraped tags and their contents are built into the soup, which
+# saves building a tree of the rest of the page
+STRAINER = SoupStrainer(class_=_is_scraped)
+TITLE_STRAINER = SoupStrainer('title')
+
 class UntappdParseException(Exception):
     pass
 
+def make_soup(body):
+    """
+    Parses the HTML of an Untappd page, keeping only the tags matched by
+    STRAINER
+    """
+    return BeautifulSoup(body, "html.parser", parse_only=STRAINER)
+
+def parse_title(body):
+    """Returns the title tag of an Untappd page, parsing only its head"""
+    end = body.find(b'</head>')
+    if end >= 0:
+        body = body[:end]
+    return BeautifulSoup(body, "html.parser", parse_only=TITLE_STRAINER).find('title')
+
+def fetch_page(url, kind):
+    """
+    Returns the HttpResponse for an Untappd page of the given kind, one of
+    the page_cache kinds, from the on-disk cache if it's there. Pages that
+    are downloaded are cached under the URL and any redirect target.
+    """
+    cache = get_page_cache()
+    if cache is None or urlparse(url).scheme not in ('http', 'https'):
+        return get_client().get(url, headers=HEADERS)
+    page = cache.get(url, kind)
+    if page is not None:
+        logger.debug('Using cached %s page for %s', kind, url)
+        return HttpResponse(page.url, 200, {}, page.body)
+    response = get_client().get(url, headers=HEADERS)
+    if response.status == 200:
+        cache.put(url, response.url, kind, response.body)
+    return response
+
 def parse_checkin(url):
     """
     Takes in a URL and parses the result into a Unvalidated_Checkin object 
     with the following attributes, all optional:
 
     """
-    with urlopen(Request(url, headers=HEADERS)) as response:
-        soup = BeautifulSoup(response, "html.parser")
-        result = Unvalidated_Checkin()
-        # Get title
-        title = soup.find('title')
-        result.untappd_title = title.string.strip()
-
-        # Get beer info and error if it's not there
-        checkinInfo = soup.find("div", class_="beer")
-        if checkinInfo is None:
-            raise UntappdParseException(
-                    "Unable to find beer information on checkin page")
-        links = checkinInfo.find_all("a")
-        for link in links:
-            if 'href' not in link.attrs:
-                continue
-            logger.info('Examining URL: {}'.format(link['href']))
-            if link['href'].startswith('/b/'):
-                result.beer = link.string.strip()
-                result.beer_url = urljoin(response.geturl(), link['href'])
-            elif link['href'].startswith('/brewery/') or link['href'].count('/') == 1:
-                result.brewery = link.string.strip()
-                result.brewery_url = urljoin(response.geturl(), link['href'])
-        userInfo = soup.find("div", class_="user-info")
-        if userInfo is None:
-            raise UntappdParseException(
-                    "Unable to find user information on checkin page")
-        links = userInfo.find_all("a")
-        for link in links:
-            if 'href' not in link.attrs:
-                continue
-            if link['href'].startswith('/user/'):
-                result.untappd_user = link['href'][link['href'].rfind('/')+1:]
-                logger.info('Extracted user {} from URL: {}'.format(result.untappd_user, 
-                                                                    link['href']))
-
-        if result.beer is None or result.beer_url is None:
-            raise UntappdParseException(
-                    "Unable to find beer information link on page")
-
-        timeP = soup.find('p', class_='time')
-        if timeP is not None:
-            result.untappd_checkin_date = datetime.datetime.strptime(
-                    timeP.string.strip(), 
-                    '%a, %d %b %Y %H:%M:%S %z')
-
-        result.untappd_checkin = response.geturl()
-
-        # Optional photo information
-        photoDiv = soup.find("div", class_="photo")
-        if photoDiv is not None:
-            photoLink = photoDiv.find("a")
-            result.photo_url = photoLink['data-image']
-
-        # Optional rating
-        ratingSpan = soup.find('span', class_='rating')
-        if ratingSpan is not None:
-            for cls in ratingSpan['class']:
-                # These look like 'r200' for a 2 star rating
-                if RE_RATING.match(cls):
-                    result.rating = int(cls[1:])
-        return result
+    response = fetch_page(url, CHECKIN)
+    soup = make_soup(response.body)
+    result = Unvalidated_Checkin()
+    # Get title
+    title = parse_title(response.body)
+    result.untappd_title = title.string.strip()
+
+    # Get beer info and error if it's not there
+    checkinInfo = soup.find("div", class_="beer")
+    if checkinInfo is None:
+        raise UntappdParseException(
+                "Unable to find beer information on checkin page")
+    links = checkinInfo.find_all("a")
+    for link in links:
+        if 'href' not in link.attrs:
+            continue
+        logger.info('Examining URL: {}'.format(link['href']))
+        if link['href'].startswith('/b/'):
+            result.beer = link.string.strip()
+            result.beer_url = urljoin(response.url, link['href'])
+        elif link['href'].startswith('/brewery/') or link['href'].count('/') == 1:
+            result.brewery = link.string.strip()
+            result.brewery_url = urljoin(response.url, link['href'])
+    userInfo = soup.find("div", class_="user-info")
+    if userInfo is None:
+        raise UntappdParseException(
+                "Unable to find user information on checkin page")
+    links = userInfo.find_all("a")
+    for link in links:
+        if 'href' not in link.attrs:
+            continue
+        if link['href'].startswith('/user/'):
+            result.untappd_user = link['href'][link['href'].rfind('/')+1:]
+            logger.info('Extracted user {} from URL: {}'.format(result.untappd_user, 
+                                                                link['href']))
+
+    if result.beer is None or result.beer_url is None:
+        raise UntappdParseException(
+                "Unable to find beer information link on page")
+
+    timeP = soup.find('p', class_='time')
+    if timeP is not None:
+        result.untappd_checkin_date = datetime.datetime.strptime(
+                timeP.string.strip(), 
+                '%a, %d %b %Y %H:%M:%S %z')
+
+    result.untappd_checkin = response.url
+
+    # Optional photo information
+    photoDiv = soup.find("div", class_="photo")
+    if photoDiv is not None:
+        photoLink = photoDiv.find("a")
+        result.photo_url = photoLink['data-image']
+
+    # Optional rating
+    ratingSpan = soup.find('span', class_='rating')
+    if ratingSpan is not None:
+        for cls in ratingSpan['class']:
+            # These look like 'r200' for a 2 star rating
+            if RE_RATING.match(cls):
+                result.rating = int(cls[1:])
+    return result
 
 def parse_beer(url, followBrewery=True):
-    with urlopen(Request(url, headers=HEADERS)) as response:
-        soup = BeautifulSoup(response, "html.parser")
-        result = Beer()
-        divs = soup.find_all('div', class_='name')
-        if len(divs) == 0:
-            raise UntappdParseException("Expected Beer URL at {}".format(url))
-        breweryUrl = None
-        result.untappd_url = response.geturl()
-        for div in divs:
-            header = div.find('h1')
-            if header is not None:
-                # We're in the right title block
-                result.name = header.string.strip()
-                breweryLink = div.find('a')
-                if breweryLink is None:
-                    raise UntappdParseException(
-                            'Could not find expected brewery link in {}'.format(url))
-                result.brewery = breweryLink.string.strip()
-                breweryUrl  = urljoin(response.geturl(), breweryLink['href'])
-                styleP = div.find('p', class_='style')
-                if styleP is not None:
-                    result.style = styleP.string.strip()
-                break
-        if followBrewery:       
-            brewery = parse_brewery(breweryUrl)
-            result.brewery_url = brewery.untappd_url
-        else:
-            result.brewery_url = breweryUrl
-        return result
+    response = fetch_page(url, BEER)
+    soup = make_soup(response.body)
+    result = Beer()
+    divs = soup.find_all('div', class_='name')
+    if len(divs) == 0:
+        raise UntappdParseException("Expected Beer URL at {}".format(url))
+    breweryUrl = None
+    result.untappd_url = response.url
+    for div in divs:
+        header = div.find('h1')
+        if header is not None:
+            # We're in the right title block
+            result.name = header.string.strip()
+            breweryLink = div.find('a')
+            if breweryLink is None:
+                raise UntappdParseException(
+                        'Could not find expected brewery link in {}'.format(url))
+            result.brewery = breweryLink.string.strip()
+            breweryUrl  = urljoin(response.url, breweryLink['href'])
+            styleP = div.find('p', class_='style')
+            if styleP is not None:
+                result.style = styleP.string.strip()
+            break
+    if followBrewery:       
+        brewery = parse_brewery(breweryUrl)
+        result.brewery_url = brewery.untappd_url
+    else:
+        result.brewery_url = breweryUrl
+    return result
 
 def parse_brewery(url):
-    with urlopen(Request(url, headers=HEADERS)) as response:
-        soup = BeautifulSoup(response, "html.parser")
-        result = Brewery()
-        result.untappd_url = response.geturl()
-        divs = soup.find_all('div', class_='name')
-        if len(divs) == 0:
-            raise UntappdParseException("Expected Brewery URL at {}".format(url))
-        for div in divs:
-            header = div.find('h1')
-            if header is not None:
-                result.name = header.string.strip()
-                locationP = div.find('p', class_='brewery')
-                if locationP is not None:
-                    result.location = locationP.string.strip()
-            break
-        return result
+    response = fetch_page(url, BREWERY)
+    soup = make_soup(response.body)
+    result = Brewery()
+    result.untappd_url = response.url
+    divs = soup.find_all('div', class_='name')
+    if len(divs) == 0:
+        raise UntappdParseException("Expected Brewery URL at {}".format(url))
+    for div in divs:
+        header = div.find('h1')
+        if header is not None:
+            result.name = header.string.strip()
+            locationP = div.find('p', class_='brewery')
+            if locationP is not None:
+                result.location = locationP.string.strip()
+        break
+    return result
+
+def canonical_url(url):
+    """
+    Returns the form of a URL that beers and breweries are stored under:
+    without www., a trailing slash, a query or a fragment, and https for
+    Untappd itself. Other URLs, such as file: URLs, are returned unchanged.
+    """
+    parts = urlparse(url)
+    if parts.scheme not in ('http', 'https'):
+        return url
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    scheme = 'https' if host == 'untappd.com' else parts.scheme
+    return urlunparse((scheme, host, parts.path.rstrip('/') or '/', '', '', ''))
+
+def stored_brewery(url):
+    """Returns the Brewery stored for an Untappd URL, or None"""
+    return Brewery.objects.for_untappd_url(url, canonical_url(url))
+
+def stored_beer(url):
+    """
+    Returns the Beer stored for an Untappd URL, or None if there isn't one
+    or it's missing its brewery URL
+    """
+    beer = Beer.objects.for_untappd_url(url, canonical_url(url))
+    if beer is None or not beer.brewery_url:
+        return None
+    return beer
+
+def lookup_brewery(url):
+    """
+    Returns the Brewery stored for an Untappd URL. Only if there isn't one
+    is the page scraped, and the new brewery saved under its canonical URL.
+    """
+    brewery = stored_brewery(url)
+    if brewery is not None:
+        return brewery
+    scraped = parse_brewery(url)
+    scraped.untappd_url = canonical_url(scraped.untappd_url)
+    # The URL may have redirected to a brewery that is already stored
+    brewery = Brewery.objects.for_untappd_url(scraped.untappd_url)
+    if brewery is not None:
+        return brewery
+    logger.info('Storing brewery %s from %s', scraped.name, url)
+    return Brewery.objects.create_brewery(scraped.name, scraped.untappd_url,
+                                          location=scraped.location)
+
+def lookup_beer(url):
+    """
+    Returns the Beer stored for an Untappd URL, as for lookup_brewery. The
+    beer's brewery is looked up the same way, rather than always following
+    the link to its page. A stored beer without a brewery URL is filled in
+    from the scraped page.
+    """
+    beer = Beer.objects.for_untappd_url(url, canonical_url(url))
+    if beer is not None and beer.brewery_url:
+        return beer
+    scraped = parse_beer(url, followBrewery=False)
+    scraped.untappd_url = canonical_url(scraped.untappd_url)
+    scraped.brewery_url = lookup_brewery(scraped.brewery_url).untappd_url
+    if beer is None:
+        beer = Beer.objects.for_untappd_url(scraped.untappd_url)
+    if beer is None:
+        logger.info('Storing beer %s from %s', scraped.name, url)
+        return Beer.objects.create_beer(scraped.name, scraped.brewery,
+                                        untappd_url=scraped.untappd_url,
+                                        style=scraped.style or '',
+                                        brewery_url=scraped.brewery_url)
+    if not beer.brewery_url:
+        beer.brewery_url = scraped.brewery_url
+        beer.last_updated = timezone.now()
+        beer.save(update_fields=['brewery_url', 'last_updated'])
+    return beer
 
 def parse_user(stream):
     pass
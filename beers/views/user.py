@@ -4,7 +4,7 @@ from django.db import transaction
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from beers.models import Player, Contest_Player
+from beers.models import Player, Contest_Player, Player_Feed
 from beers.forms.registration import RegistrationForm, ProfileForm
 
 logger = logging.getLogger(__name__)
@@ -78,6 +78,9 @@ def update_profile(request):
                 for cp in cps:
                     cp.last_checkin_load = cp.contest.start_date
                     cp.save()
+                Player_Feed.objects.invalidate(player)
+                # A new URL deserves a fresh start if the old one was broken
+                Player_Feed.objects.reset_failures(player)
             update_success = True
     # This will include errors if necessary
     return render(request, 'registration/profile.html',
@@ -0,0 +1,67 @@
+# Standalone benchmark comparing the wall time of downloading player RSS feeds
+# one at a time against downloading them through the loader's thread pool.
+# A local HTTP server stands in for Untappd and serves the test checkin feed
+# after an artificial delay.
+#
+# Run from the project root with the usual SECRET_KEY/DATABASE_URL environment:
+#   python benchmarks/feed-fetch.py --players 50 --latency 0.2 --concurrency 1 8 16
+import os
+import sys
+import argparse
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hundred_beers.settings')
+
+import django
+
+django.setup()
+
+from beers.utils.feeds import fetch_feeds
+
+FEED = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'beers', 'tests', 'test-data', 'test-checkins.xml')
+
+parser = argparse.ArgumentParser(description='Benchmark concurrent feed fetching')
+parser.add_argument('--players', type=int, default=50)
+parser.add_argument('--latency', type=float, default=0.2,
+                    help='Seconds the server waits before each response')
+parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+args = parser.parse_args()
+
+with open(FEED, 'rb') as f:
+    body = f.read()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(args.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+threading.Thread(target=httpd.serve_forever, daemon=True).start()
+players = [SimpleNamespace(id=i, untappd_rss='http://127.0.0.1:{}/rss/{}'.format(
+               httpd.server_port, i)) for i in range(args.players)]
+
+print('{} feeds, {:.0f}ms latency'.format(args.players, args.latency * 1000))
+for concurrency in args.concurrency:
+    start = time.perf_counter()
+    entries = 0
+    for player, feed in fetch_feeds(players, concurrency=concurrency,
+                                    conditional=False):
+        entries += sum(1 for _ in feed.entries)
+    elapsed = time.perf_counter() - start
+    print('concurrency {:3d}: {:7.2f}s wall, {} entries'.format(concurrency,
+                                                             elapsed, entries))
+httpd.shutdown()
@@ -0,0 +1,93 @@
+# Standalone benchmark comparing feedparser with the loader's streaming
+# parser, iter_entries, on a large synthetic feed such as an exported
+# history. Each parser runs in its own process so its peak memory can be
+# measured:
+#   feedparser:  feedparser.parse, which builds every entry up front
+#   stream:      iter_entries read to the end
+#   stream-stop: iter_entries stopped after the newest --new entries, as the
+#                loader does once it reaches the last load date
+#
+# Run from the project root with the usual SECRET_KEY/DATABASE_URL environment:
+#   python benchmarks/feed-parse.py --size 50
+import os
+import sys
+import argparse
+import datetime
+import resource
+import subprocess
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hundred_beers.settings')
+
+parser = argparse.ArgumentParser(description='Benchmark parsing a large feed')
+parser.add_argument('--size', type=int, default=50, help='Feed size in MB')
+parser.add_argument('--new', type=int, default=25,
+                    help='Entries read before stream-stop stops')
+parser.add_argument('--feed', help='Feed file to parse instead of generating one')
+parser.add_argument('--mode', choices=['feedparser', 'stream', 'stream-stop'],
+                    help='Parse the feed in this process with one parser')
+args = parser.parse_args()
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_feed(path, size):
+    """Writes a newest first feed of about size MB"""
+    newest = datetime.datetime(2019, 6, 1, tzinfo=datetime.timezone.utc)
+    count = 0
+    with open(path, 'w') as feed:
+        feed.write('<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0">'
+                   + '<channel><title>Untappd</title>\n')
+        while feed.tell() < size * 1024 * 1024:
+            published = newest - datetime.timedelta(minutes=30 * count)
+            link = 'https://untappd.com/user/player/checkin/{}'.format(count)
+            feed.write(('<item><title>{}</title><link>{}</link><guid>{}</guid>'
+                        + '<description>{}</description><pubDate>{}</pubDate>'
+                        + '</item>\n').format(
+                escape('Player is drinking a Beer {} by Brewery {} at Some Bar'.format(
+                    count, count % 50)),
+                link, link,
+                escape("It's a tasty one #tag{}".format(count % 7)),
+                published.strftime('%a, %d %b %Y %H:%M:%S +0000')))
+            count += 1
+        feed.write('</channel></rss>\n')
+    return count
+
+
+if args.mode is not None:
+    import django
+
+    django.setup()
+    import feedparser
+    from beers.utils.feeds import iter_entries
+
+    baseline = max_rss_mb()
+    start = time.perf_counter()
+    if args.mode == 'feedparser':
+        count = len(feedparser.parse(args.feed).entries)
+    else:
+        count = 0
+        for entry in iter_entries(args.feed):
+            count += 1
+            if args.mode == 'stream-stop' and count == args.new:
+                break
+    elapsed = time.perf_counter() - start
+    print('{:12s}: {:8.2f}s, {:8.1f}MB peak memory, {} entries'.format(
+        args.mode, elapsed, max_rss_mb() - baseline, count))
+    sys.exit(0)
+
+with tempfile.TemporaryDirectory() as directory:
+    feed = args.feed
+    if feed is None:
+        feed = os.path.join(directory, 'feed.xml')
+        count = write_feed(feed, args.size)
+        print('{:.1f}MB feed, {} entries'.format(os.path.getsize(feed) / 1024 / 1024,
+                                                 count))
+    for mode in ('feedparser', 'stream', 'stream-stop'):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--feed', feed,
+                        '--mode', mode, '--new', str(args.new)], check=True)
@@ -0,0 +1,103 @@
+# Standalone benchmark for the per-entry cost of walking a player's feed in
+# the checkin loader. A synthetic newest first feed is parsed once up front,
+# then walked for several contests two ways:
+#   before: every contest parses every entry's date and title itself
+#   after:  the entries are parsed once with prepare_entries, stopping at the
+#           earliest last load date, and shared by all of the contests
+# Only the in-memory work is timed; the database is not touched.
+#
+# Run from the project root with the usual SECRET_KEY/DATABASE_URL environment:
+#   python benchmarks/feed-walk.py --entries 10000 --contests 3 --new 25
+import os
+import sys
+import argparse
+import datetime
+import html
+import io
+import time
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hundred_beers.settings')
+
+import django
+
+django.setup()
+
+from beers.utils.feeds import iter_entries
+from beers.utils.checkin import prepare_entries, parse_published, \
+                                RE_HAS_LOC, RE_TITLE, RE_TAGS
+
+parser = argparse.ArgumentParser(description='Benchmark walking feed entries')
+parser.add_argument('--entries', type=int, default=10000)
+parser.add_argument('--contests', type=int, default=3)
+parser.add_argument('--new', type=int, default=25,
+                    help='Entries newer than the last load date')
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+newest = datetime.datetime(2019, 6, 1, tzinfo=datetime.timezone.utc)
+items = []
+for i in range(args.entries):
+    published = newest - datetime.timedelta(minutes=30 * i)
+    items.append(('<item><title>{}</title><link>https://untappd.com/user/u/checkin/{}</link>'
+                  + '<description>{}</description><pubDate>{}</pubDate></item>').format(
+        escape('Player is drinking a Beer {} by Brewery {} at Some Bar'.format(i, i % 50)),
+        i, escape('Tasty #tag{}'.format(i % 7)),
+        published.strftime('%a, %d %b %Y %H:%M:%S +0000')))
+feed = ('<?xml version="1.0"?><rss version="2.0"><channel><title>t</title>'
+        + ''.join(items) + '</channel></rss>')
+entries = list(iter_entries(io.BytesIO(feed.encode('utf-8'))))
+last_load = newest - datetime.timedelta(minutes=30 * args.new) + datetime.timedelta(seconds=1)
+start_date = newest - datetime.timedelta(days=365 * 2)
+end_date = newest + datetime.timedelta(days=1)
+
+
+def before(after_date):
+    found = 0
+    for _ in range(args.contests):
+        for c in entries:
+            dt = parse_published(c.published)
+            if dt < start_date or dt > end_date or dt <= after_date:
+                continue
+            lmatch = RE_HAS_LOC.match(c.title)
+            title = lmatch.group(1) if lmatch else c.title
+            match = RE_TITLE.match(title)
+            if match:
+                match.group('beer').strip(), match.group('brewery').strip()
+                RE_TAGS.findall(html.unescape(c.description))
+                found += 1
+    return found
+
+
+def after(after_date):
+    found = 0
+    shared = prepare_entries(entries, after_date)
+    for _ in range(args.contests):
+        for c in shared:
+            if c.published <= after_date or c.published < start_date:
+                break
+            if c.published > end_date:
+                continue
+            if c.beer is not None:
+                found += 1
+    return found
+
+
+def timed(walk, after_date):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        found = walk(after_date)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, found
+
+
+print('{} entries, {} contests'.format(args.entries, args.contests))
+for label, after_date in (('incremental ({} new)'.format(args.new), last_load),
+                          ('full load', start_date)):
+    for name, walk in (('before', before), ('after', after)):
+        elapsed, found = timed(walk, after_date)
+        print('{:22s} {:6s}: {:8.2f}ms total, {:6.2f}us/entry, {} checkins'.format(
+            label, name, elapsed * 1000, elapsed * 1e6 / args.entries, found))
@@ -0,0 +1,94 @@
+# Standalone benchmark for connection reuse in the shared Untappd client.
+# A local HTTP/1.1 server that keeps connections alive serves an Untappd
+# test page, which is fetched --requests times in a row three ways:
+#   urlopen:  urllib's urlopen, opening a new connection for every request
+#   no reuse: a new UntappdClient, and so a new connection, for every request
+#   reuse:    one UntappdClient, whose pool keeps the connection open
+# --latency adds a delay to every new connection, standing in for the TCP
+# and TLS handshakes that reuse saves on a real network.
+#
+# Run from the project root with the usual SECRET_KEY/DATABASE_URL environment:
+#   python benchmarks/untappd-client.py --requests 500 --latency 0.01
+import os
+import sys
+import argparse
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hundred_beers.settings')
+
+import django
+
+django.setup()
+
+from beers.utils.client import UntappdClient
+
+parser = argparse.ArgumentParser(description='Benchmark Untappd connection reuse')
+parser.add_argument('--requests', type=int, default=500)
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='Seconds added to every new connection')
+args = parser.parse_args()
+
+PAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'beers', 'tests', 'test-data', 'untappd',
+                    'untappd.com-b-saint-arnold-brewing-company-santo-68727')
+with open(PAGE, 'rb') as page:
+    body = page.read()
+connections = [0]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        connections[0] += 1
+        time.sleep(args.latency)
+        super().setup()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+threading.Thread(target=httpd.serve_forever, daemon=True).start()
+url = 'http://127.0.0.1:{}/b/santo/68727'.format(httpd.server_port)
+
+
+def with_urlopen():
+    for _ in range(args.requests):
+        with urlopen(url) as response:
+            response.read()
+
+
+def without_reuse():
+    for _ in range(args.requests):
+        UntappdClient(rate=0).get(url)
+
+
+def with_reuse():
+    client = UntappdClient(rate=0)
+    for _ in range(args.requests):
+        client.get(url)
+
+
+print('{} requests for a {:.1f}KB page, {:.0f}ms per new connection'.format(
+    args.requests, len(body) / 1024, args.latency * 1000))
+for name, fetch in (('urlopen', with_urlopen), ('no reuse', without_reuse),
+                    ('reuse', with_reuse)):
+    connections[0] = 0
+    start = time.perf_counter()
+    fetch()
+    elapsed = time.perf_counter() - start
+    print('{:10s}: {:8.2f}s total, {:6.2f}ms/request, {} connections'.format(
+        name, elapsed, elapsed * 1000 / args.requests, connections[0]))
+httpd.shutdown()
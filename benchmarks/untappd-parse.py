@@ -0,0 +1,82 @@
+# Standalone benchmark for targeted parsing of Untappd pages. Every test
+# page in beers/tests/test-data/untappd is parsed --repeat times by each of
+# the scrapers that can read it, once building the whole page into the soup
+# and once building only the tags the scrapers read. Pages are served from
+# memory, so only parsing is timed.
+#
+# Run from the project root with the usual SECRET_KEY/DATABASE_URL environment:
+#   python benchmarks/untappd-parse.py --repeat 50
+import os
+import sys
+import argparse
+import logging
+import time
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hundred_beers.settings')
+
+import django
+
+django.setup()
+
+from beers.utils import untappd
+from beers.utils.client import HttpResponse
+
+parser = argparse.ArgumentParser(description='Benchmark Untappd page parsing')
+parser.add_argument('--repeat', type=int, default=50)
+args = parser.parse_args()
+# The scrapers log every link they examine
+logging.disable(logging.INFO)
+
+DATA = os.path.join(ROOT, 'beers', 'tests', 'test-data', 'untappd')
+pages = {}
+for name in sorted(os.listdir(DATA)):
+    with open(os.path.join(DATA, name), 'rb') as page:
+        pages[name] = page.read()
+
+PARSERS = (('checkin', untappd.parse_checkin),
+           ('brewery', untappd.parse_brewery),
+           ('beer', lambda url: untappd.parse_beer(url, followBrewery=False)))
+
+
+def fetch_page(url, kind):
+    return HttpResponse(url, 200, {}, pages[url])
+
+
+def parseable(name):
+    """The scrapers that read a page without raising"""
+    result = []
+    for kind, parse in PARSERS:
+        try:
+            parse(name)
+            result.append((kind, parse))
+        except Exception:
+            pass
+    return result
+
+
+def run(name, parse):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        parse(name)
+    return (time.perf_counter() - start) * 1000 / args.repeat
+
+
+with patch.object(untappd, 'fetch_page', fetch_page):
+    totals = [0, 0]
+    print('{:50s} {:8s} {:>9s} {:>9s} {:>8s}'.format(
+        'page', 'parser', 'full', 'targeted', 'speedup'))
+    for name, body in pages.items():
+        for kind, parse in parseable(name):
+            with patch.object(untappd, 'STRAINER', None), \
+                    patch.object(untappd, 'TITLE_STRAINER', None):
+                full = run(name, parse)
+            targeted = run(name, parse)
+            totals[0] += full
+            totals[1] += targeted
+            print('{:50s} {:8s} {:7.2f}ms {:7.2f}ms {:7.1f}x'.format(
+                name[:50], kind, full, targeted, full / targeted))
+    print('{:50s} {:8s} {:7.2f}ms {:7.2f}ms {:7.1f}x'.format(
+        'total', '', totals[0], totals[1], totals[0] / totals[1]))
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -123,6 +124,57 @@ USE_TZ = True
 # ARN for Role that the loader should take on
 LOADER_ROLE_ARN = os.getenv("LOADER_ROLE_ARN")
 
+# The number of player RSS feeds the checkin loader downloads at once
+CHECKIN_LOADER_CONCURRENCY = int(os.getenv("CHECKIN_LOADER_CONCURRENCY", default="8"))
+
+# The bounds, in seconds, on how often poll_checkins polls a player's feed.
+# Players with new checkins are polled at the minimum and idle players back
+# off towards the maximum.
+CHECKIN_POLL_MIN_INTERVAL = int(os.getenv("CHECKIN_POLL_MIN_INTERVAL", default="300"))
+CHECKIN_POLL_MAX_INTERVAL = int(os.getenv("CHECKIN_POLL_MAX_INTERVAL", default="21600"))
+
+# The number of seconds to wait on a single feed download, and the bounds, in
+# seconds, on how long a feed that keeps failing is skipped for
+CHECKIN_FEED_TIMEOUT = int(os.getenv("CHECKIN_FEED_TIMEOUT", default="10"))
+CHECKIN_FEED_BACKOFF = int(os.getenv("CHECKIN_FEED_BACKOFF", default="300"))
+CHECKIN_FEED_MAX_BACKOFF = int(os.getenv("CHECKIN_FEED_MAX_BACKOFF", default="86400"))
+
+# Feed downloads are limited to this many a second on average, separately
+# from the limit on Untappd pages below. 0 leaves them limited only by the
+# loader's concurrency.
+CHECKIN_FEED_REQUESTS_PER_SECOND = float(os.getenv("CHECKIN_FEED_REQUESTS_PER_SECOND",
+                                                   default="0"))
+
+# The number of seconds either side of a contest's dates that checkins are
+# still loaded for it, so checkins that show up late in a feed are kept
+CHECKIN_CONTEST_GRACE = int(os.getenv("CHECKIN_CONTEST_GRACE", default="86400"))
+
+# The number of seconds a worker has to finish a queued job it has claimed,
+# after which the job is marked as failed, e.g. because the worker died
+JOB_LEASE = int(os.getenv("JOB_LEASE", default="600"))
+
+# Requests to Untappd are limited to this many a second on average, in
+# bursts of up to UNTAPPD_BURST, and transient failures are retried up to
+# UNTAPPD_RETRIES times after a random pause growing from
+# UNTAPPD_RETRY_BACKOFF seconds
+UNTAPPD_REQUESTS_PER_SECOND = float(os.getenv("UNTAPPD_REQUESTS_PER_SECOND", default="5"))
+UNTAPPD_BURST = int(os.getenv("UNTAPPD_BURST", default="10"))
+UNTAPPD_RETRIES = int(os.getenv("UNTAPPD_RETRIES", default="3"))
+UNTAPPD_RETRY_BACKOFF = float(os.getenv("UNTAPPD_RETRY_BACKOFF", default="0.5"))
+
+# The directory of the on-disk cache of Untappd beer, brewery and checkin
+# pages, which is turned off if empty, its size in bytes, and how many
+# seconds each kind of page is kept
+UNTAPPD_CACHE_DIR = os.getenv("UNTAPPD_CACHE_DIR",
+                              default=os.path.join(tempfile.gettempdir(),
+                                                   'onehundredbeers-untappd'))
+UNTAPPD_CACHE_MAX_SIZE = int(os.getenv("UNTAPPD_CACHE_MAX_SIZE", default="104857600"))
+UNTAPPD_CACHE_TTLS = {
+    'beer': int(os.getenv("UNTAPPD_CACHE_BEER_TTL", default="604800")),
+    'brewery': int(os.getenv("UNTAPPD_CACHE_BREWERY_TTL", default="2592000")),
+    'checkin': int(os.getenv("UNTAPPD_CACHE_CHECKIN_TTL", default="86400")),
+}
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
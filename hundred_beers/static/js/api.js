@@ -1,5 +1,51 @@
 var Contests = {
 
+    waitForJob: function(request, interval, maxPolls) {
+        // Returns a Promise for what a request resolves to. Requests that
+        // are answered with 202 Accepted and a scrape job are resolved
+        // with the job's result once the job is done, by polling it, or
+        // rejected with the job's errors as the responseText, the same as
+        // a request that failed validation. The job is polled at most
+        // maxPolls times before giving up with a 504.
+        interval = interval || 1000;
+        maxPolls = maxPolls || 120;
+        let polls = 0;
+        let deferred = $.Deferred();
+        let poll = function (job) {
+            if (job.status == 'done') {
+                deferred.resolve(job.result);
+            } else if (job.status == 'failed') {
+                deferred.reject({ status: 400,
+                                  responseText: JSON.stringify(job.errors) });
+            } else if (polls >= maxPolls) {
+                deferred.reject({ status: 504,
+                                  responseText: JSON.stringify({
+                                      non_field_errors: [
+                                          'Timed out waiting for Untappd'] }) });
+            } else {
+                polls += 1;
+                setTimeout(function () {
+                    $.ajax({
+                        url: job.url,
+                        headers: { Accept: 'application/json' },
+                        method: 'GET',
+                    }).then(poll, deferred.reject);
+                }, interval);
+            }
+        };
+        request.then(
+            function (data, textStatus, jqXHR) {
+                if (jqXHR.status == 202) {
+                    poll(data);
+                } else {
+                    deferred.resolve(data);
+                }
+            },
+            deferred.reject
+        );
+        return deferred.promise();
+    },
+
     init: function(baseUrl, contestId) {
         // Returns a contest object that provides access to the data 
         // specific to the contest.
@@ -29,13 +75,13 @@ var Contests = {
             addUnvalidatedCheckin: function(untappdUrl) {
                 let url = this.baseUrl + 'api/contests/' 
                                        + contestId + '/unvalidated_checkins';
-                return $.ajax({
+                return Contests.waitForJob($.ajax({
                   url: url,
                   headers: { Accept: 'application/json' },
                   data: { 'untappd_checkin': untappdUrl },
                   method: 'POST',
                   contestType: 'application/json',
-                })
+                }))
             },
 
             deleteUnvalidatedCheckin: function (uvId) {
@@ -208,25 +254,25 @@ var Contests = {
 
             lookupBeer: function(untappdUrl) {
               let url = this.baseUrl + 'api/lookup/beer';
-              return $.ajax({
+              return Contests.waitForJob($.ajax({
                 url: url,
                 data: { 'url': untappdUrl, },
                 headers: { Accept: 'application/json' },
                 contentType: 'application/json',
                 method: 'GET',
-              })
+              }))
             },
                         
             lookupBrewery: function(untappdUrl) {
               let url = this.baseUrl + 'api/lookup/brewery';
               console.log('Looking up brewery at URL: ' + untappdUrl);
-              return $.ajax({
+              return Contests.waitForJob($.ajax({
                 url: url,
                 data: { 'url': untappdUrl, },
                 headers: { Accept: 'application/json' },
                 contentType: 'application/json',
                 method: 'GET',
-              })
+              }))
             },
         }
     }
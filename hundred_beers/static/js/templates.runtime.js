@@ -192,8 +192,8 @@ templates['validation_grid'] = template({"1":function(container,depth0,helpers,p
 },"3":function(container,depth0,helpers,partials,data) {
     var stack1, alias1=container.lambda, alias2=container.escapeExpression;
 
-  return "    <option value=\"beer:"
-    + alias2(alias1(((stack1 = (depth0 != null ? depth0.checkin : depth0)) != null ? stack1.possible_id : stack1), depth0))
+  return "    <option value=\""
+    + alias2(alias1(((stack1 = (depth0 != null ? depth0.checkin : depth0)) != null ? stack1.possible_value : stack1), depth0))
     + "\">"
     + alias2(alias1(((stack1 = (depth0 != null ? depth0.checkin : depth0)) != null ? stack1.possible_name : stack1), depth0))
     + "</option>\n";
@@ -235,7 +235,7 @@ templates['validation_grid'] = template({"1":function(container,depth0,helpers,p
     + "</em>\n     </a>\n  </div>\n  <div class=\"validation-selection\">\n    <select id=\"id_"
     + alias2(alias1(((stack1 = (depth0 != null ? depth0.checkin : depth0)) != null ? stack1.id : stack1), depth0))
     + "_select\" class=\"beer-select\" style=\"width: 100%;\">\n"
-    + ((stack1 = helpers["if"].call(alias3,((stack1 = (depth0 != null ? depth0.checkin : depth0)) != null ? stack1.possible_id : stack1),{"name":"if","hash":{},"fn":container.program(3, data, 0, blockParams, depths),"inverse":container.program(5, data, 0, blockParams, depths),"data":data})) != null ? stack1 : "")
+    + ((stack1 = helpers["if"].call(alias3,((stack1 = (depth0 != null ? depth0.checkin : depth0)) != null ? stack1.possible_value : stack1),{"name":"if","hash":{},"fn":container.program(3, data, 0, blockParams, depths),"inverse":container.program(5, data, 0, blockParams, depths),"data":data})) != null ? stack1 : "")
     + "    </select>\n  </div>\n  <div class=\"validation-bonuses\">\n"
     + ((stack1 = helpers.each.call(alias3,(depth0 != null ? depth0.bonuses : depth0),{"name":"each","hash":{},"fn":container.program(7, data, 0, blockParams, depths),"inverse":container.noop,"data":data})) != null ? stack1 : "")
     + "  </div>\n  <div class=\"validation-button\">\n    <span>\n    <button type=\"button\" id=\"id_"
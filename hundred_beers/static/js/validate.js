@@ -27,13 +27,29 @@ var Validate = {
       }
     },
 
+    possibleMatch: function(contest, checkin) {
+        // The contest beer, or failing that the contest brewery, that the
+        // checkin was flagged as a possible match for
+        let beer = (contest.beers || []).find(b =>
+                (checkin.beer == b.name && checkin.brewery == b.brewery));
+        if (beer) {
+            return { value: 'beer:' + beer.id, name: beer.name };
+        }
+        let brewery = (contest.breweries || []).find(b => checkin.brewery == b.name);
+        if (brewery) {
+            return { value: 'brewery:' + brewery.id, name: brewery.name };
+        }
+        return null;
+    },
+
     addRow: function(contest, checkin, even=true, updateSelect=true) {
         if (checkin.has_possibles) {
-            let beer = contest.beers.find(b => 
-                    (checkin.beer == b.name && checkin.brewery && b.brewery));
-            checkin.possible_id = beer.id;
-            checkin.any_possible = true;
-            checkin.possible_name = beer.name;
+            let match = this.possibleMatch(contest, checkin);
+            if (match) {
+                checkin.possible_value = match.value;
+                checkin.any_possible = true;
+                checkin.possible_name = match.name;
+            }
         }
         if (checkin.possible_bonuses) {
             checkin.any_possible = true;